@@ -0,0 +1,166 @@
+# offline benchmark matrix:
+#   python -m benchmarks --num_illusts 1000,10000 --existing_ratios 0,0.5,0.9
+# every scenario runs in fresh processes against a local image server
+# and, for s3, a fresh in-memory S3 stub
+import json
+import subprocess
+import sys
+from argparse import ArgumentParser
+from collections.abc import Iterator
+from contextlib import contextmanager
+from itertools import product
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
+
+
+def parse_list(value: str) -> list[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+@contextmanager
+def start_server(module: str, *args: str) -> Iterator[int]:
+    process = subprocess.Popen(
+        [sys.executable, "-m", module, "--port", "0", *args],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert process.stdout is not None
+        # the server prints its port on the first line
+        yield int(process.stdout.readline())
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run_scenario(
+    storage_type: str,
+    mode: str,
+    num_illusts: int,
+    existing_ratio: float,
+    image_base_url: str,
+    args: Any,
+) -> dict[str, Any]:
+    with (
+        TemporaryDirectory() as _work_dir,
+        start_server("benchmarks.s3_stub") as s3_port,
+    ):
+        work_dir = Path(_work_dir)
+
+        scenario_args = [
+            "--work_dir",
+            str(work_dir),
+            "--storage_type",
+            storage_type,
+            "--root_dir",
+            str(work_dir / "storage"),
+            "--s3_endpoint_url",
+            f"http://127.0.0.1:{s3_port}",
+            "--image_base_url",
+            image_base_url,
+            "--mode",
+            mode,
+            "--num_illusts",
+            str(num_illusts),
+            "--existing_ratio",
+            str(existing_ratio),
+            "--max_pages",
+            str(args.max_pages),
+            "--num_users",
+            str(args.num_users),
+            "--image_size",
+            str(args.image_size),
+            "--download_concurrency",
+            str(args.download_concurrency),
+        ]
+        if args.manifest:
+            scenario_args.append("--manifest")
+        if args.packed_meta:
+            scenario_args.append("--packed_meta")
+        if args.incremental:
+            scenario_args.append("--incremental")
+
+        subprocess.run(
+            [sys.executable, "-m", "benchmarks.scenario", "prepare", *scenario_args],
+            check=True,
+        )
+        completed = subprocess.run(
+            [sys.executable, "-m", "benchmarks.scenario", "run", *scenario_args],
+            check=True,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+
+    result: dict[str, Any] = json.loads(completed.stdout.splitlines()[-1])
+
+    return result
+
+
+def format_row(result: dict[str, Any]) -> str:
+    return (
+        f"{result['storage_type']:<10} {result['mode']:<4} "
+        f"{result['num_illusts']:>7} {result['existing_ratio']:>5.2f} "
+        f"{result['num_new_illusts']:>7} {result['elapsed_seconds']:>8.2f} "
+        f"{result['new_illusts_per_second']:>9.1f} "
+        f"{result['uploaded_bytes_per_second'] / 1024 / 1024:>8.1f} "
+        f"{result['storage_ops_per_scanned_illust']:>8.2f} "
+        f"{result['peak_rss_kib'] / 1024:>8.1f}"
+    )
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--storage_types", type=parse_list, default="filesystem,s3")
+    parser.add_argument("--modes", type=parse_list, default="desc,asc")
+    parser.add_argument("--num_illusts", type=parse_list, default="1000,10000")
+    parser.add_argument("--existing_ratios", type=parse_list, default="0,0.5,0.9")
+    parser.add_argument("--max_pages", type=int, default=3)
+    parser.add_argument(
+        "--num_users", type=int, default=97, help="users posting the illusts"
+    )
+    parser.add_argument("--image_size", type=int, default=32 * 1024)
+    parser.add_argument("--download_concurrency", type=int, default=8)
+    parser.add_argument("--manifest", action="store_true")
+    parser.add_argument("--packed_meta", action="store_true")
+    parser.add_argument("--incremental", action="store_true")
+    parser.add_argument(
+        "--output", type=str, default=None, help="write results as JSON lines"
+    )
+    args = parser.parse_args()
+
+    print(
+        f"{'storage':<10} {'mode':<4} {'illusts':>7} {'exist':>5} {'new':>7} "
+        f"{'seconds':>8} {'illust/s':>9} {'MiB/s':>8} {'ops/ill':>8} {'rss MiB':>8}",
+        flush=True,
+    )
+
+    results = []
+    with start_server(
+        "benchmarks.image_server", "--image_size", str(args.image_size)
+    ) as image_port:
+        image_base_url = f"http://127.0.0.1:{image_port}"
+
+        for storage_type, mode, num_illusts, existing_ratio in product(
+            args.storage_types, args.modes, args.num_illusts, args.existing_ratios
+        ):
+            result = run_scenario(
+                storage_type=storage_type,
+                mode=mode,
+                num_illusts=int(num_illusts),
+                existing_ratio=float(existing_ratio),
+                image_base_url=image_base_url,
+                args=args,
+            )
+            results.append(result)
+
+            print(format_row(result), flush=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as fp:
+            for result in results:
+                fp.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
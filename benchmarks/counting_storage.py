@@ -0,0 +1,78 @@
+from collections import Counter
+from collections.abc import AsyncIterable, AsyncIterator, Iterable
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+from xivbookmarkdl.storage.base import Storage, StorageObject
+
+
+# storage proxy counting operations and uploaded bytes
+class CountingStorage(Storage):
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self.link_shares_data = storage.link_shares_data
+
+        self.op_counts: Counter[str] = Counter()
+        self.uploaded_bytes = 0
+
+    @property
+    def num_ops(self) -> int:
+        return sum(self.op_counts.values())
+
+    async def delete(self, key: str) -> None:
+        self.op_counts["delete"] += 1
+        await self.storage.delete(key=key)
+
+    async def close(self) -> None:
+        await self.storage.close()
+
+    async def iter_with_prefix(self, prefix: str) -> AsyncIterator[str]:
+        self.op_counts["list"] += 1
+        async for key in self.storage.iter_with_prefix(prefix=prefix):
+            yield key
+
+    async def list_tree(self, prefix: str) -> AsyncIterator[StorageObject]:
+        self.op_counts["list"] += 1
+        async for obj in self.storage.list_tree(prefix=prefix):
+            yield obj
+
+    async def exists_many(self, keys: Iterable[str]) -> set[str]:
+        self.op_counts["exists_many"] += 1
+        return await self.storage.exists_many(keys=keys)
+
+    @asynccontextmanager
+    async def download(self, key: str) -> AsyncIterator[Path]:
+        self.op_counts["download"] += 1
+        async with self.storage.download(key=key) as file:
+            yield file
+
+    async def upload(self, source_path: Path, dest_key: str) -> StorageObject:
+        self.op_counts["upload"] += 1
+        obj = await self.storage.upload(source_path=source_path, dest_key=dest_key)
+        self.uploaded_bytes += obj.size
+
+        return obj
+
+    async def upload_stream(
+        self, dest_key: str, chunks: AsyncIterable[bytes]
+    ) -> StorageObject:
+        self.op_counts["upload_stream"] += 1
+        obj = await self.storage.upload_stream(dest_key=dest_key, chunks=chunks)
+        self.uploaded_bytes += obj.size
+
+        return obj
+
+    async def read_bytes(self, key: str) -> bytes:
+        self.op_counts["read_bytes"] += 1
+        return await self.storage.read_bytes(key=key)
+
+    async def upload_bytes(self, dest_key: str, data: bytes) -> StorageObject:
+        self.op_counts["upload_bytes"] += 1
+        obj = await self.storage.upload_bytes(dest_key=dest_key, data=data)
+        self.uploaded_bytes += len(data)
+
+        return obj
+
+    async def link(self, source_key: str, dest_key: str) -> StorageObject:
+        self.op_counts["link"] += 1
+        return await self.storage.link(source_key=source_key, dest_key=dest_key)
@@ -0,0 +1,208 @@
+import json
+from datetime import UTC, datetime, timedelta
+from typing import Any
+from urllib.parse import quote
+
+from pixivpy3 import AppPixivAPI
+from pixivpy3.utils import ParamDict, ParsedJson
+
+# illusts are created an hour apart from this date in the order of their ids
+CREATE_DATE_EPOCH = datetime(2020, 1, 1, tzinfo=UTC)
+
+
+def make_illust(
+    illust_id: int,
+    image_base_url: str,
+    max_pages: int,
+    num_users: int,
+) -> dict[str, Any]:
+    # deterministic synthetic illust, newer illusts have larger ids
+    page_count = illust_id % max_pages + 1
+    user_id = illust_id % num_users + 1
+
+    image_urls = [
+        f"{image_base_url}/img/{user_id}/{illust_id}_p{page}.png"
+        for page in range(page_count)
+    ]
+    create_date = CREATE_DATE_EPOCH + timedelta(hours=illust_id)
+
+    return {
+        "id": illust_id,
+        "title": f"illust {illust_id}",
+        "type": "illust",
+        "create_date": create_date.isoformat(),
+        "page_count": page_count,
+        "user": {"id": user_id, "name": f"user {user_id}"},
+        "meta_single_page": (
+            {"original_image_url": image_urls[0]} if page_count == 1 else {}
+        ),
+        "meta_pages": (
+            [{"image_urls": {"original": image_url}} for image_url in image_urls]
+            if page_count > 1
+            else []
+        ),
+    }
+
+
+# AppPixivAPI serving synthetic paginated results without network access.
+# images are fetched by the inherited requests_call from the local image server
+class FakeAppPixivAPI(AppPixivAPI):
+    def __init__(
+        self,
+        num_illusts: int,
+        image_base_url: str,
+        max_pages: int = 3,
+        num_users: int = 97,
+        page_size: int = 30,
+    ):
+        super().__init__()
+
+        self.num_illusts = num_illusts
+        self.image_base_url = image_base_url
+        self.max_pages = max_pages
+        self.num_users = num_users
+        self.page_size = page_size
+
+        self.num_api_calls = 0
+
+    def auth(
+        self,
+        username: str | None = None,
+        password: str | None = None,
+        refresh_token: str | None = None,
+        headers: ParamDict = None,
+    ) -> ParsedJson:
+        return self.parse_json(
+            json.dumps(
+                {
+                    "response": {
+                        "access_token": "benchmark",
+                        "refresh_token": "benchmark",
+                        "expires_in": 3600,
+                        "user": {"id": "1"},
+                    }
+                }
+            )
+        )
+
+    def _get_page(
+        self,
+        offset: int,
+        desc: bool,
+        next_url_format: str,
+        first_illust_id: int = 1,
+        last_illust_id: int | None = None,
+    ) -> ParsedJson:
+        self.num_api_calls += 1
+
+        # illusts from first_illust_id to last_illust_id in asc order
+        if last_illust_id is None:
+            last_illust_id = self.num_illusts
+        num_illusts = max(
+            min(last_illust_id, self.num_illusts) - first_illust_id + 1, 0
+        )
+        if desc:
+            illust_ids = range(
+                self.num_illusts - offset,
+                max(self.num_illusts - offset - self.page_size, 0),
+                -1,
+            )
+        else:
+            illust_ids = range(
+                first_illust_id + offset,
+                first_illust_id + min(offset + self.page_size, num_illusts),
+            )
+
+        next_offset = offset + self.page_size
+        next_url = (
+            next_url_format.format(
+                offset=next_offset, max_illust_id=self.num_illusts - next_offset
+            )
+            if next_offset < num_illusts
+            else None
+        )
+
+        return self.parse_json(
+            json.dumps(
+                {
+                    "illusts": [
+                        make_illust(
+                            illust_id=illust_id,
+                            image_base_url=self.image_base_url,
+                            max_pages=self.max_pages,
+                            num_users=self.num_users,
+                        )
+                        for illust_id in illust_ids
+                    ],
+                    "next_url": next_url,
+                }
+            )
+        )
+
+    def user_bookmarks_illust(
+        self,
+        user_id: int | str,
+        restrict: str = "public",
+        filter: str = "for_ios",
+        max_bookmark_id: int | str | None = None,
+        tag: str | None = None,
+        req_auth: bool = True,
+    ) -> ParsedJson:
+        # newest first, bookmark ids are the illust ids
+        # and max_bookmark_id is the newest one of the page
+        offset = 0
+        if max_bookmark_id:
+            offset = self.num_illusts - int(max_bookmark_id)
+
+        return self._get_page(
+            offset=offset,
+            desc=True,
+            next_url_format=(
+                "https://app-api.pixiv.net/v1/user/bookmarks/illust"
+                f"?user_id={user_id}&restrict={restrict}"
+                "&max_bookmark_id={max_illust_id}"
+            ),
+        )
+
+    def search_illust(
+        self,
+        word: str,
+        search_target: str = "partial_match_for_tags",
+        sort: str = "date_desc",
+        duration: str | None = None,
+        start_date: str | None = None,
+        end_date: str | None = None,
+        filter: str = "for_ios",
+        search_ai_type: Any = None,
+        offset: int | str | None = None,
+        req_auth: bool = True,
+    ) -> ParsedJson:
+        # start_date and end_date are applied to asc results only, in UTC
+        first_illust_id = 1
+        if start_date:
+            start_datetime = datetime.fromisoformat(start_date).replace(tzinfo=UTC)
+            first_illust_id = max(
+                int((start_datetime - CREATE_DATE_EPOCH) / timedelta(hours=1)), 1
+            )
+        last_illust_id = None
+        if end_date:
+            end_datetime = datetime.fromisoformat(end_date).replace(
+                tzinfo=UTC
+            ) + timedelta(days=1)
+            last_illust_id = (
+                int((end_datetime - CREATE_DATE_EPOCH) / timedelta(hours=1)) - 1
+            )
+
+        return self._get_page(
+            offset=int(offset or 0),
+            desc=sort != "date_asc",
+            next_url_format=(
+                "https://app-api.pixiv.net/v1/search/illust"
+                f"?word={quote(word)}&search_target={search_target}&sort={sort}"
+                + (f"&start_date={start_date}" if start_date else "")
+                + (f"&end_date={end_date}" if end_date else "")
+                + "&offset={offset}"
+            ),
+            first_illust_id=first_illust_id,
+            last_illust_id=last_illust_id,
+        )
@@ -0,0 +1,49 @@
+# HTTP server serving synthetic image bytes of a fixed size at any path
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class ImageServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address: tuple[str, int], image_size: int):
+        super().__init__(server_address, ImageHandler)
+        self.image_size = image_size
+        self.padding = bytes(range(256)) * (image_size // 256 + 1)
+
+
+class ImageHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: ImageServer
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        # prefix with the path so that every image has different content
+        body = (self.path.encode() + self.server.padding)[: self.server.image_size]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        self.wfile.write(body)
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--port", type=int, default=0)
+    parser.add_argument("--image_size", type=int, default=32 * 1024)
+    args = parser.parse_args()
+
+    server = ImageServer(("127.0.0.1", args.port), image_size=args.image_size)
+
+    # the parent process reads the port from the first line
+    print(server.server_address[1], flush=True)
+
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
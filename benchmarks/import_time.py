@@ -0,0 +1,107 @@
+# import time regression check of the CLI:
+#   python -m benchmarks.import_time --max_milliseconds 500
+# imports the CLI in fresh processes, reports the best import time
+# and fails when a lazily imported module is loaded or the budget is exceeded
+import json
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+# imported only when a subcommand needs them
+LAZY_MODULES = "boto3,botocore,s3transfer,pixivpy3,requests"
+
+
+def parse_list(value: str) -> list[str]:
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def measure_import(module: str) -> tuple[float, list[str]]:
+    # returns the cumulative import time in seconds and the loaded modules
+    completed = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import json, sys, {module}; print(json.dumps(sorted(sys.modules)))",
+        ],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+    # import time: self [us] | cumulative | imported package
+    for line in completed.stderr.splitlines():
+        fields = [
+            field.strip() for field in line.removeprefix("import time:").split("|")
+        ]
+        if len(fields) == 3 and fields[2] == module:
+            loaded_modules: list[str] = json.loads(completed.stdout.splitlines()[-1])
+
+            return int(fields[1]) / 1_000_000, loaded_modules
+
+    raise RuntimeError(f"Import time of {module} is not reported")
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--module", type=str, default="xivbookmarkdl.cli")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--lazy_modules", type=parse_list, default=LAZY_MODULES)
+    parser.add_argument(
+        "--max_milliseconds",
+        type=float,
+        default=None,
+        help="fail when the best import time exceeds this",
+    )
+    args = parser.parse_args()
+
+    # the best of fresh processes is the least noisy
+    measurements = [measure_import(args.module) for _ in range(args.repeat)]
+    import_seconds = min(seconds for seconds, _ in measurements)
+    loaded_modules = set(measurements[0][1])
+
+    eager_modules = [
+        lazy_module
+        for lazy_module in args.lazy_modules
+        if lazy_module in loaded_modules
+    ]
+
+    print(
+        json.dumps(
+            {
+                "module": args.module,
+                "import_milliseconds": import_seconds * 1000,
+                "num_loaded_modules": len(loaded_modules),
+                "eager_modules": eager_modules,
+            }
+        ),
+        flush=True,
+    )
+
+    failed = False
+    if eager_modules:
+        print(
+            f"Lazily imported modules are loaded by {args.module}: "
+            f"{', '.join(eager_modules)}",
+            file=sys.stderr,
+        )
+        failed = True
+
+    if (
+        args.max_milliseconds is not None
+        and import_seconds * 1000 > args.max_milliseconds
+    ):
+        print(
+            f"Import time of {args.module} exceeds {args.max_milliseconds} ms: "
+            f"{import_seconds * 1000:.1f} ms",
+            file=sys.stderr,
+        )
+        failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
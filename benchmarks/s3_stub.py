@@ -0,0 +1,299 @@
+# in-memory S3-compatible server for benchmarks,
+# covering only the operations used by StorageS3 (path-style, no authentication)
+import hashlib
+import threading
+from argparse import ArgumentParser
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from uuid import uuid4
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+S3_XMLNS = "http://s3.amazonaws.com/doc/2006-03-01/"
+
+
+@dataclass
+class S3StubObject:
+    body: bytes
+    etag: str
+
+
+@dataclass
+class S3StubState:
+    objects: dict[str, S3StubObject] = field(default_factory=dict)
+    uploads: dict[str, dict[int, bytes]] = field(default_factory=dict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+class S3StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address: tuple[str, int]):
+        super().__init__(server_address, S3StubHandler)
+        self.state = S3StubState()
+
+
+class S3StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: S3StubServer
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def _parse_path(self) -> tuple[str, dict[str, list[str]]]:
+        parsed = urlsplit(self.path)
+        # /{bucket}/{key}, objects of all buckets share one namespace
+        _, _, key = unquote(parsed.path).lstrip("/").partition("/")
+
+        return key, parse_qs(parsed.query, keep_blank_values=True)
+
+    def _read_chunked(self) -> bytes:
+        # HTTP chunked encoding, also used by aws-chunked bodies with trailers
+        body = bytearray()
+        while True:
+            size_line = self.rfile.readline().strip()
+            size = int(size_line.split(b";")[0], 16)
+            if size == 0:
+                break
+
+            body += self.rfile.read(size)
+            self.rfile.readline()
+
+        # trailers until an empty line
+        while self.rfile.readline().strip():
+            pass
+
+        return bytes(body)
+
+    def _read_body(self) -> bytes:
+        if "chunked" in (self.headers.get("Transfer-Encoding") or ""):
+            return self._read_chunked()
+
+        content_length = int(self.headers.get("Content-Length") or 0)
+
+        return self.rfile.read(content_length)
+
+    def _send(
+        self,
+        status: int,
+        body: bytes = b"",
+        headers: dict[str, str] | None = None,
+        include_body: bool = True,
+    ) -> None:
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+
+        if include_body:
+            self.wfile.write(body)
+
+    def _send_xml(self, status: int, xml: str) -> None:
+        self._send(
+            status,
+            f'<?xml version="1.0" encoding="UTF-8"?>{xml}'.encode(),
+            headers={"Content-Type": "application/xml"},
+        )
+
+    def _send_not_found(self, key: str, include_body: bool = True) -> None:
+        if not include_body:
+            self._send(404, include_body=False)
+            return
+
+        self._send_xml(
+            404,
+            "<Error><Code>NoSuchKey</Code>"
+            f"<Message>The specified key does not exist.</Message>"
+            f"<Key>{escape(key)}</Key></Error>",
+        )
+
+    def do_PUT(self) -> None:
+        key, query = self._parse_path()
+        body = self._read_body()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+
+        copy_source = self.headers.get("x-amz-copy-source")
+        if copy_source is not None:
+            self._copy_object(key=key, copy_source=copy_source)
+            return
+
+        state = self.server.state
+        with state.lock:
+            if "uploadId" in query:
+                parts = state.uploads.get(query["uploadId"][0])
+                if parts is None:
+                    self._send_not_found(key)
+                    return
+
+                parts[int(query["partNumber"][0])] = body
+            else:
+                state.objects[key] = S3StubObject(body=body, etag=etag)
+
+        self._send(200, headers={"ETag": etag})
+
+    def _copy_object(self, key: str, copy_source: str) -> None:
+        # {bucket}/{key}, objects of all buckets share one namespace
+        _, _, source_key = unquote(copy_source).lstrip("/").partition("/")
+
+        state = self.server.state
+        with state.lock:
+            source_obj = state.objects.get(source_key)
+            if source_obj is None:
+                self._send_not_found(source_key)
+                return
+
+            state.objects[key] = S3StubObject(
+                body=source_obj.body, etag=source_obj.etag
+            )
+
+        self._send_xml(
+            200,
+            f'<CopyObjectResult xmlns="{S3_XMLNS}">'
+            f"<ETag>{escape(source_obj.etag)}</ETag></CopyObjectResult>",
+        )
+
+    def do_POST(self) -> None:
+        key, query = self._parse_path()
+        body = self._read_body()
+
+        state = self.server.state
+        if "uploads" in query:
+            upload_id = uuid4().hex
+            with state.lock:
+                state.uploads[upload_id] = {}
+
+            self._send_xml(
+                200,
+                f'<InitiateMultipartUploadResult xmlns="{S3_XMLNS}">'
+                f"<Key>{escape(key)}</Key><UploadId>{upload_id}</UploadId>"
+                "</InitiateMultipartUploadResult>",
+            )
+            return
+
+        upload_id = query["uploadId"][0]
+        part_numbers = [
+            int(element.text or "0")
+            for element in ElementTree.fromstring(body).iter(
+                f"{{{S3_XMLNS}}}PartNumber"
+            )
+        ]
+
+        with state.lock:
+            parts = state.uploads.pop(upload_id, None)
+            if parts is None:
+                self._send_not_found(key)
+                return
+
+            object_body = b"".join(parts[part_number] for part_number in part_numbers)
+            etag = f'"{hashlib.md5(object_body).hexdigest()}-{len(part_numbers)}"'
+            state.objects[key] = S3StubObject(body=object_body, etag=etag)
+
+        self._send_xml(
+            200,
+            f'<CompleteMultipartUploadResult xmlns="{S3_XMLNS}">'
+            f"<Key>{escape(key)}</Key><ETag>{escape(etag)}</ETag>"
+            "</CompleteMultipartUploadResult>",
+        )
+
+    def do_DELETE(self) -> None:
+        key, query = self._parse_path()
+
+        state = self.server.state
+        with state.lock:
+            if "uploadId" in query:
+                state.uploads.pop(query["uploadId"][0], None)
+            else:
+                state.objects.pop(key, None)
+
+        self._send(204)
+
+    def do_HEAD(self) -> None:
+        self._get_object(include_body=False)
+
+    def do_GET(self) -> None:
+        key, query = self._parse_path()
+        if query.get("list-type") == ["2"]:
+            self._list_objects(query=query)
+            return
+
+        self._get_object(include_body=True)
+
+    def _get_object(self, include_body: bool) -> None:
+        key, _ = self._parse_path()
+
+        with self.server.state.lock:
+            obj = self.server.state.objects.get(key)
+
+        if obj is None:
+            self._send_not_found(key, include_body=include_body)
+            return
+
+        body = obj.body
+        status = 200
+        headers = {"ETag": obj.etag, "Accept-Ranges": "bytes"}
+
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            start_string, _, end_string = range_header[len("bytes=") :].partition("-")
+            start = int(start_string)
+            end = int(end_string) if end_string else len(body) - 1
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+            body = body[start : end + 1]
+            status = 206
+
+        self._send(status, body, headers=headers, include_body=include_body)
+
+    def _list_objects(self, query: dict[str, list[str]]) -> None:
+        prefix = query.get("prefix", [""])[0]
+        max_keys = int(query.get("max-keys", ["1000"])[0])
+        start_after = query.get("continuation-token", query.get("start-after", [""]))[0]
+
+        with self.server.state.lock:
+            keys = sorted(
+                key
+                for key in self.server.state.objects
+                if key.startswith(prefix) and key > start_after
+            )
+            page_keys = keys[:max_keys]
+            contents = "".join(
+                f"<Contents><Key>{escape(key)}</Key>"
+                f"<Size>{len(self.server.state.objects[key].body)}</Size>"
+                f"<ETag>{escape(self.server.state.objects[key].etag)}</ETag>"
+                "<StorageClass>STANDARD</StorageClass></Contents>"
+                for key in page_keys
+            )
+
+        is_truncated = len(keys) > max_keys
+        next_token = (
+            f"<NextContinuationToken>{escape(page_keys[-1])}</NextContinuationToken>"
+            if is_truncated
+            else ""
+        )
+
+        self._send_xml(
+            200,
+            f'<ListBucketResult xmlns="{S3_XMLNS}">'
+            f"<Prefix>{escape(prefix)}</Prefix><KeyCount>{len(page_keys)}</KeyCount>"
+            f"<MaxKeys>{max_keys}</MaxKeys>"
+            f"<IsTruncated>{'true' if is_truncated else 'false'}</IsTruncated>"
+            f"{next_token}{contents}</ListBucketResult>",
+        )
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("--port", type=int, default=0)
+    args = parser.parse_args()
+
+    server = S3StubServer(("127.0.0.1", args.port))
+
+    # the parent process reads the port from the first line
+    print(server.server_address[1], flush=True)
+
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,347 @@
+# one benchmark scenario, run in a fresh process to measure its peak RSS:
+#   python -m benchmarks.scenario prepare ...  store the already downloaded illusts
+#   python -m benchmarks.scenario run ...      crawl and print the result as JSON
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+from argparse import ArgumentParser, Namespace
+from collections.abc import AsyncIterator
+from contextlib import redirect_stdout
+from datetime import UTC, datetime
+from functools import partial
+from pathlib import Path
+from typing import Any
+
+from xivbookmarkdl.cli import (
+    StorageConfig,
+    create_storage,
+    download_illusts_asc,
+    download_illusts_desc,
+    get_illust_create_date,
+    get_watermark_start_date,
+)
+from xivbookmarkdl.dao.crawl_checkpoint import CrawlCheckpointDao
+from xivbookmarkdl.dao.crawl_watermark import (
+    BOOKMARK_WATERMARK_SIZE,
+    BookmarkWatermark,
+    CrawlWatermark,
+    CrawlWatermarkDao,
+)
+from xivbookmarkdl.dao.illust_binary import IllustBinaryDao
+from xivbookmarkdl.dao.illust_manifest import IllustManifest, IllustManifestDao
+from xivbookmarkdl.dao.illust_meta import IllustMetaDao
+from xivbookmarkdl.dao.illust_meta_pack import META_PACK_PREFIX
+from xivbookmarkdl.illust_download import (
+    get_illust_image_filename,
+    get_illust_image_urls,
+)
+from xivbookmarkdl.rate_limiter import RateLimiter
+from xivbookmarkdl.storage.base import Storage
+
+from .counting_storage import CountingStorage
+from .fake_pixiv import FakeAppPixivAPI, make_illust
+
+
+def create_benchmark_storage(args: Namespace) -> Storage:
+    return create_storage(
+        StorageConfig(
+            storage_type=args.storage_type,
+            root_dir=args.root_dir,
+            storage_s3_bucket="benchmark",
+            storage_s3_region="us-east-1",
+            storage_s3_endpoint_url=args.s3_endpoint_url,
+            storage_s3_force_path_style=True,
+            storage_s3_access_key_id="benchmark",
+            storage_s3_secret_access_key="benchmark",
+            storage_s3_session_token=None,
+            storage_s3_max_pool_connections=None,
+            storage_s3_multipart_threshold_mib=8,
+            storage_s3_multipart_chunksize_mib=8,
+            storage_s3_transfer_concurrency=10,
+            storage_s3_checksum_algorithm="CRC32",
+            storage_io_concurrency=None,
+        ),
+        download_concurrency=args.download_concurrency,
+    )
+
+
+def create_watermark_dao(storage: Storage, args: Namespace) -> CrawlWatermarkDao:
+    return CrawlWatermarkDao(storage=storage, job_key=f"benchmark-{args.mode}")
+
+
+def get_manifest_path(args: Namespace) -> Path | None:
+    return Path(args.work_dir) / "manifest.sqlite3" if args.manifest else None
+
+
+async def prepare(args: Namespace) -> None:
+    # the oldest illusts are already downloaded, as left by previous runs
+    num_existing_illusts = int(args.num_illusts * args.existing_ratio)
+
+    api = FakeAppPixivAPI(
+        num_illusts=args.num_illusts,
+        image_base_url=args.image_base_url,
+        max_pages=args.max_pages,
+        num_users=args.num_users,
+    )
+    padding = bytes(range(256)) * (args.image_size // 256 + 1)
+
+    manifest_path = get_manifest_path(args)
+    illust_manifest_dao = (
+        IllustManifestDao(manifest_path=manifest_path) if manifest_path else None
+    )
+
+    async with create_benchmark_storage(args) as storage:
+        illust_meta_dao = IllustMetaDao(
+            storage=storage, cache_size=0, packed=args.packed_meta
+        )
+        illust_binary_dao = IllustBinaryDao(storage=storage)
+
+        semaphore = asyncio.Semaphore(32)
+
+        async def store_illust(illust_id: int) -> None:
+            illust_dict = make_illust(
+                illust_id=illust_id,
+                image_base_url=args.image_base_url,
+                max_pages=args.max_pages,
+                num_users=api.num_users,
+            )
+            illust = api.parse_json(json.dumps(illust_dict))
+            user_id = int(illust.user.id)
+
+            async with semaphore:
+                pages = []
+                for image_url in get_illust_image_urls(illust):
+                    # same content as the image server returns
+                    body = (
+                        image_url.removeprefix(args.image_base_url).encode() + padding
+                    )[: args.image_size]
+
+                    async def iter_chunks(body: bytes = body) -> AsyncIterator[bytes]:
+                        yield body
+
+                    pages.append(
+                        await illust_binary_dao.store_illust_binary_stream(
+                            illust_id=illust_id,
+                            user_id=user_id,
+                            filename=get_illust_image_filename(image_url),
+                            chunks=iter_chunks(),
+                        )
+                    )
+
+                illust_meta = await illust_meta_dao.upsert_illust_meta(
+                    illust_id=illust_id,
+                    user_id=user_id,
+                    illust=illust_dict,
+                    found_at=datetime.now(UTC),
+                    pages=pages,
+                )
+
+            if illust_manifest_dao is not None:
+                await illust_manifest_dao.upsert_illust_manifest(
+                    IllustManifest(
+                        illust_id=illust_id,
+                        user_id=user_id,
+                        page_count=len(pages),
+                        pages=pages,
+                        found_at=illust_meta.found_at,
+                    )
+                )
+
+        await asyncio.gather(
+            *(
+                store_illust(illust_id=illust_id)
+                for illust_id in range(1, num_existing_illusts + 1)
+            )
+        )
+        await illust_meta_dao.flush()
+
+        # as left by an incremental crawl
+        if args.incremental and num_existing_illusts > 0:
+            watermark: CrawlWatermark | BookmarkWatermark
+            if args.mode == "asc":
+                newest_illust = api.parse_json(
+                    json.dumps(
+                        make_illust(
+                            illust_id=num_existing_illusts,
+                            image_base_url=args.image_base_url,
+                            max_pages=args.max_pages,
+                            num_users=api.num_users,
+                        )
+                    )
+                )
+                watermark = CrawlWatermark(
+                    create_date=get_illust_create_date(newest_illust),
+                    illust_id=num_existing_illusts,
+                    updated_at=datetime.now(UTC),
+                )
+            else:
+                # the first page of the bookmarks then
+                watermark = BookmarkWatermark(
+                    illust_ids=list(
+                        range(
+                            num_existing_illusts,
+                            max(num_existing_illusts - BOOKMARK_WATERMARK_SIZE, 0),
+                            -1,
+                        )
+                    ),
+                    max_bookmark_id=num_existing_illusts - api.page_size,
+                    updated_at=datetime.now(UTC),
+                )
+
+            await create_watermark_dao(storage, args).save_watermark(watermark)
+
+    if illust_manifest_dao is not None:
+        illust_manifest_dao.close()
+
+
+async def run(args: Namespace) -> dict[str, Any]:
+    api = FakeAppPixivAPI(
+        num_illusts=args.num_illusts,
+        image_base_url=args.image_base_url,
+        max_pages=args.max_pages,
+        num_users=args.num_users,
+    )
+
+    manifest_path = get_manifest_path(args)
+    illust_manifest_dao = (
+        IllustManifestDao(manifest_path=manifest_path) if manifest_path else None
+    )
+
+    # no pacing, measure the crawler itself
+    rate_limiter = RateLimiter.from_intervals(
+        page_interval=0,
+        download_interval=0,
+        retry_interval=0,
+        max_retries=0,
+        download_concurrency=args.download_concurrency,
+        download_interval_per_worker=True,
+    )
+
+    async with CountingStorage(create_benchmark_storage(args)) as storage:
+        illust_meta_dao = IllustMetaDao(storage=storage, packed=args.packed_meta)
+        illust_binary_dao = IllustBinaryDao(storage=storage)
+
+        # checkpoint writes are a part of the storage operations of a run
+        checkpoint_dao = CrawlCheckpointDao(
+            storage=storage, job_key=f"benchmark-{args.mode}"
+        )
+
+        download_func: Any = download_illusts_desc
+        first_func: Any = partial(api.user_bookmarks_illust, user_id=1)
+        next_func: Any = api.user_bookmarks_illust
+        if args.mode == "asc":
+            download_func = download_illusts_asc
+            first_func = partial(api.search_illust, word="benchmark", sort="date_asc")
+            next_func = api.search_illust
+
+        if args.incremental:
+            watermark_dao = create_watermark_dao(storage, args)
+            if args.mode == "asc":
+                watermark = await watermark_dao.get_watermark(CrawlWatermark)
+                if watermark is not None:
+                    first_func = partial(
+                        first_func, start_date=get_watermark_start_date(watermark)
+                    )
+
+                download_func = partial(
+                    download_illusts_asc,
+                    watermark_dao=watermark_dao,
+                    watermark=watermark,
+                )
+            else:
+                download_func = partial(
+                    download_illusts_desc,
+                    watermark_dao=watermark_dao,
+                    watermark=await watermark_dao.get_watermark(BookmarkWatermark),
+                )
+
+        started_at = time.perf_counter()
+
+        # progress output of the crawler is not a part of the result
+        with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+            num_new_illusts = await download_func(
+                api=api,
+                first_func=first_func,
+                next_func=next_func,
+                illust_meta_dao=illust_meta_dao,
+                illust_binary_dao=illust_binary_dao,
+                ignore_existence=False,
+                updated_at_utc=datetime.now(UTC),
+                rate_limiter=rate_limiter,
+                download_concurrency=args.download_concurrency,
+                illust_manifest_dao=illust_manifest_dao,
+                checkpoint_dao=checkpoint_dao,
+            )
+
+        elapsed_seconds = time.perf_counter() - started_at
+
+        # metadata objects left in the storage, not counted as operations of the run
+        num_meta_objects = 0
+        async for obj in storage.storage.list_tree(prefix=""):
+            if obj.key.startswith(META_PACK_PREFIX) or obj.key.endswith("/illust.json"):
+                num_meta_objects += 1
+
+    if illust_manifest_dao is not None:
+        illust_manifest_dao.close()
+
+    num_scanned_illusts = min(api.num_api_calls * api.page_size, args.num_illusts)
+
+    return {
+        "storage_type": args.storage_type,
+        "mode": args.mode,
+        "manifest": args.manifest,
+        "packed_meta": args.packed_meta,
+        "incremental": args.incremental,
+        "num_illusts": args.num_illusts,
+        "num_users": args.num_users,
+        "existing_ratio": args.existing_ratio,
+        "num_new_illusts": num_new_illusts,
+        "num_scanned_illusts": num_scanned_illusts,
+        "num_api_calls": api.num_api_calls,
+        "elapsed_seconds": elapsed_seconds,
+        "new_illusts_per_second": num_new_illusts / elapsed_seconds,
+        "uploaded_bytes": storage.uploaded_bytes,
+        "uploaded_bytes_per_second": storage.uploaded_bytes / elapsed_seconds,
+        "storage_ops": dict(storage.op_counts),
+        "storage_ops_per_scanned_illust": storage.num_ops / max(num_scanned_illusts, 1),
+        "num_meta_objects": num_meta_objects,
+        # kilobytes on Linux
+        "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser()
+    parser.add_argument("command", choices=["prepare", "run"])
+    parser.add_argument("--work_dir", type=str, required=True)
+    parser.add_argument(
+        "--storage_type", type=str, choices=["filesystem", "s3"], required=True
+    )
+    parser.add_argument("--root_dir", type=str, default=None)
+    parser.add_argument("--s3_endpoint_url", type=str, default=None)
+    parser.add_argument("--image_base_url", type=str, required=True)
+    parser.add_argument("--mode", type=str, choices=["desc", "asc"], default="desc")
+    parser.add_argument("--num_illusts", type=int, default=1000)
+    parser.add_argument("--existing_ratio", type=float, default=0.0)
+    parser.add_argument("--max_pages", type=int, default=3)
+    parser.add_argument("--num_users", type=int, default=97)
+    parser.add_argument("--image_size", type=int, default=32 * 1024)
+    parser.add_argument("--download_concurrency", type=int, default=8)
+    parser.add_argument("--manifest", action="store_true")
+    parser.add_argument("--packed_meta", action="store_true")
+    parser.add_argument("--incremental", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "prepare":
+        asyncio.run(prepare(args))
+        return
+
+    result = asyncio.run(run(args))
+    sys.stdout.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import json
+from datetime import UTC, datetime, timedelta
+from typing import Any
+
+from pixivpy3 import AppPixivAPI
+from pixivpy3.utils import ParamDict, ParsedJson
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+# illusts are created an hour apart from this date in the order of their ids
+CREATE_DATE_EPOCH = datetime(2020, 1, 1, tzinfo=UTC)
+
+IMAGE_BODY = b"image"
+
+
+def make_illust(illust_id: int, user_id: int | None = None) -> dict[str, Any]:
+    # a single page illust, its image is served by FakePixivAPI
+    user_id = user_id if user_id is not None else 1000 + illust_id
+
+    return {
+        "id": illust_id,
+        "title": f"illust {illust_id}",
+        "type": "illust",
+        "create_date": (CREATE_DATE_EPOCH + timedelta(hours=illust_id)).isoformat(),
+        "page_count": 1,
+        "user": {"id": user_id, "name": f"user {user_id}"},
+        "meta_single_page": {
+            "original_image_url": (
+                f"https://i.pximg.net/img-original/{illust_id}_p0.png"
+            )
+        },
+        "meta_pages": [],
+    }
+
+
+def make_response(body: bytes, status_code: int = 200) -> Response:
+    # the body is served as already read
+    response = Response()
+    response.status_code = status_code
+    response.headers = CaseInsensitiveDict({"Content-Length": str(len(body))})
+    response._content = body
+    response._content_consumed = True
+
+    return response
+
+
+# AppPixivAPI serving pages of illusts and their images without network access
+class FakePixivAPI(AppPixivAPI):
+    def __init__(self, pages: list[list[dict[str, Any]]]):
+        super().__init__()
+
+        self.pages = pages
+        self.fetched_pages: list[int] = []
+        self.requested_urls: list[str] = []
+
+    def get_page(self, offset: int | str = 0) -> ParsedJson:
+        # first_func and next_func of the crawls, offset is the page index
+        page_index = int(offset)
+        self.fetched_pages.append(page_index)
+
+        next_url = (
+            f"https://app-api.pixiv.net/v1/search/illust?offset={page_index + 1}"
+            if page_index + 1 < len(self.pages)
+            else None
+        )
+
+        return self.parse_json(
+            json.dumps({"illusts": self.pages[page_index], "next_url": next_url})
+        )
+
+    def get_response(self, url: str) -> Response:
+        return make_response(IMAGE_BODY)
+
+    def requests_call(
+        self,
+        method: str,
+        url: str,
+        headers: ParamDict | CaseInsensitiveDict[Any] | None = None,
+        params: ParamDict | None = None,
+        data: ParamDict | None = None,
+        stream: bool = False,
+    ) -> Response:
+        self.requested_urls.append(url)
+
+        return self.get_response(url)
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+from collections.abc import AsyncIterator, Iterable, Iterator
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from benchmarks.counting_storage import CountingStorage
+from benchmarks.fake_pixiv import FakeAppPixivAPI
+from benchmarks.s3_stub import S3StubServer
+from xivbookmarkdl.storage.base import StorageDownloadNotFoundError
+from xivbookmarkdl.storage.filesystem import StorageFilesystem
+from xivbookmarkdl.storage.s3 import StorageS3
+
+
+@pytest.fixture
+def s3_stub_port() -> Iterator[int]:
+    server = S3StubServer(("127.0.0.1", 0))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address[1]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def create_storage(port: int) -> StorageS3:
+    return StorageS3(
+        bucket_name="bucket",
+        prefix="prefix/",
+        aws_region="us-east-1",
+        aws_endpoint_url=f"http://127.0.0.1:{port}",
+        force_path_style=True,
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+        aws_session_token=None,
+        multipart_threshold=4,
+        multipart_chunksize=4,
+    )
+
+
+async def iter_chunks(chunks: Iterable[bytes]) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+def test_storage_s3_on_stub(s3_stub_port: int) -> None:
+    async def main() -> None:
+        async with create_storage(s3_stub_port) as storage:
+            small_obj = await storage.upload_bytes(dest_key="1/10/a", data=b"ab")
+            large_obj = await storage.upload_stream(
+                dest_key="1/10/b", chunks=iter_chunks([b"abcdef", b"ghij"])
+            )
+
+            assert await storage.read_bytes(key="1/10/a") == b"ab"
+            assert await storage.read_bytes(key="1/10/b") == b"abcdefghij"
+            assert [obj async for obj in storage.list_tree(prefix="1/")] == [
+                small_obj,
+                large_obj,
+            ]
+            assert await storage.exists_many(keys=["1/10/a", "1/10/c"]) == {"1/10/a"}
+
+            await storage.delete(key="1/10/a")
+            with pytest.raises(StorageDownloadNotFoundError):
+                await storage.read_bytes(key="1/10/a")
+
+    asyncio.run(main())
+
+
+def test_storage_s3_link_on_stub(s3_stub_port: int) -> None:
+    async def main() -> None:
+        async with create_storage(s3_stub_port) as storage:
+            await storage.upload_bytes(dest_key="_blobs/a", data=b"ab")
+
+            obj = await storage.link(source_key="_blobs/a", dest_key="1/10/a")
+            assert obj.size == 2
+            assert await storage.read_bytes(key="1/10/a") == b"ab"
+            assert [obj async for obj in storage.list_tree(prefix="1/")] == [obj]
+
+            with pytest.raises(StorageDownloadNotFoundError):
+                await storage.link(source_key="_blobs/b", dest_key="1/10/b")
+
+    asyncio.run(main())
+
+
+def test_counting_storage(tmp_path: Path) -> None:
+    async def main() -> None:
+        async with CountingStorage(StorageFilesystem(root_dir=tmp_path)) as storage:
+            await storage.upload_bytes(dest_key="1/10/a", data=b"ab")
+            await storage.upload_stream(
+                dest_key="1/10/b", chunks=iter_chunks([b"abc", b"def"])
+            )
+            await storage.read_bytes(key="1/10/a")
+
+            assert storage.op_counts == {
+                "upload_bytes": 1,
+                "upload_stream": 1,
+                "read_bytes": 1,
+            }
+            assert storage.num_ops == 3
+            assert storage.uploaded_bytes == 8
+
+    asyncio.run(main())
+
+
+def test_fake_app_pixiv_api_pages() -> None:
+    api = FakeAppPixivAPI(
+        num_illusts=70, image_base_url="http://127.0.0.1:9", page_size=30
+    )
+
+    # bookmarks are paged newest first with max_bookmark_id
+    pages: list[list[int]] = []
+    next_qs: dict[str, Any] | None = {"user_id": "1"}
+    while next_qs:
+        result = api.user_bookmarks_illust(**next_qs)
+        pages.append([int(illust.id) for illust in result.illusts])
+        next_qs = api.parse_qs(result.next_url)
+
+    assert pages == [
+        list(range(70, 40, -1)),
+        list(range(40, 10, -1)),
+        list(range(10, 0, -1)),
+    ]
+    assert api.num_api_calls == 3
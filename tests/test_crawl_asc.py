@@ -0,0 +1,178 @@
+import asyncio
+import json
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+import pytest
+from fake_pixiv import FakePixivAPI, make_illust
+from pixivpy3.utils import ParsedJson
+
+from xivbookmarkdl.cli import download_illusts_asc
+from xivbookmarkdl.dao.crawl_checkpoint import CHECKPOINT_PREFIX, CrawlCheckpointDao
+from xivbookmarkdl.dao.illust_binary import IllustBinaryDao
+from xivbookmarkdl.dao.illust_meta import IllustMetaDao
+from xivbookmarkdl.rate_limiter import RateLimiter, RetryLimitExceededError
+from xivbookmarkdl.storage.base import Storage
+from xivbookmarkdl.storage.filesystem import StorageFilesystem
+
+
+class RecordingCheckpointDao(CrawlCheckpointDao):
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.saved_page_indexes: list[int] = []
+
+    async def save_page(
+        self,
+        page_index: int,
+        illusts: list[dict[str, Any]],
+        next_qs: dict[str, Any] | None,
+    ) -> None:
+        self.saved_page_indexes.append(page_index)
+        await super().save_page(page_index=page_index, illusts=illusts, next_qs=next_qs)
+
+
+def create_rate_limiter() -> RateLimiter:
+    return RateLimiter.from_intervals(
+        page_interval=0, download_interval=0, retry_interval=0, max_retries=0
+    )
+
+
+def test_asc_checkpoint_with_packed_illust_meta(tmp_path: Path) -> None:
+    # 3 pages of 3 illusts, illust meta are written at every 4 illusts
+    api = FakePixivAPI(
+        pages=[
+            [make_illust(illust_id) for illust_id in range(page * 3 + 1, page * 3 + 4)]
+            for page in range(3)
+        ]
+    )
+
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            illust_meta_dao = IllustMetaDao(
+                storage=storage, packed=True, segment_size=4
+            )
+            checkpoint_dao = RecordingCheckpointDao(storage=storage, job_key="test")
+
+            num_new_illusts = await download_illusts_asc(
+                api=api,
+                first_func=api.get_page,
+                next_func=api.get_page,
+                illust_meta_dao=illust_meta_dao,
+                illust_binary_dao=IllustBinaryDao(storage=storage),
+                ignore_existence=False,
+                updated_at_utc=datetime.now(UTC),
+                rate_limiter=create_rate_limiter(),
+                checkpoint_dao=checkpoint_dao,
+            )
+            assert num_new_illusts == 9
+
+            # each page is saved once its illust meta are written by a flush
+            # (page 1 at the 4th illust, page 2 at the 8th),
+            # the last one at the end of the crawl
+            assert checkpoint_dao.saved_page_indexes == [0, 1]
+            assert await checkpoint_dao.get_checkpoint() is None
+
+            for illust_id in range(1, 10):
+                assert (
+                    await IllustMetaDao(storage=storage, packed=True).get_illust_meta(
+                        illust_id=illust_id, user_id=1000 + illust_id
+                    )
+                    is not None
+                )
+
+    asyncio.run(main())
+
+
+class FailingOncePixivAPI(FakePixivAPI):
+    # the API fails at a page once, as when the run is interrupted there
+    def __init__(self, pages: list[list[dict[str, Any]]], failing_page: int):
+        super().__init__(pages=pages)
+        self.failing_page: int | None = failing_page
+
+    def get_page(self, offset: int | str = 0) -> ParsedJson:
+        if int(offset) == self.failing_page:
+            self.failing_page = None
+            self.fetched_pages.append(int(offset))
+            return self.parse_json(json.dumps({"error": {"message": "Error"}}))
+
+        return super().get_page(offset=offset)
+
+
+def test_asc_resume_from_checkpoint(tmp_path: Path) -> None:
+    api = FailingOncePixivAPI(
+        pages=[
+            [make_illust(illust_id) for illust_id in range(page * 3 + 1, page * 3 + 4)]
+            for page in range(4)
+        ],
+        failing_page=2,
+    )
+
+    async def crawl(storage: Storage, resume: bool) -> int:
+        return await download_illusts_asc(
+            api=api,
+            first_func=api.get_page,
+            next_func=api.get_page,
+            illust_meta_dao=IllustMetaDao(storage=storage),
+            illust_binary_dao=IllustBinaryDao(storage=storage),
+            ignore_existence=False,
+            updated_at_utc=datetime.now(UTC),
+            rate_limiter=create_rate_limiter(),
+            checkpoint_dao=CrawlCheckpointDao(storage=storage, job_key="test"),
+            resume=resume,
+        )
+
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            with pytest.raises(RetryLimitExceededError):
+                await crawl(storage=storage, resume=False)
+
+            checkpoint = await CrawlCheckpointDao(
+                storage=storage, job_key="test"
+            ).get_checkpoint()
+            assert checkpoint is not None
+            assert checkpoint.num_pages == 2
+
+            # continued from the page the interrupted run failed at
+            api.fetched_pages.clear()
+            assert await crawl(storage=storage, resume=True) == 6
+            assert api.fetched_pages == [2, 3]
+
+            # deleted once the crawl has finished
+            assert [
+                key async for key in storage.iter_with_prefix(prefix=CHECKPOINT_PREFIX)
+            ] == []
+
+    asyncio.run(main())
+
+
+def test_checkpoint_of_interrupted_run_is_discarded(tmp_path: Path) -> None:
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            checkpoint_dao = CrawlCheckpointDao(storage=storage, job_key="test")
+            await checkpoint_dao.save_page(
+                page_index=0, illusts=[make_illust(1)], next_qs={"offset": "1"}
+            )
+            await checkpoint_dao.save_page(
+                page_index=1, illusts=[make_illust(2)], next_qs={"offset": "2"}
+            )
+
+            checkpoint = await checkpoint_dao.get_checkpoint()
+            assert checkpoint is not None
+            assert checkpoint.next_qs == {"offset": "2"}
+            assert [
+                illust["id"]
+                for illust in await checkpoint_dao.get_pending_illusts(checkpoint)
+            ] == [1, 2]
+
+            # a run not resuming replaces the checkpoint at its first write
+            checkpoint_dao = CrawlCheckpointDao(storage=storage, job_key="test")
+            checkpoint_dao.discard_checkpoint()
+            await checkpoint_dao.save_page(page_index=0, illusts=[], next_qs=None)
+
+            checkpoint = await checkpoint_dao.get_checkpoint()
+            assert checkpoint is not None
+            assert checkpoint.num_pages == 1
+            assert await checkpoint_dao.get_pending_illusts(checkpoint) == []
+
+    asyncio.run(main())
@@ -0,0 +1,139 @@
+import asyncio
+import threading
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+from fake_pixiv import FakePixivAPI, make_illust
+from pixivpy3.utils import ParsedJson
+from requests import Response
+
+from xivbookmarkdl.cli import download_illusts_desc
+from xivbookmarkdl.dao.crawl_watermark import BookmarkWatermark
+from xivbookmarkdl.dao.illust_binary import IllustBinaryDao, IllustPageRecord
+from xivbookmarkdl.dao.illust_meta import IllustMetaDao, IllustMetaWithId
+from xivbookmarkdl.rate_limiter import RateLimiter
+from xivbookmarkdl.storage.base import Storage
+from xivbookmarkdl.storage.filesystem import StorageFilesystem
+
+
+class RecordingIllustMetaDao(IllustMetaDao):
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.upserted_illust_ids: list[int] = []
+
+    async def upsert_illust_meta(
+        self,
+        illust_id: int,
+        user_id: int,
+        illust: dict[str, Any],
+        found_at: datetime,
+        pages: list[IllustPageRecord] | None = None,
+    ) -> IllustMetaWithId:
+        self.upserted_illust_ids.append(illust_id)
+        return await super().upsert_illust_meta(
+            illust_id=illust_id,
+            user_id=user_id,
+            illust=illust,
+            found_at=found_at,
+            pages=pages,
+        )
+
+
+async def crawl(
+    storage: Storage,
+    api: FakePixivAPI,
+    watermark: BookmarkWatermark | None = None,
+    illust_meta_dao: IllustMetaDao | None = None,
+) -> int:
+    return await download_illusts_desc(
+        api=api,
+        first_func=api.get_page,
+        next_func=api.get_page,
+        illust_meta_dao=illust_meta_dao or IllustMetaDao(storage=storage),
+        illust_binary_dao=IllustBinaryDao(storage=storage),
+        ignore_existence=False,
+        updated_at_utc=datetime.now(UTC),
+        rate_limiter=RateLimiter.from_intervals(
+            page_interval=0, download_interval=0, retry_interval=0, max_retries=0
+        ),
+        watermark=watermark,
+        watermark_max_empty_pages=3,
+    )
+
+
+def test_desc_stops_at_empty_page(tmp_path: Path) -> None:
+    # 6 pages of 2 illusts, newest first
+    pages = [
+        [make_illust(illust_id) for illust_id in (12 - page * 2, 11 - page * 2)]
+        for page in range(6)
+    ]
+
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            assert await crawl(storage, api=FakePixivAPI(pages=pages)) == 12
+
+            # without a watermark, at the first page without new illusts
+            api = FakePixivAPI(pages=pages)
+            assert await crawl(storage, api=api) == 0
+            assert api.fetched_pages == [0]
+
+            # with a watermark no page reaches, after a few pages in a row
+            api = FakePixivAPI(pages=pages)
+            assert (
+                await crawl(
+                    storage,
+                    api=api,
+                    watermark=BookmarkWatermark(
+                        illust_ids=[1000],
+                        max_bookmark_id=None,
+                        updated_at=datetime.now(UTC),
+                    ),
+                )
+                == 0
+            )
+            assert api.fetched_pages == [0, 1, 2]
+
+    asyncio.run(main())
+
+
+class PipelinedPixivAPI(FakePixivAPI):
+    # the last page is served once an image has been requested,
+    # which happens only if images are downloaded while paging
+    def __init__(self, pages: list[list[dict[str, Any]]]):
+        super().__init__(pages=pages)
+        self.image_requested = threading.Event()
+        self.downloaded_while_paging = False
+
+    def get_page(self, offset: int | str = 0) -> ParsedJson:
+        if int(offset) == len(self.pages) - 1:
+            self.downloaded_while_paging = self.image_requested.wait(timeout=5)
+
+        return super().get_page(offset=offset)
+
+    def get_response(self, url: str) -> Response:
+        self.image_requested.set()
+        return super().get_response(url)
+
+
+def test_desc_downloads_while_paging(tmp_path: Path) -> None:
+    # 3 pages of 2 illusts, newest first
+    api = PipelinedPixivAPI(
+        pages=[
+            [make_illust(illust_id) for illust_id in (6 - page * 2, 5 - page * 2)]
+            for page in range(3)
+        ]
+    )
+
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            illust_meta_dao = RecordingIllustMetaDao(storage=storage)
+
+            assert await crawl(storage, api=api, illust_meta_dao=illust_meta_dao) == 6
+
+            # committed oldest first, after paging has finished
+            assert illust_meta_dao.upserted_illust_ids == [1, 2, 3, 4, 5, 6]
+
+    asyncio.run(main())
+
+    assert api.downloaded_while_paging
@@ -0,0 +1,117 @@
+import asyncio
+from datetime import date
+from pathlib import Path
+
+import pytest
+
+from xivbookmarkdl.dao.crawl_shard import CrawlShardDao, plan_crawl_shards
+from xivbookmarkdl.storage.filesystem import StorageFilesystem
+
+
+def test_plan_crawl_shards() -> None:
+    shards = plan_crawl_shards(
+        start_date=date(2025, 1, 1), end_date=date(2025, 1, 25), shard_days=10
+    )
+
+    assert [(shard.start_date, shard.end_date) for shard in shards] == [
+        (date(2025, 1, 1), date(2025, 1, 10)),
+        (date(2025, 1, 11), date(2025, 1, 20)),
+        (date(2025, 1, 21), date(2025, 1, 25)),
+    ]
+    assert shards[0].shard_id == "2025-01-01_2025-01-10"
+
+    assert (
+        plan_crawl_shards(
+            start_date=date(2025, 1, 2), end_date=date(2025, 1, 1), shard_days=10
+        )
+        == []
+    )
+
+    with pytest.raises(ValueError):
+        plan_crawl_shards(
+            start_date=date(2025, 1, 1), end_date=date(2025, 1, 25), shard_days=0
+        )
+
+
+def test_crawl_shard_lease(tmp_path: Path) -> None:
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            shard_dao = CrawlShardDao(storage=storage, job_key="search_tag-test")
+
+            lease = await shard_dao.acquire_lease(
+                shard_id="shard", worker_id="a", lease_seconds=60, settle_seconds=0
+            )
+            assert lease is not None
+
+            # leased by another worker
+            assert (
+                await shard_dao.acquire_lease(
+                    shard_id="shard", worker_id="b", lease_seconds=60, settle_seconds=0
+                )
+                is None
+            )
+
+            renewed_lease = await shard_dao.renew_lease(
+                shard_id="shard", lease=lease, lease_seconds=60
+            )
+            assert renewed_lease is not None
+            assert renewed_lease.token == lease.token
+            assert renewed_lease.expires_at >= lease.expires_at
+
+            assert await shard_dao.release_lease(shard_id="shard", lease=lease)
+            assert await shard_dao.get_lease(shard_id="shard") is None
+
+    asyncio.run(main())
+
+
+def test_crawl_shard_lease_taken_over(tmp_path: Path) -> None:
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            shard_dao = CrawlShardDao(storage=storage, job_key="search_tag-test")
+
+            # expired at once, as left by a stopped worker
+            stale_lease = await shard_dao.acquire_lease(
+                shard_id="shard", worker_id="a", lease_seconds=0, settle_seconds=0
+            )
+            assert stale_lease is not None
+
+            lease = await shard_dao.acquire_lease(
+                shard_id="shard", worker_id="b", lease_seconds=60, settle_seconds=0
+            )
+            assert lease is not None
+            assert lease.token != stale_lease.token
+
+            # the stopped worker neither renews nor releases the lease of the new owner
+            assert (
+                await shard_dao.renew_lease(
+                    shard_id="shard", lease=stale_lease, lease_seconds=60
+                )
+                is None
+            )
+            assert not await shard_dao.release_lease(
+                shard_id="shard", lease=stale_lease
+            )
+            assert await shard_dao.get_lease(shard_id="shard") == lease
+
+    asyncio.run(main())
+
+
+def test_crawl_shard_done(tmp_path: Path) -> None:
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            shard_dao = CrawlShardDao(storage=storage, job_key="search_tag-test")
+
+            shards = plan_crawl_shards(
+                start_date=date(2025, 1, 1), end_date=date(2025, 1, 20), shard_days=10
+            )
+            await shard_dao.save_plan(shards=shards)
+            await shard_dao.mark_done(
+                shard_id=shards[0].shard_id, worker_id="a", num_new_illusts=3
+            )
+
+            plan = await shard_dao.get_plan()
+            assert plan is not None
+            assert plan.shards == shards
+            assert await shard_dao.get_done_shard_ids() == {shards[0].shard_id}
+
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+from datetime import UTC, datetime
+
+from xivbookmarkdl.dao.crawl_watermark import (
+    BookmarkWatermark,
+    CrawlWatermark,
+    make_bookmark_watermark,
+)
+
+UPDATED_AT = datetime(2026, 1, 1, tzinfo=UTC)
+
+
+def test_crawl_watermark_covers() -> None:
+    create_date = datetime(2025, 6, 1, 12, 0, tzinfo=UTC)
+    watermark = CrawlWatermark(
+        create_date=create_date, illust_id=100, updated_at=UPDATED_AT
+    )
+
+    assert watermark.covers(create_date=create_date, illust_id=100)
+    assert watermark.covers(create_date=create_date, illust_id=99)
+    assert watermark.covers(
+        create_date=datetime(2025, 5, 31, tzinfo=UTC), illust_id=200
+    )
+
+    # posted at the same time, after the watermark in the asc order
+    assert not watermark.covers(create_date=create_date, illust_id=101)
+    assert not watermark.covers(
+        create_date=datetime(2025, 6, 2, tzinfo=UTC), illust_id=1
+    )
+
+
+def test_bookmark_watermark_find_boundary() -> None:
+    watermark = BookmarkWatermark(
+        illust_ids=[50, 49, 48], max_bookmark_id=1000, updated_at=UPDATED_AT
+    )
+
+    assert watermark.find_boundary([52, 51, 50, 49, 48, 47]) == 2
+    # the page ends before the rest of the watermark
+    assert watermark.find_boundary([52, 51, 50]) == 2
+    # 50 has been bookmarked again since the last sync
+    assert watermark.find_boundary([50, 52, 51, 47]) is None
+    assert watermark.find_boundary([52, 51]) is None
+
+    assert (
+        BookmarkWatermark(
+            illust_ids=[], max_bookmark_id=None, updated_at=UPDATED_AT
+        ).find_boundary([50])
+        is None
+    )
+
+
+def test_bookmark_watermark_covers_cursor() -> None:
+    watermark = BookmarkWatermark(
+        illust_ids=[50], max_bookmark_id=1000, updated_at=UPDATED_AT
+    )
+
+    assert watermark.covers_cursor(1000)
+    assert watermark.covers_cursor(999)
+    assert not watermark.covers_cursor(1001)
+
+    assert not BookmarkWatermark(
+        illust_ids=[50], max_bookmark_id=None, updated_at=UPDATED_AT
+    ).covers_cursor(1)
+
+
+def test_make_bookmark_watermark() -> None:
+    pages: list[tuple[list[int], int | None]] = [
+        ([10, 9, 8, 7], 100),
+        ([6, 5, 4, 3], 50),
+        ([2, 1], None),
+    ]
+
+    watermark = make_bookmark_watermark(pages=pages, incomplete_illust_ids=set())
+    assert watermark is not None
+    assert watermark.illust_ids == [10, 9, 8, 7, 6]
+    assert watermark.max_bookmark_id == 100
+
+
+def test_make_bookmark_watermark_after_incomplete_illusts() -> None:
+    pages: list[tuple[list[int], int | None]] = [
+        ([10, 9, 8, 7], 100),
+        ([6, 5, 4, 3], 50),
+        ([2, 1], None),
+    ]
+
+    # the next run reaches the oldest illust with missing pages again
+    watermark = make_bookmark_watermark(pages=pages, incomplete_illust_ids={9, 6})
+    assert watermark is not None
+    assert watermark.illust_ids == [5, 4, 3, 2, 1]
+    assert watermark.max_bookmark_id == 50
+
+    assert make_bookmark_watermark(pages=pages, incomplete_illust_ids={1}) is None
@@ -0,0 +1,274 @@
+import asyncio
+import json
+from collections.abc import AsyncIterator
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from xivbookmarkdl.cli import report_dedup
+from xivbookmarkdl.dao.illust_binary import (
+    IllustBinaryDao,
+    IllustPageRecord,
+    get_blob_key,
+    get_valid_illust_pages,
+    hash_file,
+)
+from xivbookmarkdl.progress import set_progress_format
+from xivbookmarkdl.storage.base import Storage, StorageObject
+from xivbookmarkdl.storage.filesystem import StorageFilesystem
+
+IMAGE_KEYS = ["1/10/10_p0.png", "1/10/10_p1.png", "1/10/10_p2.png"]
+
+
+def test_get_valid_illust_pages_without_records() -> None:
+    # illust.json written before page records, stored objects are trusted
+    pages = get_valid_illust_pages(
+        image_keys=IMAGE_KEYS,
+        objects_by_key={
+            IMAGE_KEYS[0]: StorageObject(key=IMAGE_KEYS[0], size=100),
+            IMAGE_KEYS[1]: StorageObject(key=IMAGE_KEYS[1], size=0),
+        },
+        recorded_pages=None,
+    )
+
+    assert pages == [IllustPageRecord(key=IMAGE_KEYS[0], size=100)]
+
+
+def test_get_valid_illust_pages_with_records() -> None:
+    recorded_pages = [
+        IllustPageRecord(key=IMAGE_KEYS[0], size=100, sha256="a"),
+        IllustPageRecord(key=IMAGE_KEYS[1], size=200, sha256="b"),
+    ]
+
+    pages = get_valid_illust_pages(
+        image_keys=IMAGE_KEYS,
+        objects_by_key={
+            IMAGE_KEYS[0]: StorageObject(key=IMAGE_KEYS[0], size=100),
+            # cut off after it was recorded
+            IMAGE_KEYS[1]: StorageObject(key=IMAGE_KEYS[1], size=150),
+            # stored without a record, by an interrupted run
+            IMAGE_KEYS[2]: StorageObject(key=IMAGE_KEYS[2], size=300),
+        },
+        recorded_pages=recorded_pages,
+    )
+
+    assert pages == [recorded_pages[0]]
+
+
+def test_get_valid_illust_pages_with_etags() -> None:
+    recorded_pages = [
+        IllustPageRecord(key=IMAGE_KEYS[0], size=100, etag='"a"'),
+        IllustPageRecord(key=IMAGE_KEYS[1], size=100, etag='"b"'),
+        # recorded before etags
+        IllustPageRecord(key=IMAGE_KEYS[2], size=100),
+    ]
+
+    pages = get_valid_illust_pages(
+        image_keys=IMAGE_KEYS,
+        objects_by_key={
+            IMAGE_KEYS[0]: StorageObject(key=IMAGE_KEYS[0], size=100, etag='"a"'),
+            # replaced by another image of the same size after it was recorded
+            IMAGE_KEYS[1]: StorageObject(key=IMAGE_KEYS[1], size=100, etag='"c"'),
+            IMAGE_KEYS[2]: StorageObject(key=IMAGE_KEYS[2], size=100, etag='"d"'),
+        },
+        recorded_pages=recorded_pages,
+    )
+
+    assert pages == [recorded_pages[0], recorded_pages[2]]
+
+
+def test_store_illust_binary_hashes_only_with_dedup(tmp_path: Path) -> None:
+    file = tmp_path / "10_p0.png"
+    file.write_bytes(b"image")
+
+    async def store(dedup: bool) -> IllustPageRecord:
+        async with StorageFilesystem(root_dir=tmp_path / f"storage-{dedup}") as storage:
+            illust_binary_dao = IllustBinaryDao(storage=storage, dedup=dedup)
+
+            page = await illust_binary_dao.store_illust_binary(
+                illust_id=10, user_id=1, file=file
+            )
+
+            # the recorded etag is the one listed for the stored object
+            [obj] = [obj async for obj in storage.list_tree(prefix="1/")]
+            assert page.etag is not None
+            assert page.etag == obj.etag
+
+            return page
+
+    assert asyncio.run(store(dedup=False)).model_dump(exclude={"etag"}) == {
+        "key": "1/10/10_p0.png",
+        "size": 5,
+        "sha256": None,
+    }
+    assert asyncio.run(store(dedup=True)).model_dump(exclude={"etag"}) == {
+        "key": "1/10/10_p0.png",
+        "size": 5,
+        "sha256": hash_file(file),
+    }
+
+
+class StorageFilesystemRecordingListings(StorageFilesystem):
+    def __init__(self, root_dir: Path):
+        super().__init__(root_dir=root_dir)
+        self.listed_prefixes: list[str] = []
+
+    async def list_tree(self, prefix: str) -> AsyncIterator[StorageObject]:
+        self.listed_prefixes.append(prefix)
+        async for obj in super().list_tree(prefix=prefix):
+            yield obj
+
+
+def test_list_illust_objects_many(tmp_path: Path) -> None:
+    async def main() -> None:
+        async with StorageFilesystemRecordingListings(root_dir=tmp_path) as storage:
+            # user 1 has 5 objects of 4 illusts, user 2 has 1 illust
+            for key in [
+                "1/10/10_p0.png",
+                "1/11/11_p0.png",
+                "1/11/11_p1.png",
+                "1/12/12_p0.png",
+                "1/13/13_p0.png",
+                "2/20/20_p0.png",
+            ]:
+                await storage.upload_bytes(dest_key=key, data=b"image")
+
+            illust_binary_dao = IllustBinaryDao(storage=storage)
+            illust_ids = [(10, 1), (11, 1), (14, 1), (20, 2)]
+            expected_keys = {
+                (10, 1): ["1/10/10_p0.png"],
+                (11, 1): ["1/11/11_p0.png", "1/11/11_p1.png"],
+                (14, 1): [],
+                (20, 2): ["2/20/20_p0.png"],
+            }
+
+            async def list_keys(
+                user_listing_max_objects: int,
+            ) -> dict[tuple[int, int], list[str]]:
+                storage.listed_prefixes.clear()
+                objects_by_illust = await illust_binary_dao.list_illust_objects_many(
+                    illust_ids=illust_ids,
+                    user_listing_max_objects=user_listing_max_objects,
+                )
+                return {
+                    illust_id: sorted(obj.key for obj in objects)
+                    for illust_id, objects in objects_by_illust.items()
+                }
+
+            # one listing for the user of many illusts
+            assert await list_keys(user_listing_max_objects=5) == expected_keys
+            assert storage.listed_prefixes == ["1/", "2/20/"]
+
+            # the user has more objects than the cap, listed per illust
+            assert await list_keys(user_listing_max_objects=4) == expected_keys
+            assert storage.listed_prefixes == [
+                "1/",
+                "1/10/",
+                "1/11/",
+                "1/14/",
+                "2/20/",
+            ]
+
+    asyncio.run(main())
+
+
+# a storage whose link copies the content, like S3
+class StorageFilesystemCopyingLink(StorageFilesystem):
+    link_shares_data = False
+
+
+async def store_same_image_twice(
+    storage: Storage, tmp_path: Path
+) -> list[IllustPageRecord]:
+    illust_binary_dao = IllustBinaryDao(storage=storage, dedup=True)
+
+    pages: list[IllustPageRecord] = []
+    for illust_id in (10, 11):
+        file = tmp_path / f"{illust_id}_p0.png"
+        file.write_bytes(b"image")
+
+        pages.append(
+            await illust_binary_dao.store_illust_binary(
+                illust_id=illust_id, user_id=1, file=file
+            )
+        )
+
+    return pages
+
+
+def get_dedup_report(
+    storage: Storage, capsys: pytest.CaptureFixture[str]
+) -> dict[str, Any]:
+    capsys.readouterr()
+
+    set_progress_format("json")
+    try:
+        asyncio.run(
+            report_dedup(
+                storage=storage, illust_binary_dao=IllustBinaryDao(storage=storage)
+            )
+        )
+    finally:
+        set_progress_format("text")
+
+    report: dict[str, Any] = json.loads(capsys.readouterr().out)
+    return report
+
+
+def test_store_deduplicated_links_blob(
+    tmp_path: Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    storage_dir = tmp_path / "storage"
+    storage = StorageFilesystem(root_dir=storage_dir)
+
+    pages = asyncio.run(store_same_image_twice(storage=storage, tmp_path=tmp_path))
+
+    # both illust keys are links to the same blob
+    assert pages[0].sha256 is not None
+    blob_path = storage_dir / get_blob_key(
+        sha256=pages[0].sha256, filename=pages[0].key
+    )
+    for page in pages:
+        assert page.size == 5
+        assert (storage_dir / page.key).samefile(blob_path)
+
+    report = get_dedup_report(storage=storage, capsys=capsys)
+    assert report["num_illust_binaries"] == 2
+    assert report["num_refs"] == 0
+    assert report["logical_size"] == 10
+    assert report["stored_size"] == 5
+
+    asyncio.run(storage.close())
+
+
+def test_store_deduplicated_writes_blob_refs(
+    tmp_path: Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    storage = StorageFilesystemCopyingLink(root_dir=tmp_path / "storage")
+
+    async def main() -> None:
+        pages = await store_same_image_twice(storage=storage, tmp_path=tmp_path)
+
+        illust_binary_dao = IllustBinaryDao(storage=storage)
+        objects = [obj async for obj in storage.list_tree(prefix="1/")]
+        assert sorted(obj.key for obj in objects) == [page.key for page in pages]
+
+        # illust keys hold references to the blob in place of the image
+        for obj in objects:
+            blob_ref = await illust_binary_dao.get_blob_ref(obj=obj)
+            assert blob_ref is not None
+            assert blob_ref.size == 5
+            assert blob_ref.sha256 == pages[0].sha256
+            assert await storage.read_bytes(key=blob_ref.blob_key) == b"image"
+
+    asyncio.run(main())
+
+    report = get_dedup_report(storage=storage, capsys=capsys)
+    assert report["num_illust_binaries"] == 2
+    assert report["num_refs"] == 2
+    assert report["num_blobs"] == 1
+    assert report["num_missing_blobs"] == 0
+    assert report["logical_size"] == 10
+
+    asyncio.run(storage.close())
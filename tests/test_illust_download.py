@@ -0,0 +1,232 @@
+import asyncio
+import json
+import threading
+import time
+from collections.abc import Iterator
+from io import BytesIO
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+from fake_pixiv import IMAGE_BODY, FakePixivAPI, make_illust, make_response
+from requests import Response
+from urllib3.exceptions import ProtocolError
+
+from xivbookmarkdl.dao.illust_binary import IllustBinaryDao, IllustPageRecord
+from xivbookmarkdl.illust_download import (
+    IllustDownloadPipeline,
+    IncompleteDownloadError,
+    download_illust_image,
+    get_illust_image_keys,
+    iter_illust_image_chunks,
+)
+from xivbookmarkdl.rate_limiter import RateLimiter
+from xivbookmarkdl.storage.filesystem import StorageFilesystem
+
+
+class CutOffResponse(Response):
+    # the connection is cut after the first chunk of the body
+    def iter_content(
+        self, chunk_size: int | None = 1, decode_unicode: bool = False
+    ) -> Iterator[bytes]:
+        yield IMAGE_BODY[:2]
+        raise ProtocolError("Connection broken: IncompleteRead")
+
+
+class CutOffOncePixivAPI(FakePixivAPI):
+    def get_response(self, url: str) -> Response:
+        if len(self.requested_urls) > 1:
+            return make_response(IMAGE_BODY)
+
+        response = CutOffResponse()
+        response.status_code = 200
+        response.raw = BytesIO()
+
+        return response
+
+
+def test_download_retries_cut_off_stream(tmp_path: Path) -> None:
+    api = CutOffOncePixivAPI(pages=[])
+    illust_dict = make_illust(10)
+    illust = SimpleNamespace(
+        id=illust_dict["id"], user=SimpleNamespace(id=illust_dict["user"]["id"])
+    )
+    image_url = illust_dict["meta_single_page"]["original_image_url"]
+
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            page = await download_illust_image(
+                api=api,
+                illust=illust,
+                image_url=image_url,
+                illust_binary_dao=IllustBinaryDao(storage=storage),
+                rate_limiter=RateLimiter.from_intervals(
+                    page_interval=0,
+                    download_interval=0,
+                    retry_interval=0,
+                    max_retries=1,
+                ),
+            )
+
+            assert page is not None
+            assert page.size == len(IMAGE_BODY)
+            assert await storage.read_bytes(key=page.key) == IMAGE_BODY
+
+    asyncio.run(main())
+
+    assert api.requested_urls == [image_url, image_url]
+
+
+class RateLimitedOncePixivAPI(FakePixivAPI):
+    def get_response(self, url: str) -> Response:
+        if len(self.requested_urls) > 1:
+            return make_response(IMAGE_BODY)
+
+        return make_response(b"", status_code=429)
+
+
+def test_download_slows_down_when_rate_limited(tmp_path: Path) -> None:
+    api = RateLimitedOncePixivAPI(pages=[])
+    illust_dict = make_illust(10)
+    illust = SimpleNamespace(
+        id=illust_dict["id"], user=SimpleNamespace(id=illust_dict["user"]["id"])
+    )
+    image_url = illust_dict["meta_single_page"]["original_image_url"]
+
+    rate_limiter = RateLimiter.from_intervals(
+        page_interval=0.001, download_interval=0.001, retry_interval=0, max_retries=1
+    )
+    initial_rate = rate_limiter.download.rate
+
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            page = await download_illust_image(
+                api=api,
+                illust=illust,
+                image_url=image_url,
+                illust_binary_dao=IllustBinaryDao(storage=storage),
+                rate_limiter=rate_limiter,
+            )
+
+            assert page is not None
+
+    asyncio.run(main())
+
+    assert api.requested_urls == [image_url, image_url]
+    # halved by the rate limit, then increased by the success
+    assert rate_limiter.download.rate == initial_rate / 2 + initial_rate / 10
+
+
+class SlowPixivAPI(FakePixivAPI):
+    # image requests take a while, counting how many are in flight
+    def __init__(self, pages: list[list[dict[str, Any]]]):
+        super().__init__(pages=pages)
+
+        self._lock = threading.Lock()
+        self.num_requests = 0
+        self.max_requests = 0
+
+    def get_response(self, url: str) -> Response:
+        with self._lock:
+            self.num_requests += 1
+            self.max_requests = max(self.max_requests, self.num_requests)
+
+        time.sleep(0.02)
+
+        with self._lock:
+            self.num_requests -= 1
+
+        return make_response(IMAGE_BODY)
+
+
+def test_pipeline_downloads_concurrently(tmp_path: Path) -> None:
+    api = SlowPixivAPI(pages=[])
+    illusts = [
+        api.parse_json(json.dumps(make_illust(illust_id)))
+        for illust_id in range(10, 16)
+    ]
+
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            pipeline = IllustDownloadPipeline(
+                api=api,
+                illust_binary_dao=IllustBinaryDao(storage=storage),
+                rate_limiter=RateLimiter.from_intervals(
+                    page_interval=0.001,
+                    download_interval=0.001,
+                    retry_interval=0,
+                    max_retries=0,
+                    download_concurrency=3,
+                ),
+                download_concurrency=3,
+            )
+            try:
+                # the image of the first illust is already stored
+                stored_page = IllustPageRecord(
+                    key=get_illust_image_keys(illusts[0])[0], size=len(IMAGE_BODY)
+                )
+                pipeline.submit(illusts[0], stored_pages=[stored_page])
+                for illust in illusts[1:]:
+                    pipeline.submit(illust)
+
+                assert await pipeline.wait(illusts[0]) == [stored_page]
+                for illust in illusts[1:]:
+                    [page] = await pipeline.wait(illust)
+                    assert await storage.read_bytes(key=page.key) == IMAGE_BODY
+            finally:
+                await pipeline.close()
+
+    asyncio.run(main())
+
+    assert len(api.requested_urls) == 5
+    assert api.max_requests == 3
+
+
+async def read_chunks(response: Response) -> bytes:
+    chunks: list[bytes] = []
+    async for chunk in iter_illust_image_chunks(response=response, chunk_size=2):
+        chunks.append(chunk)
+
+    return b"".join(chunks)
+
+
+def test_iter_illust_image_chunks_checks_content_length() -> None:
+    assert asyncio.run(read_chunks(make_response(IMAGE_BODY))) == IMAGE_BODY
+
+    # the connection was closed before the end of the body
+    response = make_response(IMAGE_BODY)
+    response.headers["Content-Length"] = str(len(IMAGE_BODY) + 1)
+    with pytest.raises(IncompleteDownloadError):
+        asyncio.run(read_chunks(response))
+
+    # Content-Length is of the encoded body, which is not comparable
+    response.headers["Content-Encoding"] = "gzip"
+    assert asyncio.run(read_chunks(response)) == IMAGE_BODY
+
+
+def test_store_illust_binary_stream_without_staging(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def fail_to_stage(*args: Any, **kwargs: Any) -> None:
+        raise AssertionError("the stream is staged in a local file")
+
+    monkeypatch.setattr(
+        "xivbookmarkdl.dao.illust_binary.TemporaryDirectory", fail_to_stage
+    )
+
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            page = await IllustBinaryDao(storage=storage).store_illust_binary_stream(
+                illust_id=10,
+                user_id=1,
+                filename="10_p0.png",
+                chunks=iter_illust_image_chunks(
+                    response=make_response(IMAGE_BODY), chunk_size=2
+                ),
+            )
+
+            assert page.size == len(IMAGE_BODY)
+            assert await storage.read_bytes(key=page.key) == IMAGE_BODY
+
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+import asyncio
+import sqlite3
+from datetime import UTC, datetime
+from pathlib import Path
+
+from xivbookmarkdl.dao.illust_binary import IllustPageRecord
+from xivbookmarkdl.dao.illust_manifest import IllustManifest, IllustManifestDao
+
+
+def test_upsert_illust_manifest(tmp_path: Path) -> None:
+    manifest_path = tmp_path / "manifest" / "manifest.sqlite3"
+    manifest = IllustManifest(
+        illust_id=10,
+        user_id=1,
+        page_count=2,
+        pages=[
+            IllustPageRecord(key="1/10/10_p0.png", size=100, etag='"a"'),
+            IllustPageRecord(key="1/10/10_p1.png", size=200, sha256="b"),
+        ],
+        found_at=datetime(2020, 1, 1, tzinfo=UTC),
+    )
+
+    async def main() -> None:
+        illust_manifest_dao = IllustManifestDao(manifest_path=manifest_path)
+        try:
+            await illust_manifest_dao.upsert_illust_manifest(manifest)
+
+            # pages are replaced by the next upsert
+            updated_manifest = manifest.model_copy(
+                update={"pages": manifest.pages[:1], "found_at": None}
+            )
+            await illust_manifest_dao.upsert_illust_manifest(updated_manifest)
+
+            assert (
+                await illust_manifest_dao.get_illust_manifest(illust_id=10, user_id=1)
+                == updated_manifest
+            )
+            assert (
+                await illust_manifest_dao.get_illust_manifest(illust_id=10, user_id=2)
+                is None
+            )
+
+            await illust_manifest_dao.clear()
+            assert (
+                await illust_manifest_dao.get_illust_manifest(illust_id=10, user_id=1)
+                is None
+            )
+        finally:
+            illust_manifest_dao.close()
+
+    asyncio.run(main())
+
+
+def test_manifest_of_older_version(tmp_path: Path) -> None:
+    manifest_path = tmp_path / "manifest.sqlite3"
+
+    # keys were indexed without page records
+    with sqlite3.connect(manifest_path) as connection:
+        connection.execute(
+            "CREATE TABLE illusts (user_id INTEGER NOT NULL, "
+            "illust_id INTEGER NOT NULL, page_count INTEGER NOT NULL, "
+            "found_at TEXT, PRIMARY KEY (user_id, illust_id))"
+        )
+        connection.execute(
+            "CREATE TABLE illust_keys (user_id INTEGER NOT NULL, "
+            "illust_id INTEGER NOT NULL, key TEXT NOT NULL, "
+            "PRIMARY KEY (user_id, illust_id, key))"
+        )
+        connection.execute("INSERT INTO illusts VALUES (1, 10, 1, NULL)")
+        connection.execute("INSERT INTO illust_keys VALUES (1, 10, '1/10/10_p0.png')")
+    connection.close()
+
+    async def main() -> None:
+        illust_manifest_dao = IllustManifestDao(manifest_path=manifest_path)
+        try:
+            # keys without size are not records, the illust is checked in storage
+            manifest = await illust_manifest_dao.get_illust_manifest(
+                illust_id=10, user_id=1
+            )
+            assert manifest is not None
+            assert manifest.pages == []
+
+            await illust_manifest_dao.upsert_illust_manifest(
+                manifest.model_copy(
+                    update={"pages": [IllustPageRecord(key="1/10/10_p0.png", size=100)]}
+                )
+            )
+            manifest = await illust_manifest_dao.get_illust_manifest(
+                illust_id=10, user_id=1
+            )
+            assert manifest is not None
+            assert manifest.pages == [IllustPageRecord(key="1/10/10_p0.png", size=100)]
+        finally:
+            illust_manifest_dao.close()
+
+    asyncio.run(main())
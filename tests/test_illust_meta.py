@@ -0,0 +1,482 @@
+import asyncio
+import json
+from collections.abc import Awaitable, Callable
+from datetime import UTC, datetime
+from pathlib import Path
+
+from fake_pixiv import FakePixivAPI, make_illust
+
+from xivbookmarkdl.cli import compact_illust_meta, to_plain_json
+from xivbookmarkdl.dao.illust_binary import IllustPageRecord
+from xivbookmarkdl.dao.illust_meta import IllustMetaDao
+from xivbookmarkdl.dao.illust_meta_pack import (
+    META_PACK_DELTA_PREFIX,
+    META_PACK_INDEX_KEY,
+    META_PACK_LEASE_KEY,
+    META_PACK_SEGMENT_PREFIX,
+    IllustMetaPackDelta,
+    make_meta_pack_index,
+    merge_meta_pack_index,
+)
+from xivbookmarkdl.dao.storage_lease import StorageLeaseDao
+from xivbookmarkdl.storage.base import Storage, StorageObject
+from xivbookmarkdl.storage.filesystem import StorageFilesystem
+
+FOUND_AT = datetime(2026, 1, 1, tzinfo=UTC)
+
+
+class StorageFilesystemWithHook(StorageFilesystem):
+    # runs on_segment once, when the first segment is being written
+    def __init__(self, root_dir: Path, on_segment: Callable[[], Awaitable[None]]):
+        super().__init__(root_dir=root_dir)
+        self.on_segment: Callable[[], Awaitable[None]] | None = on_segment
+
+    async def upload_bytes(self, dest_key: str, data: bytes) -> StorageObject:
+        if dest_key.startswith(META_PACK_SEGMENT_PREFIX) and self.on_segment:
+            on_segment = self.on_segment
+            self.on_segment = None
+            await on_segment()
+
+        return await super().upload_bytes(dest_key=dest_key, data=data)
+
+
+class StorageFilesystemCountingReads(StorageFilesystem):
+    def __init__(self, root_dir: Path):
+        super().__init__(root_dir=root_dir)
+        self.read_keys: list[str] = []
+
+    async def read_bytes(self, key: str) -> bytes:
+        self.read_keys.append(key)
+        return await super().read_bytes(key=key)
+
+
+async def list_keys(storage: Storage, prefix: str) -> list[str]:
+    return sorted([key async for key in storage.iter_with_prefix(prefix=prefix)])
+
+
+async def get_versions(
+    storage: Storage, illust_ids: list[tuple[int, int]]
+) -> dict[int, str | None]:
+    # read by a new DAO, without the records cached by the writer
+    illust_meta_dao = IllustMetaDao(storage=storage, packed=True)
+
+    versions: dict[int, str | None] = {}
+    for illust_id, user_id in illust_ids:
+        illust_meta = await illust_meta_dao.get_illust_meta(
+            illust_id=illust_id, user_id=user_id
+        )
+        versions[illust_id] = (
+            illust_meta.illust["version"] if illust_meta is not None else None
+        )
+
+    return versions
+
+
+async def upsert_versions(
+    illust_meta_dao: IllustMetaDao, illust_ids: list[tuple[int, int]], version: str
+) -> None:
+    for illust_id, user_id in illust_ids:
+        await illust_meta_dao.upsert_illust_meta(
+            illust_id=illust_id,
+            user_id=user_id,
+            illust={"version": version},
+            found_at=FOUND_AT,
+        )
+
+
+async def compact(storage: Storage, keep_loose: bool = False) -> None:
+    await compact_illust_meta(
+        storage=storage,
+        illust_meta_dao=IllustMetaDao(storage=storage, packed=True, segment_size=3),
+        keep_loose=keep_loose,
+        worker_id="compactor",
+        lease_seconds=60,
+        lease_settle_seconds=0,
+    )
+
+
+def test_illust_meta_cache(tmp_path: Path) -> None:
+    async def main() -> None:
+        async with StorageFilesystemCountingReads(root_dir=tmp_path) as storage:
+            await upsert_versions(
+                IllustMetaDao(storage=storage), [(10, 1), (11, 1)], version="1"
+            )
+
+            illust_meta_dao = IllustMetaDao(storage=storage, cache_size=2)
+            storage.read_keys.clear()
+
+            # read once, then served from the cache, also when absent
+            for _ in range(2):
+                for illust_id in (10, 12):
+                    await illust_meta_dao.get_illust_meta(
+                        illust_id=illust_id, user_id=1
+                    )
+            assert storage.read_keys == ["1/10/illust.json", "1/12/illust.json"]
+            assert (illust_meta_dao.cache_hits, illust_meta_dao.cache_misses) == (2, 2)
+
+            # written through, 10 is evicted as the least recently used
+            await upsert_versions(illust_meta_dao, [(11, 1)], version="2")
+            storage.read_keys.clear()
+
+            illust_meta = await illust_meta_dao.get_illust_meta(illust_id=11, user_id=1)
+            assert illust_meta is not None
+            assert illust_meta.illust == {"version": "2"}
+            assert storage.read_keys == []
+
+            await illust_meta_dao.get_illust_meta(illust_id=10, user_id=1)
+            assert storage.read_keys == ["1/10/illust.json"]
+
+            # absence told by a listing is cached without a read
+            illust_meta_dao.set_illust_meta_absent(illust_id=13, user_id=1)
+            storage.read_keys.clear()
+            assert (
+                await illust_meta_dao.get_illust_meta(illust_id=13, user_id=1) is None
+            )
+            assert storage.read_keys == []
+
+            # without a cache, every get reads the storage
+            illust_meta_dao = IllustMetaDao(storage=storage, cache_size=0)
+            for _ in range(2):
+                await illust_meta_dao.get_illust_meta(illust_id=10, user_id=1)
+            assert storage.read_keys == ["1/10/illust.json"] * 2
+
+    asyncio.run(main())
+
+
+def test_to_plain_json() -> None:
+    illust = FakePixivAPI(pages=[]).parse_json(json.dumps(make_illust(10)))
+
+    plain_illust = to_plain_json(illust)
+
+    assert plain_illust == make_illust(10)
+    assert type(plain_illust) is dict
+    assert type(plain_illust["user"]) is dict
+
+
+def test_upsert_illust_meta_from_memory(tmp_path: Path) -> None:
+    pages = [IllustPageRecord(key="1/10/10_p0.png", size=5, sha256="a", etag='"b"')]
+
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            await IllustMetaDao(storage=storage).upsert_illust_meta(
+                illust_id=10,
+                user_id=1,
+                illust=make_illust(10, user_id=1),
+                found_at=FOUND_AT,
+                pages=pages,
+            )
+
+            # illust.json holds IllustMeta, the ids are in its key
+            meta_dict = json.loads((tmp_path / "1/10/illust.json").read_bytes())
+            assert sorted(meta_dict) == ["found_at", "illust", "pages", "updated_at"]
+
+            # read back by a new DAO, without the record cached by the writer
+            illust_meta = await IllustMetaDao(storage=storage).get_illust_meta(
+                illust_id=10, user_id=1
+            )
+            assert illust_meta is not None
+            assert (illust_meta.illust_id, illust_meta.user_id) == (10, 1)
+            assert illust_meta.illust == make_illust(10, user_id=1)
+            assert illust_meta.found_at == FOUND_AT
+            assert illust_meta.pages == pages
+
+            # a broken illust.json is taken as absent
+            (tmp_path / "1/11").mkdir()
+            (tmp_path / "1/11/illust.json").write_bytes(b"{")
+            assert (
+                await IllustMetaDao(storage=storage).get_illust_meta(
+                    illust_id=11, user_id=1
+                )
+                is None
+            )
+
+    asyncio.run(main())
+
+
+def test_make_meta_pack_index() -> None:
+    pack_index = make_meta_pack_index(
+        segment_names={1: "b.jsonl", 2: "a.jsonl", 3: "b.jsonl"}
+    )
+
+    assert pack_index.segments == ["a.jsonl", "b.jsonl"]
+    assert pack_index.get_segment_name(1) == "b.jsonl"
+    assert pack_index.get_segment_name(2) == "a.jsonl"
+    assert pack_index.get_segment_name(4) is None
+    assert pack_index.get_segment_names() == {
+        1: "b.jsonl",
+        2: "a.jsonl",
+        3: "b.jsonl",
+    }
+
+
+def test_merge_meta_pack_index() -> None:
+    pack_index = make_meta_pack_index(
+        segment_names={1: "a.jsonl", 2: "a.jsonl"}, deltas=["a.jsonl"]
+    )
+
+    merged_pack_index = merge_meta_pack_index(
+        pack_index=pack_index,
+        deltas=[
+            IllustMetaPackDelta(segment="c.jsonl", illust_ids=[2], created_at=FOUND_AT),
+            IllustMetaPackDelta(
+                segment="b.jsonl", illust_ids=[2, 3], created_at=FOUND_AT
+            ),
+            # already folded in the index
+            IllustMetaPackDelta(segment="a.jsonl", illust_ids=[4], created_at=FOUND_AT),
+        ],
+    )
+
+    # later segments supersede earlier ones, whatever order the deltas are listed
+    assert merged_pack_index.get_segment_names() == {
+        1: "a.jsonl",
+        2: "c.jsonl",
+        3: "b.jsonl",
+    }
+    assert merged_pack_index.deltas == ["a.jsonl", "b.jsonl", "c.jsonl"]
+    # the index is not modified
+    assert pack_index.get_segment_names() == {1: "a.jsonl", 2: "a.jsonl"}
+
+
+def test_packed_illust_meta_flush(tmp_path: Path) -> None:
+    # illusts of many users, one illust each
+    illust_ids = [(illust_id, 1000 + illust_id) for illust_id in range(1, 8)]
+
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            illust_meta_dao = IllustMetaDao(
+                storage=storage, packed=True, compression="gzip", segment_size=3
+            )
+
+            for illust_id, user_id in illust_ids:
+                await illust_meta_dao.upsert_illust_meta(
+                    illust_id=illust_id,
+                    user_id=user_id,
+                    illust={"version": "old"},
+                    found_at=FOUND_AT,
+                )
+
+            # superseded by a later segment
+            await illust_meta_dao.upsert_illust_meta(
+                illust_id=1,
+                user_id=1001,
+                illust={"version": "new"},
+                found_at=FOUND_AT,
+            )
+            assert illust_meta_dao.flushed_seq == 6
+            await illust_meta_dao.flush()
+            assert illust_meta_dao.flushed_seq == illust_meta_dao.upserted_seq == 8
+
+            # a segment and its delta per flush, whichever users the illusts are
+            # posted by, without rewriting the index
+            segment_keys = await list_keys(storage, prefix=META_PACK_SEGMENT_PREFIX)
+            assert len(segment_keys) == 3
+            assert all(key.endswith(".jsonl.gz") for key in segment_keys)
+            assert len(await list_keys(storage, prefix=META_PACK_DELTA_PREFIX)) == 3
+            assert await list_keys(storage, prefix=META_PACK_INDEX_KEY) == []
+            assert await list_keys(storage, prefix="1001/") == []
+
+            assert await get_versions(storage, illust_ids=illust_ids) == {
+                1: "new",
+                2: "old",
+                3: "old",
+                4: "old",
+                5: "old",
+                6: "old",
+                7: "old",
+            }
+
+            # the record of another user is not returned
+            assert (
+                await IllustMetaDao(storage=storage, packed=True).get_illust_meta(
+                    illust_id=1, user_id=9999
+                )
+                is None
+            )
+
+    asyncio.run(main())
+
+
+def test_packed_illust_meta_writers(tmp_path: Path) -> None:
+    # writers sharing a storage, with the index read before the others flush
+    illust_ids = [(illust_id, 1000 + illust_id) for illust_id in range(1, 7)]
+
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            illust_meta_daos = [
+                IllustMetaDao(storage=storage, packed=True, segment_size=2)
+                for _ in range(3)
+            ]
+            for illust_meta_dao in illust_meta_daos:
+                assert (
+                    await illust_meta_dao.get_illust_meta(illust_id=1, user_id=1001)
+                    is None
+                )
+
+            await asyncio.gather(
+                *(
+                    upsert_versions(
+                        illust_meta_dao,
+                        illust_ids=illust_ids[index * 2 : index * 2 + 2],
+                        version=f"writer {index}",
+                    )
+                    for index, illust_meta_dao in enumerate(illust_meta_daos)
+                )
+            )
+
+            # no writer loses the records of the others
+            assert await get_versions(storage, illust_ids=illust_ids) == {
+                1: "writer 0",
+                2: "writer 0",
+                3: "writer 1",
+                4: "writer 1",
+                5: "writer 2",
+                6: "writer 2",
+            }
+
+    asyncio.run(main())
+
+
+def test_compact_illust_meta(tmp_path: Path) -> None:
+    illust_ids = [(illust_id, 1000 + illust_id) for illust_id in range(1, 8)]
+
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            loose_illust_meta_dao = IllustMetaDao(storage=storage)
+            packed_illust_meta_dao = IllustMetaDao(
+                storage=storage, packed=True, segment_size=2
+            )
+
+            # 1-2: loose only, 3-4: loose, then packed, 5-7: packed only
+            for illust_id, user_id in illust_ids[:4]:
+                await loose_illust_meta_dao.upsert_illust_meta(
+                    illust_id=illust_id,
+                    user_id=user_id,
+                    illust={"version": "loose"},
+                    found_at=FOUND_AT,
+                )
+            for illust_id, user_id in illust_ids[2:]:
+                await packed_illust_meta_dao.upsert_illust_meta(
+                    illust_id=illust_id,
+                    user_id=user_id,
+                    illust={"version": "packed"},
+                    found_at=FOUND_AT,
+                )
+            # 4: newer loose than packed
+            await loose_illust_meta_dao.upsert_illust_meta(
+                illust_id=4,
+                user_id=1004,
+                illust={"version": "newer loose"},
+                found_at=FOUND_AT,
+            )
+            await packed_illust_meta_dao.flush()
+
+            old_segment_keys = await list_keys(storage, prefix=META_PACK_SEGMENT_PREFIX)
+
+            await compact(storage)
+
+            segment_keys = await list_keys(storage, prefix=META_PACK_SEGMENT_PREFIX)
+            assert len(segment_keys) == 3
+            assert set(segment_keys).isdisjoint(old_segment_keys)
+
+            # the deltas are folded, and the lease is released
+            assert [
+                key
+                for key in await list_keys(storage, prefix="")
+                if not key.startswith(META_PACK_SEGMENT_PREFIX)
+            ] == [META_PACK_INDEX_KEY]
+
+            assert await get_versions(storage, illust_ids=illust_ids) == {
+                1: "loose",
+                2: "loose",
+                3: "packed",
+                4: "newer loose",
+                5: "packed",
+                6: "packed",
+                7: "packed",
+            }
+
+    asyncio.run(main())
+
+
+def test_compact_illust_meta_while_writing(tmp_path: Path) -> None:
+    illust_ids = [(illust_id, 1000 + illust_id) for illust_id in range(1, 6)]
+
+    async def main() -> None:
+        writer_storage = StorageFilesystem(root_dir=tmp_path)
+        writer_illust_meta_dao = IllustMetaDao(
+            storage=writer_storage, packed=True, segment_size=2
+        )
+
+        # 5: flushed by the writer after the compaction has read the index
+        async def write_after_snapshot() -> None:
+            await upsert_versions(
+                writer_illust_meta_dao, illust_ids=[(5, 1005)], version="new"
+            )
+            await writer_illust_meta_dao.flush()
+
+        async with (
+            writer_storage,
+            StorageFilesystemWithHook(
+                root_dir=tmp_path, on_segment=write_after_snapshot
+            ) as compactor_storage,
+        ):
+            await upsert_versions(
+                writer_illust_meta_dao, illust_ids=illust_ids, version="old"
+            )
+            await writer_illust_meta_dao.flush()
+
+            # a reader having read the index before the compaction
+            reader_illust_meta_dao = IllustMetaDao(
+                storage=writer_storage, packed=True, cache_size=0
+            )
+            assert (
+                await reader_illust_meta_dao.get_illust_meta(illust_id=1, user_id=1001)
+                is not None
+            )
+
+            await compact(compactor_storage)
+
+            # the delta written after the snapshot is neither folded nor deleted
+            delta_keys = await list_keys(writer_storage, prefix=META_PACK_DELTA_PREFIX)
+            assert len(delta_keys) == 1
+
+            assert await get_versions(writer_storage, illust_ids=illust_ids) == {
+                1: "old",
+                2: "old",
+                3: "old",
+                4: "old",
+                5: "new",
+            }
+
+            # the segments compacted away are found again from the new index
+            illust_meta = await reader_illust_meta_dao.get_illust_meta(
+                illust_id=4, user_id=1004
+            )
+            assert illust_meta is not None
+            assert illust_meta.illust["version"] == "old"
+
+    asyncio.run(main())
+
+
+def test_compact_illust_meta_leased(tmp_path: Path) -> None:
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            illust_meta_dao = IllustMetaDao(storage=storage, packed=True)
+            await upsert_versions(illust_meta_dao, illust_ids=[(1, 1001)], version="v")
+            await illust_meta_dao.flush()
+
+            lease = await StorageLeaseDao(storage=storage).acquire_lease(
+                lease_key=META_PACK_LEASE_KEY,
+                worker_id="another compactor",
+                lease_seconds=60,
+                settle_seconds=0,
+            )
+            assert lease is not None
+
+            # skipped while another compaction holds the lease
+            await compact(storage)
+
+            assert len(await list_keys(storage, prefix=META_PACK_DELTA_PREFIX)) == 1
+            assert await list_keys(storage, prefix=META_PACK_INDEX_KEY) == []
+
+    asyncio.run(main())
@@ -0,0 +1,65 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+from benchmarks.import_time import LAZY_MODULES, measure_import, parse_list
+
+
+def get_loaded_modules(code: str) -> set[str]:
+    # runs the code in a fresh process, returns the modules it has loaded
+    completed = subprocess.run(
+        [sys.executable, "-c", f"{code}\nprint(json.dumps(sorted(sys.modules)))"],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+    return set(json.loads(completed.stdout.splitlines()[-1]))
+
+
+def test_cli_imports_backends_lazily() -> None:
+    _, loaded_modules = measure_import("xivbookmarkdl.cli")
+
+    assert "xivbookmarkdl.cli" in loaded_modules
+    assert [
+        lazy_module
+        for lazy_module in parse_list(LAZY_MODULES)
+        if lazy_module in loaded_modules
+    ] == []
+
+
+def test_storage_backend_imported_when_selected(tmp_path: Path) -> None:
+    def create_storage_code(storage_type: str) -> str:
+        return (
+            "import json, sys\n"
+            "from xivbookmarkdl.cli import StorageConfig, create_storage\n"
+            "create_storage(StorageConfig.model_construct(\n"
+            f"    storage_type={storage_type!r},\n"
+            f"    root_dir={str(tmp_path)!r},\n"
+            "    storage_s3_bucket='bucket',\n"
+            "    storage_s3_region='us-east-1',\n"
+            "    storage_s3_endpoint_url=None,\n"
+            "    storage_s3_force_path_style=False,\n"
+            "    storage_s3_access_key_id='key',\n"
+            "    storage_s3_secret_access_key='secret',\n"
+            "    storage_s3_session_token=None,\n"
+            "    storage_s3_max_pool_connections=None,\n"
+            "    storage_s3_multipart_threshold_mib=8,\n"
+            "    storage_s3_multipart_chunksize_mib=8,\n"
+            "    storage_s3_transfer_concurrency=1,\n"
+            "    storage_s3_checksum_algorithm='none',\n"
+            "    storage_io_concurrency=None,\n"
+            "))"
+        )
+
+    loaded_modules = get_loaded_modules(create_storage_code("filesystem"))
+    assert "xivbookmarkdl.storage.filesystem" in loaded_modules
+    assert "xivbookmarkdl.storage.s3" not in loaded_modules
+    assert "boto3" not in loaded_modules
+
+    loaded_modules = get_loaded_modules(create_storage_code("s3"))
+    assert "xivbookmarkdl.storage.s3" in loaded_modules
+    assert "boto3" in loaded_modules
+    # the API client is not needed by the storage
+    assert "pixivpy3" not in loaded_modules
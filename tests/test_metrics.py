@@ -0,0 +1,83 @@
+import asyncio
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+from xivbookmarkdl.metrics import MetricsExporter, MetricsRegistry
+
+
+def create_registry() -> MetricsRegistry:
+    registry = MetricsRegistry()
+
+    requests = registry.counter(
+        "test_requests_total", "Requests", labelnames=["target"]
+    )
+    requests.inc(target="api")
+    requests.inc(2, target='image "original"')
+
+    registry.gauge("test_progress_timestamp_seconds", "Last progress").set(1.5)
+
+    latency = registry.histogram("test_seconds", "Latency", buckets=[0.1, 1.0])
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5.0)
+
+    return registry
+
+
+EXPECTED_EXPOSITION = """\
+# HELP test_requests_total Requests
+# TYPE test_requests_total counter
+test_requests_total{target="api"} 1.0
+test_requests_total{target="image \\"original\\""} 2.0
+# HELP test_progress_timestamp_seconds Last progress
+# TYPE test_progress_timestamp_seconds gauge
+test_progress_timestamp_seconds 1.5
+# HELP test_seconds Latency
+# TYPE test_seconds histogram
+test_seconds_bucket{le="0.1"} 1
+test_seconds_bucket{le="1.0"} 2
+test_seconds_bucket{le="+Inf"} 3
+test_seconds_sum 5.55
+test_seconds_count 3
+"""
+
+
+def test_render_exposition() -> None:
+    assert create_registry().render() == EXPECTED_EXPOSITION
+
+
+def test_metric_labels_must_match() -> None:
+    registry = MetricsRegistry()
+    requests = registry.counter("test_total", "Requests", labelnames=["target"])
+
+    with pytest.raises(ValueError):
+        requests.inc(reason="status")
+
+    with pytest.raises(ValueError):
+        requests.inc(-1, target="api")
+
+
+def test_exporter_serves_and_writes_metrics(tmp_path: Path) -> None:
+    registry = create_registry()
+    file_path = tmp_path / "metrics" / "xivbookmarkdl.prom"
+
+    async def main() -> None:
+        async with MetricsExporter(
+            registry=registry, port=0, host="127.0.0.1", file_path=file_path
+        ) as exporter:
+            assert exporter._server is not None
+            port = exporter._server.server_address[1]
+
+            def get(path: str) -> str:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}") as res:
+                    body: bytes = res.read()
+                    return body.decode("utf-8")
+
+            assert await asyncio.to_thread(get, "/metrics") == EXPECTED_EXPOSITION
+
+    asyncio.run(main())
+
+    # the final values are written when the exporter exits
+    assert file_path.read_text(encoding="utf-8") == EXPECTED_EXPOSITION
@@ -0,0 +1,117 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from xivbookmarkdl.profiling import PROFILER, Profiler, get_percentile, profiled
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def perf_counter(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr("xivbookmarkdl.profiling.time.perf_counter", clock.perf_counter)
+
+    return clock
+
+
+def test_get_percentile() -> None:
+    values = [float(value) for value in range(1, 21)]
+
+    assert get_percentile(values, 50) == 10
+    assert get_percentile(values, 95) == 19
+    assert get_percentile(values, 0) == 1
+    assert get_percentile([1.0], 95) == 1
+
+
+def test_profiler_summarizes_spans(clock: FakeClock) -> None:
+    profiler = Profiler()
+
+    # ignored while disabled
+    with profiler.span("page"):
+        clock.now += 1
+    assert profiler.summarize() == []
+
+    profiler.start()
+    for duration in [0.3, 0.1, 0.2]:
+        with profiler.span("download"):
+            clock.now += duration
+    with profiler.span("page"):
+        clock.now += 1
+    profiler.stop()
+
+    with profiler.span("page"):
+        clock.now += 1
+
+    summaries = {summary.name: summary for summary in profiler.summarize()}
+    assert list(summaries) == ["download", "page"]
+
+    download = summaries["download"]
+    assert download.count == 3
+    assert download.total_seconds == pytest.approx(0.6)
+    assert download.p50_seconds == pytest.approx(0.2)
+    assert download.p95_seconds == pytest.approx(0.3)
+    assert download.max_seconds == pytest.approx(0.3)
+
+    assert summaries["page"].count == 1
+
+    # a new run starts with no spans
+    profiler.start()
+    assert profiler.summarize() == []
+
+
+def test_profiler_writes_trace(clock: FakeClock, tmp_path: Path) -> None:
+    profiler = Profiler()
+    profiler.start(trace=True)
+
+    async def download(duration: float) -> None:
+        with profiler.span("download"):
+            clock.now += duration
+            await asyncio.sleep(0)
+
+    async def main() -> None:
+        clock.now += 1
+        await asyncio.gather(download(0.5), download(0.25))
+
+    asyncio.run(main())
+    profiler.stop()
+
+    trace_path = tmp_path / "trace" / "trace.json"
+    profiler.write_trace(trace_path)
+
+    trace = json.loads(trace_path.read_text(encoding="utf-8"))
+    events = trace["traceEvents"]
+    assert [event["name"] for event in events] == ["download", "download"]
+    assert all(event["ph"] == "X" for event in events)
+    assert events[0]["ts"] == pytest.approx(1_000_000)
+    # each task is on its own track
+    assert len({event["tid"] for event in events}) == 2
+
+
+def test_profiled_records_span(clock: FakeClock) -> None:
+    @profiled("meta_read")
+    async def read() -> int:
+        clock.now += 0.5
+        return 1
+
+    async def main() -> None:
+        assert await read() == 1
+
+    PROFILER.start()
+    try:
+        asyncio.run(main())
+    finally:
+        PROFILER.stop()
+
+    [summary] = PROFILER.summarize()
+    assert summary.name == "meta_read"
+    assert summary.count == 1
+    assert summary.max_seconds == pytest.approx(0.5)
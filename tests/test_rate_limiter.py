@@ -0,0 +1,138 @@
+import asyncio
+
+import pytest
+
+from xivbookmarkdl.rate_limiter import AdaptiveTokenBucket, RateLimiter
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+        self.sleeps: list[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float) -> None:
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch: pytest.MonkeyPatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr("xivbookmarkdl.rate_limiter.time.monotonic", clock.monotonic)
+    monkeypatch.setattr("xivbookmarkdl.rate_limiter.asyncio.sleep", clock.sleep)
+
+    return clock
+
+
+def create_bucket(rate: float = 10.0) -> AdaptiveTokenBucket:
+    return AdaptiveTokenBucket(
+        name="test",
+        rate=rate,
+        min_rate=1.0,
+        max_rate=20.0,
+        increase_step=1.0,
+        jitter=0.0,
+    )
+
+
+def test_aimd_rate(clock: FakeClock) -> None:
+    bucket = create_bucket()
+
+    # additive increase up to the max rate
+    for _ in range(5):
+        bucket.on_success()
+    assert bucket.rate == 15.0
+    for _ in range(10):
+        bucket.on_success()
+    assert bucket.rate == 20.0
+
+    # multiplicative decrease down to the min rate
+    bucket.on_rate_limited()
+    assert bucket.rate == 10.0
+    for _ in range(10):
+        bucket.on_rate_limited()
+    assert bucket.rate == 1.0
+
+
+def test_acquire_paces_at_rate(clock: FakeClock) -> None:
+    bucket = create_bucket(rate=10.0)
+
+    async def main() -> None:
+        # the burst token is used at once, then 1 token per 0.1 seconds
+        for _ in range(4):
+            await bucket.acquire()
+
+    asyncio.run(main())
+
+    assert clock.now == pytest.approx(0.3)
+    assert clock.sleeps == pytest.approx([0.1, 0.1, 0.1])
+
+
+def test_rate_limited_drops_saved_tokens(clock: FakeClock) -> None:
+    bucket = create_bucket(rate=10.0)
+
+    async def main() -> None:
+        # idle long enough to save the burst token
+        clock.now += 10.0
+        bucket.on_rate_limited()
+
+        # no burst right after the rate limit, paced at the decreased rate
+        await bucket.acquire()
+
+    asyncio.run(main())
+
+    assert clock.sleeps == pytest.approx([0.2])
+
+
+def test_invalid_rates() -> None:
+    with pytest.raises(ValueError):
+        AdaptiveTokenBucket(
+            name="test", rate=30.0, min_rate=1.0, max_rate=20.0, increase_step=1.0
+        )
+
+    with pytest.raises(ValueError):
+        AdaptiveTokenBucket(
+            name="test",
+            rate=10.0,
+            min_rate=1.0,
+            max_rate=20.0,
+            increase_step=1.0,
+            decrease_factor=1.0,
+        )
+
+
+def test_from_intervals() -> None:
+    rate_limiter = RateLimiter.from_intervals(
+        page_interval=2.0,
+        download_interval=0.5,
+        retry_interval=1.0,
+        max_retries=3,
+        download_concurrency=4,
+        download_interval_per_worker=True,
+    )
+
+    assert rate_limiter.api.rate == 0.5
+    assert rate_limiter.api.min_rate == 0.5 / 8
+    assert rate_limiter.api.max_rate == 0.5 * 4
+
+    # each of the concurrent downloads is paced at the download interval
+    assert rate_limiter.download.rate == 8.0
+    assert rate_limiter.download.burst == 4
+
+
+def test_backoff_is_exponential(clock: FakeClock) -> None:
+    rate_limiter = RateLimiter.from_intervals(
+        page_interval=1.0, download_interval=1.0, retry_interval=1.0, max_retries=3
+    )
+
+    async def main() -> None:
+        for retry_index in range(3):
+            await rate_limiter.backoff(retry_index=retry_index)
+
+    asyncio.run(main())
+
+    for retry_index, seconds in enumerate(clock.sleeps):
+        assert 0.5 * 2**retry_index <= seconds <= 1.5 * 2**retry_index
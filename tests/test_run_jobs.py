@@ -0,0 +1,81 @@
+import json
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from xivbookmarkdl.cli import (
+    add_crawl_arguments,
+    add_output_arguments,
+    add_storage_arguments,
+    load_job_configs,
+)
+
+
+def get_defaults() -> dict[str, Any]:
+    parser = ArgumentParser()
+    add_storage_arguments(parser)
+    add_output_arguments(parser)
+    add_crawl_arguments(parser)
+
+    return {
+        **vars(parser.parse_args([])),
+        "refresh_token": "token",
+        "root_dir": "/data",
+    }
+
+
+def write_job_file(tmp_path: Path, jobs: list[dict[str, Any]]) -> Path:
+    job_file = tmp_path / "jobs.json"
+    job_file.write_text(json.dumps(jobs), encoding="utf-8")
+
+    return job_file
+
+
+def test_load_job_configs(tmp_path: Path) -> None:
+    job_configs = load_job_configs(
+        job_file=write_job_file(
+            tmp_path,
+            jobs=[
+                {"type": "bookmark", "user_id": 12345, "packed_meta": True},
+                {"type": "search_tag", "keyword": "tag1", "packed_meta": True},
+                # illust meta of another storage are not shared
+                {"type": "search_tag", "keyword": "tag2", "root_dir": "/other"},
+            ],
+        ),
+        defaults=get_defaults(),
+    )
+
+    assert [job_config.packed_meta for job_config in job_configs] == [
+        True,
+        True,
+        False,
+    ]
+
+
+def test_load_job_configs_conflicting_illust_meta(tmp_path: Path) -> None:
+    # jobs on a storage share an IllustMetaDao
+    with pytest.raises(ValueError, match="Job 2"):
+        load_job_configs(
+            job_file=write_job_file(
+                tmp_path,
+                jobs=[
+                    {"type": "bookmark", "user_id": 12345, "packed_meta": True},
+                    {"type": "search_tag", "keyword": "tag1"},
+                ],
+            ),
+            defaults=get_defaults(),
+        )
+
+    with pytest.raises(ValueError, match="Job 2"):
+        load_job_configs(
+            job_file=write_job_file(
+                tmp_path,
+                jobs=[
+                    {"type": "bookmark", "user_id": 12345, "meta_segment_size": 10},
+                    {"type": "bookmark", "user_id": 67890, "meta_segment_size": 20},
+                ],
+            ),
+            defaults=get_defaults(),
+        )
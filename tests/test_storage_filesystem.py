@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from xivbookmarkdl.storage.base import StorageExecutor
+from xivbookmarkdl.storage.filesystem import StorageFilesystem
+
+
+def test_list_tree_skips_temporary_and_vanished_files(tmp_path: Path) -> None:
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            await storage.upload_bytes(dest_key="1/10/10_p0.png", data=b"image")
+
+            # left by an upload in progress
+            (tmp_path / "1" / "10" / ".10_p1.png.0123abcd.tmp").write_bytes(b"ima")
+
+            assert [obj.key async for obj in storage.list_tree(prefix="1/")] == [
+                "1/10/10_p0.png"
+            ]
+            assert [key async for key in storage.iter_with_prefix(prefix="1/10/")] == [
+                "1/10/10_p0.png"
+            ]
+
+            # deleted by another process while listing
+            assert storage._to_storage_object(tmp_path / "1" / "10" / "gone") is None
+
+    asyncio.run(main())
+
+
+def test_storage_executor_limits_concurrency() -> None:
+    executor = StorageExecutor(max_workers=2, thread_name_prefix="storage-test")
+
+    lock = threading.Lock()
+    num_running = 0
+    max_running = 0
+    thread_names: set[str] = set()
+
+    def blocking_io() -> None:
+        nonlocal num_running, max_running
+
+        with lock:
+            num_running += 1
+            max_running = max(max_running, num_running)
+            thread_names.add(threading.current_thread().name)
+
+        time.sleep(0.02)
+
+        with lock:
+            num_running -= 1
+
+    async def main() -> None:
+        await asyncio.gather(*[executor.run(blocking_io) for _ in range(6)])
+
+    asyncio.run(main())
+    executor.shutdown()
+
+    assert max_running == 2
+    assert all(name.startswith("storage-test") for name in thread_names)
+
+    # the pool is created again when used after shutdown
+    asyncio.run(main())
+    executor.shutdown()
+
+
+def test_filesystem_io_runs_on_storage_executor(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    thread_names: list[str] = []
+
+    read_bytes = Path.read_bytes
+
+    def recording_read_bytes(self: Path) -> bytes:
+        thread_names.append(threading.current_thread().name)
+        return read_bytes(self)
+
+    monkeypatch.setattr(Path, "read_bytes", recording_read_bytes)
+
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path) as storage:
+            await storage.upload_bytes(dest_key="1/10/illust.json", data=b"{}")
+
+            assert await storage.read_bytes(key="1/10/illust.json") == b"{}"
+
+    asyncio.run(main())
+
+    # not on the event loop nor on the default thread pool
+    assert len(thread_names) == 1
+    assert thread_names[0].startswith("storage-filesystem")
+
+
+def test_upload_copies_source_file(tmp_path: Path) -> None:
+    source_path = tmp_path / "10_p0.png"
+    source_path.write_bytes(b"image")
+
+    async def main() -> None:
+        async with StorageFilesystem(root_dir=tmp_path / "storage") as storage:
+            obj = await storage.upload(
+                source_path=source_path, dest_key="1/10/10_p0.png"
+            )
+            assert obj.size == 5
+
+            # the caller keeps its file, writes to it do not reach the storage
+            assert not (tmp_path / "storage" / obj.key).samefile(source_path)
+            with source_path.open("r+b") as fp:
+                fp.write(b"IMAGE")
+
+            assert await storage.read_bytes(key=obj.key) == b"image"
+
+    asyncio.run(main())
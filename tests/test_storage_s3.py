@@ -0,0 +1,219 @@
+import asyncio
+from collections.abc import AsyncIterator, Iterable
+
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import ANY, Stubber
+
+from xivbookmarkdl.storage.base import StorageDownloadNotFoundError, StorageObject
+from xivbookmarkdl.storage.s3 import StorageS3
+
+
+def create_storage(multipart_threshold: int = 4) -> StorageS3:
+    # parts are uploaded one by one, so that the calls come in order
+    return StorageS3(
+        bucket_name="bucket",
+        prefix="prefix/",
+        aws_region="us-east-1",
+        aws_endpoint_url="http://127.0.0.1:9",
+        force_path_style=True,
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+        aws_session_token=None,
+        multipart_threshold=multipart_threshold,
+        multipart_chunksize=4,
+        transfer_concurrency=1,
+        checksum_algorithm="none",
+    )
+
+
+async def iter_chunks(
+    chunks: Iterable[bytes], error: Exception | None = None
+) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+    if error is not None:
+        raise error
+
+
+def test_upload_stream_multipart() -> None:
+    storage = create_storage()
+
+    with Stubber(storage._get_s3_client()) as stubber:
+        stubber.add_response(
+            "create_multipart_upload",
+            {"UploadId": "upload"},
+            {"Bucket": "bucket", "Key": "prefix/key"},
+        )
+        for part_number in (1, 2, 3):
+            stubber.add_response(
+                "upload_part",
+                {"ETag": f'"{part_number}"'},
+                {
+                    "Bucket": "bucket",
+                    "Key": "prefix/key",
+                    "UploadId": "upload",
+                    "PartNumber": part_number,
+                    "Body": ANY,
+                },
+            )
+        stubber.add_response(
+            "complete_multipart_upload",
+            {"ETag": '"multipart-3"'},
+            {
+                "Bucket": "bucket",
+                "Key": "prefix/key",
+                "UploadId": "upload",
+                "MultipartUpload": {
+                    "Parts": [
+                        {"ETag": f'"{part_number}"', "PartNumber": part_number}
+                        for part_number in (1, 2, 3)
+                    ]
+                },
+            },
+        )
+
+        obj = asyncio.run(
+            storage.upload_stream(
+                dest_key="key", chunks=iter_chunks([b"abcdef", b"ghij"])
+            )
+        )
+
+        assert obj == StorageObject(key="key", size=10, etag='"multipart-3"')
+        stubber.assert_no_pending_responses()
+
+    asyncio.run(storage.close())
+
+
+def test_upload_stream_aborts_on_part_error() -> None:
+    storage = create_storage()
+
+    with Stubber(storage._get_s3_client()) as stubber:
+        stubber.add_response(
+            "create_multipart_upload",
+            {"UploadId": "upload"},
+            {"Bucket": "bucket", "Key": "prefix/key"},
+        )
+        stubber.add_client_error(
+            "upload_part", service_error_code="InvalidRequest", http_status_code=400
+        )
+        # without completing the upload or reading the rest of the stream
+        stubber.add_response(
+            "abort_multipart_upload",
+            {},
+            {"Bucket": "bucket", "Key": "prefix/key", "UploadId": "upload"},
+        )
+
+        with pytest.raises(ClientError):
+            asyncio.run(
+                storage.upload_stream(
+                    dest_key="key",
+                    chunks=iter_chunks([b"abcd", b"efgh", b"ijkl"]),
+                )
+            )
+
+        stubber.assert_no_pending_responses()
+
+    asyncio.run(storage.close())
+
+
+def test_upload_stream_aborts_on_stream_error() -> None:
+    # the upload is started before a part is filled
+    storage = create_storage(multipart_threshold=2)
+
+    with Stubber(storage._get_s3_client()) as stubber:
+        stubber.add_response(
+            "create_multipart_upload",
+            {"UploadId": "upload"},
+            {"Bucket": "bucket", "Key": "prefix/key"},
+        )
+        stubber.add_response(
+            "abort_multipart_upload",
+            {},
+            {"Bucket": "bucket", "Key": "prefix/key", "UploadId": "upload"},
+        )
+
+        # the download of the image fails in the middle
+        with pytest.raises(ConnectionError):
+            asyncio.run(
+                storage.upload_stream(
+                    dest_key="key",
+                    chunks=iter_chunks(
+                        [b"ab"], error=ConnectionError("download failed")
+                    ),
+                )
+            )
+
+        stubber.assert_no_pending_responses()
+
+    asyncio.run(storage.close())
+
+
+def test_link_copies_in_bucket() -> None:
+    storage = create_storage()
+
+    with Stubber(storage._get_s3_client()) as stubber:
+        stubber.add_response(
+            "copy_object",
+            {"CopyObjectResult": {"ETag": '"blob"'}},
+            {
+                "Bucket": "bucket",
+                "Key": "prefix/dest",
+                "CopySource": {"Bucket": "bucket", "Key": "prefix/source"},
+            },
+        )
+        stubber.add_response(
+            "head_object",
+            {"ContentLength": 5, "ETag": '"blob"'},
+            {"Bucket": "bucket", "Key": "prefix/dest"},
+        )
+
+        obj = asyncio.run(storage.link(source_key="source", dest_key="dest"))
+
+        assert obj == StorageObject(key="dest", size=5, etag='"blob"')
+        stubber.assert_no_pending_responses()
+
+    asyncio.run(storage.close())
+
+
+def test_link_missing_source() -> None:
+    storage = create_storage()
+
+    with Stubber(storage._get_s3_client()) as stubber:
+        stubber.add_client_error(
+            "copy_object", service_error_code="NoSuchKey", http_status_code=404
+        )
+
+        with pytest.raises(StorageDownloadNotFoundError):
+            asyncio.run(storage.link(source_key="source", dest_key="dest"))
+
+    asyncio.run(storage.close())
+
+
+def test_s3_client_is_reused() -> None:
+    storage = StorageS3(
+        bucket_name="bucket",
+        prefix="",
+        aws_region="us-east-1",
+        aws_endpoint_url="http://127.0.0.1:9",
+        force_path_style=True,
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+        aws_session_token=None,
+        max_pool_connections=32,
+    )
+
+    # one client and its connection pool for all operations
+    s3_client = storage._get_s3_client()
+    assert storage._get_s3_client() is s3_client
+    assert vars(s3_client.meta.config)["max_pool_connections"] == 32
+    # the executor runs as many calls as the pool has connections
+    assert storage._executor.max_workers == 32
+
+    # a client is created again when used after close
+    asyncio.run(storage.close())
+    assert storage._s3_client is None
+    assert storage._get_s3_client() is not s3_client
+
+    asyncio.run(storage.close())
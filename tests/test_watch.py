@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+from test_run_jobs import get_defaults
+
+from xivbookmarkdl.cli import BookmarkConfig, poll_crawl
+
+
+class StopPolling(Exception):
+    pass
+
+
+def test_poll_interval_adapts(monkeypatch: pytest.MonkeyPatch) -> None:
+    config = BookmarkConfig.model_validate(
+        {
+            **get_defaults(),
+            "user_id": 12345,
+            "recrawl": True,
+            "watch": True,
+            "watch_interval": 100.0,
+            "watch_min_interval": 40.0,
+            "watch_max_interval": 200.0,
+        }
+    )
+
+    # new illusts twice, nothing new twice, a failure, then nothing new again
+    results: list[int | Exception] = [5, 5, 0, 0, RuntimeError("API error"), 0]
+    poll_configs: list[BookmarkConfig] = []
+
+    async def crawl_func(poll_config: BookmarkConfig) -> int:
+        poll_configs.append(poll_config)
+
+        result = results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+    poll_intervals: list[float] = []
+
+    async def sleep(seconds: float) -> None:
+        poll_intervals.append(seconds)
+        if len(results) == 0:
+            raise StopPolling
+
+    monkeypatch.setattr("xivbookmarkdl.cli.asyncio.sleep", sleep)
+
+    with pytest.raises(StopPolling):
+        asyncio.run(poll_crawl(config=config, crawl_func=crawl_func))
+
+    # halved while new illusts are found, slowed down while idle,
+    # and backed off after a failure
+    assert poll_intervals == [50.0, 40.0, 60.0, 90.0, 200.0, 200.0]
+
+    # only the first poll recrawls, the one after the failure resumes it
+    assert [
+        (poll_config.recrawl, poll_config.resume) for poll_config in poll_configs
+    ] == [
+        (True, False),
+        (False, False),
+        (False, False),
+        (False, False),
+        (False, False),
+        (False, True),
+    ]
@@ -1,28 +1,84 @@
+import asyncio
 import json
 import logging
+import multiprocessing
 import os
-import time
+import socket
 from argparse import ArgumentParser, Namespace
 from asyncio import iscoroutinefunction
-from datetime import UTC, datetime
+from collections import deque
+from collections.abc import Awaitable, Callable, Coroutine
+from contextlib import AsyncExitStack
+from datetime import UTC, date, datetime, timedelta
+from functools import partial
 from pathlib import Path
-from tempfile import TemporaryDirectory
-from typing import Any, Literal
+from typing import TYPE_CHECKING, Any, Literal
+from urllib.parse import quote
+from uuid import uuid4
 
 from dotenv import load_dotenv
-from pixivpy3 import AppPixivAPI
 from pydantic import BaseModel
 
-from .dao.illust_binary import IllustBinaryDao
-from .dao.illust_meta import IllustMetaDao
-from .storage.base import Storage
-from .storage.filesystem import StorageFilesystem
-from .storage.s3 import StorageS3
+from .dao.crawl_checkpoint import CrawlCheckpoint, CrawlCheckpointDao
+from .dao.crawl_shard import (
+    CrawlShard,
+    CrawlShardDao,
+    plan_crawl_shards,
+)
+from .dao.crawl_watermark import (
+    BookmarkWatermark,
+    CrawlWatermark,
+    CrawlWatermarkDao,
+    make_bookmark_watermark,
+)
+from .dao.illust_binary import (
+    BLOB_PREFIX,
+    IllustBinaryDao,
+    IllustPageRecord,
+    get_valid_illust_pages,
+    is_illust_binary_key,
+)
+from .dao.illust_manifest import IllustManifest, IllustManifestDao
+from .dao.illust_meta import IllustMetaDao, get_illust_meta_key
+from .dao.illust_meta_pack import (
+    META_PACK_LEASE_KEY,
+    MetaCompression,
+    parse_meta_pack_segment_key,
+)
+from .dao.storage_lease import (
+    StorageLease,
+    StorageLeaseDao,
+    StorageLeaseLostError,
+    run_with_lease,
+)
+from .illust_download import (
+    IllustDownloadPipeline,
+    get_illust_image_keys,
+    get_illust_image_urls,
+)
+from .metrics import (
+    API_PAGE_SECONDS,
+    ERRORS,
+    ILLUSTS_COMMITTED,
+    LAST_PROGRESS_TIMESTAMP,
+    RETRIES,
+    SKIP_CHECKS,
+    MetricsExporter,
+)
+from .pixiv_auth import PixivAuthKeeper
+from .profiling import PROFILER, profile_run, profiled
+from .progress import ProgressFormat, emit_progress, set_progress_format
+from .rate_limiter import RateLimiter, RetryLimitExceededError
+from .storage.base import ChecksumAlgorithm, Storage, StorageObject
+from .storage.metered import MeteredStorage
+
+if TYPE_CHECKING:
+    from pixivpy3 import AppPixivAPI
 
 logger = logging.getLogger("xivbookmarkdl")
 
 
-class BookmarkConfig(BaseModel):
+class StorageConfig(BaseModel):
     storage_type: Literal["filesystem", "s3"]
     root_dir: str | None
     storage_s3_bucket: str | None
@@ -32,338 +88,1800 @@ class BookmarkConfig(BaseModel):
     storage_s3_access_key_id: str | None
     storage_s3_secret_access_key: str | None
     storage_s3_session_token: str | None
+    storage_s3_max_pool_connections: int | None
+    storage_s3_multipart_threshold_mib: int
+    storage_s3_multipart_chunksize_mib: int
+    storage_s3_transfer_concurrency: int
+    storage_s3_checksum_algorithm: ChecksumAlgorithm
+    storage_io_concurrency: int | None
+
+
+class BookmarkConfig(StorageConfig):
     refresh_token: str
     user_id: int
     recrawl: bool
+    resume: bool
+    incremental: bool
+    incremental_max_empty_pages: int
     download_interval: float
     page_interval: float
     retry_interval: float
-
-
-class SearchTagConfig(BaseModel):
-    storage_type: Literal["filesystem", "s3"]
-    root_dir: str | None
-    storage_s3_bucket: str | None
-    storage_s3_region: str | None
-    storage_s3_endpoint_url: str | None
-    storage_s3_force_path_style: bool
-    storage_s3_access_key_id: str | None
-    storage_s3_secret_access_key: str | None
-    storage_s3_session_token: str | None
+    max_retries: int
+    download_concurrency: int
+    download_interval_per_worker: bool
+    dedup: bool
+    meta_cache_size: int
+    packed_meta: bool
+    meta_compression: MetaCompression
+    meta_segment_size: int
+    manifest_path: str | None
+    watch: bool
+    watch_interval: float
+    watch_min_interval: float
+    watch_max_interval: float
+
+
+class SearchTagConfig(StorageConfig):
     refresh_token: str
     keyword: str
     recrawl: bool
+    resume: bool
+    incremental: bool
     desc: bool
     download_interval: float
     page_interval: float
     retry_interval: float
+    max_retries: int
+    download_concurrency: int
+    download_interval_per_worker: bool
+    dedup: bool
+    meta_cache_size: int
+    packed_meta: bool
+    meta_compression: MetaCompression
+    meta_segment_size: int
+    manifest_path: str | None
+    watch: bool
+    watch_interval: float
+    watch_min_interval: float
+    watch_max_interval: float
+
+
+class SearchTagShardConfig(StorageConfig):
+    refresh_token: str
+    keyword: str
+    recrawl: bool
+    download_interval: float
+    page_interval: float
+    retry_interval: float
+    max_retries: int
+    download_concurrency: int
+    download_interval_per_worker: bool
+    dedup: bool
+    meta_cache_size: int
+    packed_meta: bool
+    meta_compression: MetaCompression
+    meta_segment_size: int
+    manifest_path: str | None
+    shard_start_date: date
+    shard_end_date: date | None
+    shard_days: int
+    shard_workers: int
+    lease_seconds: float
+    lease_settle_seconds: float
+
+
+class RebuildIndexConfig(StorageConfig):
+    meta_cache_size: int
+    packed_meta: bool
+    meta_compression: MetaCompression
+    meta_segment_size: int
+    manifest_path: str
+
+
+class CompactMetaConfig(StorageConfig):
+    meta_cache_size: int
+    meta_compression: MetaCompression
+    meta_segment_size: int
+    keep_loose: bool
+    lease_seconds: float
+    lease_settle_seconds: float
+
+
+def get_storage_io_concurrency(config: StorageConfig, download_concurrency: int) -> int:
+    # size the storage threads to the download concurrency by default
+    return config.storage_io_concurrency or max(10, download_concurrency * 2)
+
+
+# storage backends are imported only when selected,
+# boto3 takes longer to import than the rest of the CLI
+def create_storage_filesystem(
+    config: StorageConfig, download_concurrency: int
+) -> Storage:
+    from .storage.filesystem import StorageFilesystem
+
+    if not config.root_dir:
+        raise ValueError("root_dir is required for filesystem")
+
+    return StorageFilesystem(
+        root_dir=Path(config.root_dir),
+        io_concurrency=get_storage_io_concurrency(config, download_concurrency),
+    )
+
+
+def create_storage_s3(config: StorageConfig, download_concurrency: int) -> Storage:
+    from .storage.s3 import MIB, StorageS3
+
+    prefix = None
+
+    root_dir_string = config.root_dir
+    if root_dir_string:
+        # 末尾にスラッシュを追加
+        if not root_dir_string.endswith("/"):
+            root_dir_string += "/"
+
+        prefix = root_dir_string
+
+    if not config.storage_s3_bucket:
+        raise ValueError("storage_s3_bucket is required for s3")
+
+    return StorageS3(
+        bucket_name=config.storage_s3_bucket,
+        prefix=prefix,
+        aws_region=config.storage_s3_region,
+        aws_endpoint_url=config.storage_s3_endpoint_url,
+        force_path_style=config.storage_s3_force_path_style,
+        aws_access_key_id=config.storage_s3_access_key_id,
+        aws_secret_access_key=config.storage_s3_secret_access_key,
+        aws_session_token=config.storage_s3_session_token,
+        # a connection for each storage thread by default
+        max_pool_connections=(
+            config.storage_s3_max_pool_connections
+            or get_storage_io_concurrency(config, download_concurrency)
+        ),
+        io_concurrency=get_storage_io_concurrency(config, download_concurrency),
+        multipart_threshold=config.storage_s3_multipart_threshold_mib * MIB,
+        multipart_chunksize=config.storage_s3_multipart_chunksize_mib * MIB,
+        transfer_concurrency=config.storage_s3_transfer_concurrency,
+        checksum_algorithm=config.storage_s3_checksum_algorithm,
+    )
+
+
+STORAGE_FACTORIES: dict[str, Callable[[StorageConfig, int], Storage]] = {
+    "filesystem": create_storage_filesystem,
+    "s3": create_storage_s3,
+}
+
+
+def create_storage(config: StorageConfig, download_concurrency: int = 1) -> Storage:
+    storage_factory = STORAGE_FACTORIES.get(config.storage_type)
+    if storage_factory is None:
+        raise ValueError(f"Unknown storage_type: {config.storage_type}")
+
+    return MeteredStorage(
+        storage_factory(config, download_concurrency),
+        backend=config.storage_type,
+    )
+
+
+def create_pixiv_api() -> "AppPixivAPI":
+    # pixivpy3 pulls in requests, so subcommands without the API do not import it
+    from pixivpy3 import AppPixivAPI
+
+    return AppPixivAPI()
+
+
+def create_illust_meta_dao(
+    storage: Storage,
+    config: BookmarkConfig
+    | SearchTagConfig
+    | SearchTagShardConfig
+    | RebuildIndexConfig,
+) -> IllustMetaDao:
+    return IllustMetaDao(
+        storage=storage,
+        cache_size=config.meta_cache_size,
+        packed=config.packed_meta,
+        compression=config.meta_compression,
+        segment_size=config.meta_segment_size,
+    )
+
+
+@profiled("skip_check")
+async def filter_new_illusts(
+    illusts: list[Any],
+    illust_meta_dao: IllustMetaDao,
+    illust_binary_dao: IllustBinaryDao,
+    illust_manifest_dao: IllustManifestDao | None,
+) -> tuple[list[Any], dict[tuple[int, int], list[IllustPageRecord]]]:
+    # check completeness of illusts in a page at once, and keep the order.
+    # returns new illusts and their valid pages already stored,
+    # so that only missing or broken pages are downloaded
+    unknown_illusts: list[Any] = []
+    for illust in illusts:
+        if illust_manifest_dao is not None:
+            manifest = await illust_manifest_dao.get_illust_manifest(
+                illust_id=int(illust.id), user_id=int(illust.user.id)
+            )
+            if manifest is not None:
+                manifest_keys = {page.key for page in manifest.pages if page.size > 0}
+                if all(key in manifest_keys for key in get_illust_image_keys(illust)):
+                    SKIP_CHECKS.inc(result="manifest")
+                    continue
+
+        unknown_illusts.append(illust)
+
+    if len(unknown_illusts) == 0:
+        return [], {}
+
+    # fallback to storage for illusts unknown to the manifest
+    objects_by_illust = await illust_binary_dao.list_illust_objects_many(
+        illust_ids=[
+            (int(illust.id), int(illust.user.id)) for illust in unknown_illusts
+        ],
+    )
+
+    new_illusts: list[Any] = []
+    stored_pages_by_illust: dict[tuple[int, int], list[IllustPageRecord]] = {}
+    for illust in unknown_illusts:
+        illust_id = int(illust.id)
+        user_id = int(illust.user.id)
+
+        objects_by_key = {
+            obj.key: obj for obj in objects_by_illust[(illust_id, user_id)]
+        }
+        meta_key = get_illust_meta_key(illust_id=illust_id, user_id=user_id)
+
+        illust_meta = None
+        if meta_key in objects_by_key or illust_meta_dao.packed:
+            # packed illust meta are not in the listing
+            illust_meta = await illust_meta_dao.get_illust_meta(
+                illust_id=illust_id,
+                user_id=user_id,
+                check_loose=meta_key in objects_by_key,
+            )
+        else:
+            # no need to download illust.json again on commit
+            illust_meta_dao.set_illust_meta_absent(illust_id=illust_id, user_id=user_id)
+
+        image_keys = get_illust_image_keys(illust)
+        stored_pages = get_valid_illust_pages(
+            image_keys=image_keys,
+            objects_by_key=objects_by_key,
+            recorded_pages=illust_meta.pages if illust_meta is not None else None,
+        )
+
+        # illust.json is committed after all of the images are stored
+        if illust_meta is None or len(stored_pages) != len(image_keys):
+            SKIP_CHECKS.inc(result="new")
+            new_illusts.append(illust)
+            stored_pages_by_illust[(illust_id, user_id)] = stored_pages
+            continue
+
+        SKIP_CHECKS.inc(result="storage")
+
+        if illust_manifest_dao is not None:
+            await illust_manifest_dao.upsert_illust_manifest(
+                IllustManifest(
+                    illust_id=illust_id,
+                    user_id=user_id,
+                    page_count=len(image_keys),
+                    pages=stored_pages,
+                    found_at=illust_meta.found_at,
+                )
+            )
+
+    return new_illusts, stored_pages_by_illust
+
+
+def to_plain_json(value: Any) -> Any:
+    # JsonDict of pixivpy answers None for any attribute, which pydantic takes as
+    # a serializer hook, so copy it into plain dicts instead of a JSON round trip
+    if isinstance(value, dict):
+        return {key: to_plain_json(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_plain_json(item) for item in value]
+
+    return value
+
+
+def get_illust_create_date(illust: Any) -> datetime:
+    return datetime.fromisoformat(str(illust.create_date))
+
+
+def get_watermark_start_date(watermark: CrawlWatermark) -> str:
+    # search dates are days in the time zone of pixiv,
+    # start a day earlier not to miss illusts around the day boundary
+    return (watermark.create_date - timedelta(days=1)).date().isoformat()
+
+
+async def commit_illusts(
+    illust_download_pipeline: IllustDownloadPipeline,
+    illusts_asc: list[Any],
+    illust_meta_dao: IllustMetaDao,
+    illust_manifest_dao: IllustManifestDao | None,
+    updated_at_utc: datetime,
+    progress_prefix: str | None = None,
+) -> list[Any]:
+    # commit illust.json in asc order
+    # only after all of its images are stored and preceding illusts are committed.
+    # returns the illusts committed with missing pages, which are fetched again
+    # by the next run, so watermarks must not pass them
+    for illust in illusts_asc:
+        illust_download_pipeline.submit(illust)
+
+    incomplete_illusts: list[Any] = []
+
+    for illust_index, illust in enumerate(illusts_asc):
+        stored_pages = await illust_download_pipeline.wait(illust)
+
+        user = illust.user
+
+        emit_progress(
+            "illust_commit",
+            " ".join(
+                [
+                    *([progress_prefix] if progress_prefix else []),
+                    f"Index {illust_index + 1}/{len(illusts_asc)}",
+                    str(user.id),
+                    str(user.name),
+                    str(illust.id),
+                    str(illust.title),
+                ]
+            ),
+            index=illust_index + 1,
+            total=len(illusts_asc),
+            user_id=int(user.id),
+            user_name=user.name,
+            illust_id=int(illust.id),
+            illust_title=illust.title,
+            num_pages=len(stored_pages),
+        )
+
+        illust_meta = await illust_meta_dao.upsert_illust_meta(
+            illust_id=int(illust.id),
+            user_id=int(user.id),
+            illust=to_plain_json(illust),
+            found_at=updated_at_utc,
+            pages=stored_pages,
+        )
+
+        if illust_manifest_dao is not None:
+            await illust_manifest_dao.upsert_illust_manifest(
+                IllustManifest(
+                    illust_id=int(illust.id),
+                    user_id=int(user.id),
+                    page_count=len(get_illust_image_urls(illust)),
+                    pages=stored_pages,
+                    found_at=illust_meta.found_at,
+                )
+            )
+
+        if len(stored_pages) != len(get_illust_image_urls(illust)):
+            incomplete_illusts.append(illust)
+
+        ILLUSTS_COMMITTED.inc()
+        LAST_PROGRESS_TIMESTAMP.set_to_current_time()
+
+    return incomplete_illusts
+
+
+def is_rate_limited_result(result: Any) -> bool:
+    error = result.error
+    if not error:
+        return False
+
+    return "rate limit" in str(error.message).lower()
+
+
+async def fetch_result(rate_limiter: RateLimiter, func: Any) -> Any:
+    for retry_index in range(rate_limiter.max_retries + 1):
+        await rate_limiter.api.acquire()
+
+        # API calls are blocking, so call it in a thread not to stall downloads
+        with API_PAGE_SECONDS.time(), PROFILER.span("page_fetch"):
+            result = await asyncio.to_thread(func)
+
+        if result.illusts is not None:
+            rate_limiter.api.on_success()
+            LAST_PROGRESS_TIMESTAMP.set_to_current_time()
+            return result
+
+        logger.warning(f"Failed to fetch illusts (retry: {retry_index}): {result}")
+
+        reason = "error"
+        if is_rate_limited_result(result):
+            rate_limiter.api.on_rate_limited()
+            reason = "rate_limited"
+
+        if retry_index < rate_limiter.max_retries:
+            RETRIES.inc(target="api", reason=reason)
+            await rate_limiter.backoff(retry_index=retry_index)
+
+    ERRORS.inc(target="api", reason="retry_limit")
+    raise RetryLimitExceededError("Failed to fetch illusts")
+
+
+async def load_crawl_checkpoint(
+    checkpoint_dao: CrawlCheckpointDao | None,
+    resume: bool,
+) -> CrawlCheckpoint | None:
+    if checkpoint_dao is None:
+        return None
+
+    if resume:
+        checkpoint = await checkpoint_dao.get_checkpoint()
+        if checkpoint is not None:
+            return checkpoint
+
+        emit_progress(
+            "checkpoint_not_found", "No checkpoint found, start from the first page"
+        )
+
+    # discard the checkpoint of an interrupted run
+    checkpoint_dao.discard_checkpoint()
+
+    return None
 
 
 async def download_illusts_desc(
-    api: AppPixivAPI,
-    first_result: Any,
+    api: "AppPixivAPI",
+    first_func: Any,
     next_func: Any,
     illust_meta_dao: IllustMetaDao,
     illust_binary_dao: IllustBinaryDao,
     ignore_existence: bool,
     updated_at_utc: datetime,
-    download_interval: float = 1.0,
-    page_interval: float = 3.0,
-    retry_interval: float = 10.0,
-) -> None:
-    result = first_result
+    rate_limiter: RateLimiter,
+    download_concurrency: int = 1,
+    illust_manifest_dao: IllustManifestDao | None = None,
+    checkpoint_dao: CrawlCheckpointDao | None = None,
+    resume: bool = False,
+    watermark_dao: CrawlWatermarkDao | None = None,
+    watermark: BookmarkWatermark | None = None,
+    watermark_max_empty_pages: int = 3,
+) -> int:
+    # download images of discovered illusts while paging,
+    # the oldest illust is committed first, so download the latest discovered first
+    illust_download_pipeline = IllustDownloadPipeline(
+        api=api,
+        illust_binary_dao=illust_binary_dao,
+        rate_limiter=rate_limiter,
+        download_concurrency=download_concurrency,
+        lifo=True,
+    )
 
-    # search illusts in desc order
-    new_illusts_desc: list[Any] = []
-    while True:
-        illusts = result.illusts
-        page_new_illusts_desc: list[Any] = []
+    # illust ids and next cursors of the pages of this run,
+    # to save the watermark when all are committed
+    watermark_pages: list[tuple[list[int], int | None]] = []
+    incomplete_illusts: list[Any] = []
+
+    try:
+        new_illusts_desc: list[Any] = []
+        page_index = 0
 
-        for illust in illusts:
-            user = illust.user
+        result: Any = None
+        checkpoint = await load_crawl_checkpoint(
+            checkpoint_dao=checkpoint_dao, resume=resume
+        )
+        if checkpoint_dao is not None and checkpoint is not None:
+            pending_illusts = await checkpoint_dao.get_pending_illusts(
+                checkpoint=checkpoint
+            )
+            new_illusts_desc = [
+                api.parse_json(json.dumps(illust)) for illust in pending_illusts
+            ]
+            page_index = checkpoint.num_pages
+            emit_progress(
+                "resume",
+                f"Resume paging (found: {len(new_illusts_desc)})",
+                page=page_index,
+                num_found=len(new_illusts_desc),
+            )
 
+            stored_pages_by_illust: dict[tuple[int, int], list[IllustPageRecord]] = {}
             if not ignore_existence:
-                old_meta = await illust_meta_dao.get_illust_meta(
-                    illust_id=int(illust.id), user_id=int(user.id)
+                # some of the pending illusts may have been committed
+                # before interruption
+                new_illusts_desc, stored_pages_by_illust = await filter_new_illusts(
+                    illusts=new_illusts_desc,
+                    illust_meta_dao=illust_meta_dao,
+                    illust_binary_dao=illust_binary_dao,
+                    illust_manifest_dao=illust_manifest_dao,
                 )
-                if old_meta is not None:
-                    downloaded_illust_keys = (
-                        await illust_binary_dao.get_downloaded_illust_keys(
-                            illust_id=int(illust.id),
-                            user_id=int(user.id),
-                        )
-                    )
 
-                    num_local_pages = len(downloaded_illust_keys)
-                    num_remote_pages = (
-                        1 if illust.meta_single_page else len(illust.meta_pages)
-                    )
+            for illust in new_illusts_desc:
+                illust_download_pipeline.submit(
+                    illust,
+                    stored_pages=stored_pages_by_illust.get(
+                        (int(illust.id), int(illust.user.id))
+                    ),
+                )
 
-                    if num_local_pages == num_remote_pages:
-                        continue
+            if checkpoint.next_qs:
+                result = await fetch_result(
+                    rate_limiter=rate_limiter,
+                    func=partial(next_func, **checkpoint.next_qs),
+                )
+        else:
+            result = await fetch_result(rate_limiter=rate_limiter, func=first_func)
+
+        # search illusts in desc order
+        num_empty_pages = 0
+        while result is not None:
+            illusts = result.illusts
+            next_qs = api.parse_qs(result.next_url)
+
+            next_max_bookmark_id: int | None = None
+            if next_qs and "max_bookmark_id" in next_qs:
+                next_max_bookmark_id = int(next_qs["max_bookmark_id"])
+
+            # a resumed run does not know the newest bookmarks
+            if watermark_dao is not None and checkpoint is None:
+                watermark_pages.append(
+                    ([int(illust.id) for illust in illusts], next_max_bookmark_id)
+                )
 
-            page_new_illusts_desc.append(illust)
+            # stop at the boundary of the last sync, without existence checks
+            # of the illusts beyond it
+            reached_watermark = False
+            page_illusts: list[Any] = list(illusts)
+            if watermark is not None:
+                boundary_index = watermark.find_boundary(
+                    [int(illust.id) for illust in illusts]
+                )
+                if boundary_index is not None:
+                    page_illusts = page_illusts[:boundary_index]
+                    reached_watermark = True
+                elif next_max_bookmark_id is not None and watermark.covers_cursor(
+                    next_max_bookmark_id
+                ):
+                    # the newest illust of the last sync is not bookmarked anymore,
+                    # the rest of this page is checked for existence
+                    reached_watermark = True
+
+                SKIP_CHECKS.inc(len(illusts) - len(page_illusts), result="watermark")
+
+            page_new_illusts_desc: list[Any] = page_illusts
+            page_stored_pages_by_illust: dict[
+                tuple[int, int], list[IllustPageRecord]
+            ] = {}
+            if not ignore_existence:
+                (
+                    page_new_illusts_desc,
+                    page_stored_pages_by_illust,
+                ) = await filter_new_illusts(
+                    illusts=page_illusts,
+                    illust_meta_dao=illust_meta_dao,
+                    illust_binary_dao=illust_binary_dao,
+                    illust_manifest_dao=illust_manifest_dao,
+                )
 
-        # if no new illust in the current page, stop paging (desc search, asc download)
-        if len(page_new_illusts_desc) == 0:
-            print("No new illust found in page")
-            break
+            # if no new illust in the current page, stop paging
+            # (desc search, asc download).
+            # with a watermark, page down to it: it stays before illusts
+            # committed with missing pages, which are found again on the way.
+            # a watermark far down (or lost in the history) still stops paging
+            # after watermark_max_empty_pages pages without new illusts
+            if len(page_new_illusts_desc) == 0:
+                num_empty_pages += 1
+            else:
+                num_empty_pages = 0
+
+            if num_empty_pages > 0 and (
+                watermark is None or num_empty_pages >= watermark_max_empty_pages
+            ):
+                emit_progress(
+                    "page",
+                    f"No new illust found in {num_empty_pages} pages",
+                    page=page_index + 1,
+                    num_empty_pages=num_empty_pages,
+                )
+                break
 
-        new_illusts_desc.extend(page_new_illusts_desc)
-        print(f"Paging (found: {len(new_illusts_desc)})")
+            new_illusts_desc.extend(page_new_illusts_desc)
+            emit_progress(
+                "page",
+                f"Paging (found: {len(new_illusts_desc)})",
+                page=page_index + 1,
+                num_illusts=len(illusts),
+                num_new_illusts=len(page_new_illusts_desc),
+                num_found=len(new_illusts_desc),
+            )
 
-        next_qs = api.parse_qs(result.next_url)
-        if not next_qs:
-            break
+            for illust in page_new_illusts_desc:
+                illust_download_pipeline.submit(
+                    illust,
+                    stored_pages=page_stored_pages_by_illust.get(
+                        (int(illust.id), int(illust.user.id))
+                    ),
+                )
 
-        time.sleep(page_interval)
+            if reached_watermark:
+                next_qs = None
 
-        for retry_index in range(3):
-            next_result = next_func(**next_qs)
-            if next_result.illusts is not None:
-                break
-            print(next_result)
-            time.sleep(retry_interval * (retry_index + 1))
+            if checkpoint_dao is not None:
+                await checkpoint_dao.save_page(
+                    page_index=page_index,
+                    illusts=[to_plain_json(illust) for illust in page_new_illusts_desc],
+                    next_qs=next_qs or None,
+                )
+            page_index += 1
 
-        result = next_result
+            if reached_watermark:
+                emit_progress("page", "Reached the watermark", page=page_index)
+                break
 
-    print(f"New Illusts: {len(new_illusts_desc)}")
+            if not next_qs:
+                break
 
-    # download new illust in asc order
-    new_illusts_asc = list(reversed(new_illusts_desc))
-    for illust_index, illust in enumerate(new_illusts_asc):
-        user = illust.user
+            result = await fetch_result(
+                rate_limiter=rate_limiter,
+                func=partial(next_func, **next_qs),
+            )
 
-        print(
-            f"{illust_index}/{len(new_illusts_asc)}",
-            user.id,
-            user.name,
-            illust.id,
-            illust.title,
-        )
-        if illust.meta_single_page:
-            image_url = illust.meta_single_page.original_image_url
-            print(image_url)
-
-            with TemporaryDirectory() as _tmpdir:
-                tmpdir = Path(_tmpdir)
-
-                if api.download(image_url, path=str(tmpdir)):
-                    for file in tmpdir.iterdir():
-                        await illust_binary_dao.store_illust_binary(
-                            illust_id=int(illust.id),
-                            user_id=int(user.id),
-                            file=file,
-                        )
-
-                    time.sleep(download_interval)
-        else:
-            pages = illust.meta_pages
-            for page in pages:
-                image_url = page.image_urls.original
-                print(image_url)
+        if checkpoint_dao is not None and len(new_illusts_desc) > 0:
+            # paging has finished, only downloads of the pending illusts remain
+            await checkpoint_dao.save_cursor(num_pages=page_index, next_qs=None)
 
-                with TemporaryDirectory() as _tmpdir:
-                    tmpdir = Path(_tmpdir)
+        emit_progress(
+            "paging_done",
+            f"New Illusts: {len(new_illusts_desc)}",
+            num_pages=page_index,
+            num_found=len(new_illusts_desc),
+        )
 
-                    if api.download(image_url, path=str(tmpdir)):
-                        for file in tmpdir.iterdir():
-                            await illust_binary_dao.store_illust_binary(
-                                illust_id=int(illust.id),
-                                user_id=int(user.id),
-                                file=file,
-                            )
+        # commit new illusts in asc order
+        new_illusts_asc = list(reversed(new_illusts_desc))
+        incomplete_illusts = await commit_illusts(
+            illust_download_pipeline=illust_download_pipeline,
+            illusts_asc=new_illusts_asc,
+            illust_meta_dao=illust_meta_dao,
+            illust_manifest_dao=illust_manifest_dao,
+            updated_at_utc=updated_at_utc,
+        )
+    finally:
+        await illust_download_pipeline.close()
 
-                        time.sleep(download_interval)
+    # committed illust meta must be stored before the checkpoint is discarded
+    await illust_meta_dao.flush()
 
-        await illust_meta_dao.upsert_illust_meta(
-            illust_id=int(illust.id),
-            user_id=int(user.id),
-            illust=json.loads(json.dumps(illust)),
-            found_at=updated_at_utc,
+    new_watermark = make_bookmark_watermark(
+        pages=watermark_pages,
+        incomplete_illust_ids={int(illust.id) for illust in incomplete_illusts},
+    )
+    if (
+        watermark_dao is not None
+        and new_watermark is not None
+        and (
+            watermark is None
+            or new_watermark.illust_ids != watermark.illust_ids
+            or new_watermark.max_bookmark_id != watermark.max_bookmark_id
         )
+    ):
+        await watermark_dao.save_watermark(new_watermark)
+
+    if checkpoint_dao is not None:
+        await checkpoint_dao.delete_checkpoint()
+
+    return len(new_illusts_desc)
 
 
 async def download_illusts_asc(
-    api: AppPixivAPI,
-    first_result: Any,
+    api: "AppPixivAPI",
+    first_func: Any,
     next_func: Any,
     illust_meta_dao: IllustMetaDao,
     illust_binary_dao: IllustBinaryDao,
     ignore_existence: bool,
     updated_at_utc: datetime,
-    download_interval: float = 1.0,
-    page_interval: float = 3.0,
-    retry_interval: float = 10.0,
-) -> None:
-    result = first_result
+    rate_limiter: RateLimiter,
+    download_concurrency: int = 1,
+    illust_manifest_dao: IllustManifestDao | None = None,
+    checkpoint_dao: CrawlCheckpointDao | None = None,
+    resume: bool = False,
+    watermark_dao: CrawlWatermarkDao | None = None,
+    watermark: CrawlWatermark | None = None,
+) -> int:
+    illust_download_pipeline = IllustDownloadPipeline(
+        api=api,
+        illust_binary_dao=illust_binary_dao,
+        rate_limiter=rate_limiter,
+        download_concurrency=download_concurrency,
+    )
 
-    # search and download illusts in asc order
-    page_index = 0
-    while True:
-        illusts = result.illusts
+    num_new_illusts = 0
 
-        print(f"Page {page_index + 1} (found: {len(illusts)})")
+    # the newest illust processed, to advance the watermark
+    latest_illust: tuple[datetime, int] | None = None
+    # set at the first illust with missing pages, the watermark stays before it
+    # so that the next run fetches it again
+    watermark_blocked = False
+    if watermark is not None:
+        latest_illust = (watermark.create_date, watermark.illust_id)
 
-        for illust_index, illust in enumerate(illusts):
-            user = illust.user
+    async def save_watermark(watermark_illust: tuple[datetime, int] | None) -> None:
+        nonlocal watermark
 
-            if not ignore_existence:
-                old_meta = await illust_meta_dao.get_illust_meta(
-                    illust_id=int(illust.id), user_id=int(user.id)
+        if watermark_dao is None or watermark_illust is None:
+            return
+        if watermark is not None and watermark.covers(*watermark_illust):
+            return
+
+        watermark = CrawlWatermark(
+            create_date=watermark_illust[0],
+            illust_id=watermark_illust[1],
+            updated_at=datetime.now(tz=UTC),
+        )
+        await watermark_dao.save_watermark(watermark)
+
+    # pages whose illusts are committed, waiting for their illust meta to be
+    # written (buffered until a flush with packed illust meta), so that resuming
+    # from the checkpoint or the watermark never skips unwritten illusts:
+    # (upserted_seq, page_index, next_qs, latest_illust)
+    committed_pages: deque[
+        tuple[int, int, dict[str, Any] | None, tuple[datetime, int] | None]
+    ] = deque()
+
+    async def save_flushed_pages() -> None:
+        flushed_page = None
+        while (
+            len(committed_pages) > 0
+            and committed_pages[0][0] <= illust_meta_dao.flushed_seq
+        ):
+            flushed_page = committed_pages.popleft()
+
+        if flushed_page is None:
+            return
+
+        _, flushed_page_index, flushed_next_qs, flushed_latest_illust = flushed_page
+        if checkpoint_dao is not None:
+            await checkpoint_dao.save_page(
+                page_index=flushed_page_index, illusts=[], next_qs=flushed_next_qs
+            )
+
+        await save_watermark(flushed_latest_illust)
+
+    try:
+        page_index = 0
+
+        result: Any = None
+        checkpoint = await load_crawl_checkpoint(
+            checkpoint_dao=checkpoint_dao, resume=resume
+        )
+        if checkpoint is not None:
+            page_index = checkpoint.num_pages
+            emit_progress(
+                "resume", f"Resume from page {page_index + 1}", page=page_index + 1
+            )
+
+            if checkpoint.next_qs:
+                result = await fetch_result(
+                    rate_limiter=rate_limiter,
+                    func=partial(next_func, **checkpoint.next_qs),
                 )
-                if old_meta is not None:
-                    downloaded_illust_keys = (
-                        await illust_binary_dao.get_downloaded_illust_keys(
-                            illust_id=int(illust.id),
-                            user_id=int(user.id),
-                        )
-                    )
+        else:
+            result = await fetch_result(rate_limiter=rate_limiter, func=first_func)
 
-                    num_local_pages = len(downloaded_illust_keys)
-                    num_remote_pages = (
-                        1 if illust.meta_single_page else len(illust.meta_pages)
+        # search and download illusts in asc order
+        while result is not None:
+            illusts = result.illusts
+
+            emit_progress(
+                "page",
+                f"Page {page_index + 1} (found: {len(illusts)})",
+                page=page_index + 1,
+                num_illusts=len(illusts),
+            )
+
+            page_new_illusts_asc: list[Any] = list(illusts)
+            if watermark is not None:
+                # illusts up to the watermark are committed by earlier runs
+                page_new_illusts_asc = [
+                    illust
+                    for illust in page_new_illusts_asc
+                    if not watermark.covers(
+                        get_illust_create_date(illust), int(illust.id)
                     )
+                ]
+                SKIP_CHECKS.inc(
+                    len(illusts) - len(page_new_illusts_asc), result="watermark"
+                )
+
+            page_stored_pages_by_illust: dict[
+                tuple[int, int], list[IllustPageRecord]
+            ] = {}
+            if not ignore_existence:
+                (
+                    page_new_illusts_asc,
+                    page_stored_pages_by_illust,
+                ) = await filter_new_illusts(
+                    illusts=page_new_illusts_asc,
+                    illust_meta_dao=illust_meta_dao,
+                    illust_binary_dao=illust_binary_dao,
+                    illust_manifest_dao=illust_manifest_dao,
+                )
+
+            num_new_illusts += len(page_new_illusts_asc)
+
+            for illust in page_new_illusts_asc:
+                illust_download_pipeline.submit(
+                    illust,
+                    stored_pages=page_stored_pages_by_illust.get(
+                        (int(illust.id), int(illust.user.id))
+                    ),
+                )
+
+            incomplete_illusts = await commit_illusts(
+                illust_download_pipeline=illust_download_pipeline,
+                illusts_asc=page_new_illusts_asc,
+                illust_meta_dao=illust_meta_dao,
+                illust_manifest_dao=illust_manifest_dao,
+                updated_at_utc=updated_at_utc,
+                progress_prefix=f"Page {page_index + 1}",
+            )
 
-                    if num_local_pages == num_remote_pages:
-                        continue
+            next_qs = api.parse_qs(result.next_url)
+
+            incomplete_illust_ids = {int(illust.id) for illust in incomplete_illusts}
+            for illust in illusts:
+                if int(illust.id) in incomplete_illust_ids:
+                    watermark_blocked = True
+                if watermark_blocked:
+                    break
+
+                illust_key = (get_illust_create_date(illust), int(illust.id))
+                if latest_illust is None or illust_key > latest_illust:
+                    latest_illust = illust_key
+
+            # all illusts in the page are committed, nothing is pending
+            committed_pages.append(
+                (
+                    illust_meta_dao.upserted_seq,
+                    page_index,
+                    next_qs or None,
+                    latest_illust,
+                )
+            )
+            await save_flushed_pages()
+
+            if not next_qs:
+                break
+
+            result = await fetch_result(
+                rate_limiter=rate_limiter,
+                func=partial(next_func, **next_qs),
+            )
+            page_index += 1
+    finally:
+        await illust_download_pipeline.close()
+
+    await illust_meta_dao.flush()
+
+    await save_watermark(latest_illust)
+
+    if checkpoint_dao is not None:
+        await checkpoint_dao.delete_checkpoint()
+
+    return num_new_illusts
+
+
+async def rebuild_illust_manifest(
+    storage: Storage,
+    illust_meta_dao: IllustMetaDao,
+    illust_manifest_dao: IllustManifestDao,
+) -> None:
+    # group objects by illust: {user_id}/{illust_id}/{filename}
+    objects_by_illust: dict[tuple[int, int], dict[str, StorageObject]] = {}
+    async for obj in storage.list_tree(prefix=""):
+        parts = obj.key.split("/")
+        if len(parts) != 3:
+            continue
+
+        user_id_string, illust_id_string, _ = parts
+        if not user_id_string.isdigit() or not illust_id_string.isdigit():
+            continue
+
+        objects_by_illust.setdefault((int(user_id_string), int(illust_id_string)), {})[
+            obj.key
+        ] = obj
+
+    await illust_manifest_dao.clear()
+
+    num_indexed_illusts = 0
+    for (user_id, illust_id), objects_by_key in objects_by_illust.items():
+        # illust.json is committed after all of the images are stored
+        has_loose_meta = (
+            get_illust_meta_key(illust_id=illust_id, user_id=user_id) in objects_by_key
+        )
+        if not has_loose_meta and not illust_meta_dao.packed:
+            continue
+
+        illust_meta = await illust_meta_dao.get_illust_meta(
+            illust_id=illust_id, user_id=user_id, check_loose=has_loose_meta
+        )
+        if illust_meta is None:
+            continue
+
+        illust = illust_meta.illust
+        page_count = (
+            1 if illust.get("meta_single_page") else len(illust.get("meta_pages") or [])
+        )
 
-            print(
-                f"Page {page_index + 1}",
-                f"Index {illust_index + 1}/{len(illusts)}",
-                user.id,
-                user.name,
-                illust.id,
-                illust.title,
+        await illust_manifest_dao.upsert_illust_manifest(
+            IllustManifest(
+                illust_id=illust_id,
+                user_id=user_id,
+                page_count=page_count,
+                pages=get_valid_illust_pages(
+                    image_keys=[
+                        key for key in objects_by_key if is_illust_binary_key(key)
+                    ],
+                    objects_by_key=objects_by_key,
+                    recorded_pages=illust_meta.pages,
+                ),
+                found_at=illust_meta.found_at,
             )
-            if illust.meta_single_page:
-                image_url = illust.meta_single_page.original_image_url
-                print(image_url)
-
-                with TemporaryDirectory() as _tmpdir:
-                    tmpdir = Path(_tmpdir)
-
-                    if api.download(image_url, path=str(tmpdir)):
-                        for file in tmpdir.iterdir():
-                            await illust_binary_dao.store_illust_binary(
-                                illust_id=int(illust.id),
-                                user_id=int(user.id),
-                                file=file,
-                            )
-
-                        time.sleep(download_interval)
+        )
+        num_indexed_illusts += 1
+
+    emit_progress(
+        "index_rebuilt",
+        f"Indexed Illusts: {num_indexed_illusts}",
+        num_indexed_illusts=num_indexed_illusts,
+    )
+
+
+async def report_dedup(
+    storage: Storage,
+    illust_binary_dao: IllustBinaryDao,
+) -> None:
+    num_illust_binaries = 0
+    num_refs = 0
+    logical_size = 0
+    ref_size = 0
+
+    # size of each distinct stored content, hardlinks share the same file_id
+    content_sizes: dict[str, int] = {}
+    ref_blob_keys: list[str] = []
+    blob_content_ids: dict[str, str] = {}
+
+    async for obj in storage.list_tree(prefix=""):
+        content_id = obj.file_id or obj.key
+
+        if obj.key.startswith(BLOB_PREFIX):
+            blob_content_ids[obj.key] = content_id
+            content_sizes[content_id] = obj.size
+            continue
+
+        if not is_illust_binary_key(obj.key):
+            continue
+
+        num_illust_binaries += 1
+
+        blob_ref = await illust_binary_dao.get_blob_ref(obj=obj)
+        if blob_ref is not None:
+            num_refs += 1
+            logical_size += blob_ref.size
+            ref_size += obj.size
+            ref_blob_keys.append(blob_ref.blob_key)
+            continue
+
+        logical_size += obj.size
+        content_sizes[content_id] = obj.size
+
+    num_missing_blobs = sum(
+        1 for blob_key in ref_blob_keys if blob_key not in blob_content_ids
+    )
+
+    stored_size = sum(content_sizes.values()) + ref_size
+    reclaimed_size = logical_size - stored_size
+    reclaimed_ratio = reclaimed_size / logical_size if logical_size > 0 else 0.0
+
+    emit_progress(
+        "dedup_report",
+        "\n".join(
+            [
+                f"Illust binaries: {num_illust_binaries} (references: {num_refs})",
+                f"Blobs: {len(blob_content_ids)} (missing: {num_missing_blobs})",
+                f"Logical size: {logical_size} bytes",
+                f"Stored size: {stored_size} bytes",
+                f"Reclaimed size: {reclaimed_size} bytes ({reclaimed_ratio:.1%})",
+            ]
+        ),
+        num_illust_binaries=num_illust_binaries,
+        num_refs=num_refs,
+        num_blobs=len(blob_content_ids),
+        num_missing_blobs=num_missing_blobs,
+        logical_size=logical_size,
+        stored_size=stored_size,
+        reclaimed_size=reclaimed_size,
+    )
+
+
+async def compact_illust_meta(
+    storage: Storage,
+    illust_meta_dao: IllustMetaDao,
+    keep_loose: bool,
+    worker_id: str,
+    lease_seconds: float,
+    lease_settle_seconds: float,
+) -> None:
+    # loose illust.json as (illust_id, user_id), and segments
+    loose_illust_ids: list[tuple[int, int]] = []
+    num_segments = 0
+    async for obj in storage.list_tree(prefix=""):
+        if parse_meta_pack_segment_key(obj.key) is not None:
+            num_segments += 1
+            continue
+
+        parts = obj.key.split("/")
+        if (
+            len(parts) == 3
+            and parts[0].isdigit()
+            and parts[1].isdigit()
+            and obj.key
+            == get_illust_meta_key(illust_id=int(parts[1]), user_id=int(parts[0]))
+        ):
+            loose_illust_ids.append((int(parts[1]), int(parts[0])))
+
+    # a single compaction at a time, crawls keep writing while compacting
+    lease_dao = StorageLeaseDao(storage=storage)
+    lease = await lease_dao.acquire_lease(
+        lease_key=META_PACK_LEASE_KEY,
+        worker_id=worker_id,
+        lease_seconds=lease_seconds,
+        settle_seconds=lease_settle_seconds,
+    )
+    if lease is None:
+        logger.warning("Illust meta is being compacted by another worker")
+        return
+
+    emit_progress(
+        "meta_compact",
+        f"Compacting loose illust meta: {len(loose_illust_ids)}, "
+        f"segments: {num_segments}",
+        num_loose_illusts=len(loose_illust_ids),
+        num_segments=num_segments,
+    )
+
+    try:
+        num_illusts = await run_with_lease(
+            lease=lease,
+            lease_seconds=lease_seconds,
+            renew_lease=partial(
+                lease_dao.renew_lease, META_PACK_LEASE_KEY, lease_seconds=lease_seconds
+            ),
+            func=partial(
+                illust_meta_dao.compact,
+                loose_illust_ids=loose_illust_ids,
+                delete_loose=not keep_loose,
+            ),
+        )
+    finally:
+        await lease_dao.release_lease(lease_key=META_PACK_LEASE_KEY, lease=lease)
+
+    emit_progress(
+        "meta_compacted",
+        f"Compacted Illusts: {num_illusts}",
+        num_illusts=num_illusts,
+    )
+
+
+async def poll_crawl(
+    config: BookmarkConfig | SearchTagConfig,
+    crawl_func: Callable[[Any], Awaitable[int]],
+) -> None:
+    if not config.watch:
+        await crawl_func(config)
+        return
+
+    # poll more frequently while new illusts are found, less while idle
+    poll_interval = config.watch_interval
+    poll_config = config
+    while True:
+        try:
+            num_new_illusts = await crawl_func(poll_config)
+        except Exception as error:
+            logger.error("Failed to poll")
+            logger.exception(error)
+            ERRORS.inc(target="poll", reason=type(error).__name__)
+
+            # continue the interrupted crawl in the next poll
+            poll_config = config.model_copy(update={"recrawl": False, "resume": True})
+            poll_interval = config.watch_max_interval
+        else:
+            poll_config = config.model_copy(update={"recrawl": False, "resume": False})
+            if num_new_illusts > 0:
+                poll_interval = max(config.watch_min_interval, poll_interval / 2)
             else:
-                pages = illust.meta_pages
-                for page in pages:
-                    image_url = page.image_urls.original
-                    print(image_url)
-
-                    with TemporaryDirectory() as _tmpdir:
-                        tmpdir = Path(_tmpdir)
-
-                        if api.download(image_url, path=str(tmpdir)):
-                            for file in tmpdir.iterdir():
-                                await illust_binary_dao.store_illust_binary(
-                                    illust_id=int(illust.id),
-                                    user_id=int(user.id),
-                                    file=file,
-                                )
-
-                            time.sleep(download_interval)
-
-            await illust_meta_dao.upsert_illust_meta(
-                illust_id=int(illust.id),
-                user_id=int(user.id),
-                illust=json.loads(json.dumps(illust)),
-                found_at=updated_at_utc,
+                poll_interval = min(config.watch_max_interval, poll_interval * 1.5)
+
+            emit_progress(
+                "poll",
+                f"Poll found {num_new_illusts} new illusts",
+                num_new_illusts=num_new_illusts,
+            )
+
+        emit_progress(
+            "poll_wait",
+            f"Next poll in {poll_interval:.0f}s",
+            poll_interval=poll_interval,
+        )
+        await asyncio.sleep(poll_interval)
+
+
+async def crawl_bookmark(
+    config: BookmarkConfig,
+    api: "AppPixivAPI",
+    storage: Storage,
+    illust_meta_dao: IllustMetaDao,
+    illust_manifest_dao: IllustManifestDao | None,
+    rate_limiter: RateLimiter,
+) -> int:
+    illust_binary_dao = IllustBinaryDao(
+        storage=storage,
+        dedup=config.dedup,
+    )
+
+    job_key = f"bookmark-{config.user_id}"
+
+    checkpoint_dao = CrawlCheckpointDao(storage=storage, job_key=job_key)
+
+    updated_at_utc = datetime.now(UTC)  # utc aware current time
+
+    watermark_dao: CrawlWatermarkDao | None = None
+    watermark: BookmarkWatermark | None = None
+    if config.incremental:
+        watermark_dao = CrawlWatermarkDao(storage=storage, job_key=job_key)
+
+        if not config.recrawl:
+            watermark = await watermark_dao.get_watermark(BookmarkWatermark)
+
+    return await download_illusts_desc(
+        api=api,
+        first_func=partial(
+            api.user_bookmarks_illust, user_id=config.user_id, req_auth=True
+        ),
+        next_func=api.user_bookmarks_illust,
+        illust_meta_dao=illust_meta_dao,
+        illust_binary_dao=illust_binary_dao,
+        ignore_existence=config.recrawl,
+        updated_at_utc=updated_at_utc,
+        rate_limiter=rate_limiter,
+        download_concurrency=config.download_concurrency,
+        illust_manifest_dao=illust_manifest_dao,
+        checkpoint_dao=checkpoint_dao,
+        resume=config.resume,
+        watermark_dao=watermark_dao,
+        watermark=watermark,
+        watermark_max_empty_pages=config.incremental_max_empty_pages,
+    )
+
+
+async def __run_bookmark(config: BookmarkConfig) -> None:
+    async with create_storage(
+        config, download_concurrency=config.download_concurrency
+    ) as storage:
+        illust_meta_dao = create_illust_meta_dao(storage=storage, config=config)
+
+        illust_manifest_dao = (
+            IllustManifestDao(manifest_path=Path(config.manifest_path))
+            if config.manifest_path
+            else None
+        )
+
+        api = create_pixiv_api()
+
+        rate_limiter = RateLimiter.from_intervals(
+            page_interval=config.page_interval,
+            download_interval=config.download_interval,
+            retry_interval=config.retry_interval,
+            max_retries=config.max_retries,
+            download_concurrency=config.download_concurrency,
+            download_interval_per_worker=config.download_interval_per_worker,
+        )
+
+        try:
+            async with PixivAuthKeeper(api=api, refresh_token=config.refresh_token):
+                await poll_crawl(
+                    config=config,
+                    crawl_func=partial(
+                        crawl_bookmark,
+                        api=api,
+                        storage=storage,
+                        illust_meta_dao=illust_meta_dao,
+                        illust_manifest_dao=illust_manifest_dao,
+                        rate_limiter=rate_limiter,
+                    ),
+                )
+        finally:
+            await illust_meta_dao.flush()
+
+            if illust_manifest_dao is not None:
+                illust_manifest_dao.close()
+
+        logger.info(
+            f"Illust meta cache: hits={illust_meta_dao.cache_hits}, "
+            f"misses={illust_meta_dao.cache_misses}"
+        )
+
+
+async def run_bookmark(args: Namespace) -> None:
+    await __run_bookmark(
+        config=BookmarkConfig(
+            storage_type=args.storage_type,
+            root_dir=args.root_dir,
+            storage_s3_bucket=args.storage_s3_bucket,
+            storage_s3_region=args.storage_s3_region,
+            storage_s3_endpoint_url=args.storage_s3_endpoint_url,
+            storage_s3_force_path_style=args.storage_s3_force_path_style,
+            storage_s3_access_key_id=args.storage_s3_access_key_id,
+            storage_s3_secret_access_key=args.storage_s3_secret_access_key,
+            storage_s3_session_token=args.storage_s3_session_token,
+            storage_s3_max_pool_connections=args.storage_s3_max_pool_connections,
+            storage_s3_multipart_threshold_mib=args.storage_s3_multipart_threshold_mib,
+            storage_s3_multipart_chunksize_mib=args.storage_s3_multipart_chunksize_mib,
+            storage_s3_transfer_concurrency=args.storage_s3_transfer_concurrency,
+            storage_s3_checksum_algorithm=args.storage_s3_checksum_algorithm,
+            storage_io_concurrency=args.storage_io_concurrency,
+            refresh_token=args.refresh_token,
+            user_id=args.user_id,
+            recrawl=args.recrawl,
+            resume=args.resume,
+            incremental=args.incremental,
+            incremental_max_empty_pages=args.incremental_max_empty_pages,
+            download_interval=args.download_interval,
+            page_interval=args.page_interval,
+            retry_interval=args.retry_interval,
+            max_retries=args.max_retries,
+            download_concurrency=args.download_concurrency,
+            download_interval_per_worker=args.download_interval_per_worker,
+            dedup=args.dedup,
+            meta_cache_size=args.meta_cache_size,
+            packed_meta=args.packed_meta,
+            meta_compression=args.meta_compression,
+            meta_segment_size=args.meta_segment_size,
+            manifest_path=args.manifest_path,
+            watch=args.watch,
+            watch_interval=args.watch_interval,
+            watch_min_interval=args.watch_min_interval,
+            watch_max_interval=args.watch_max_interval,
+        )
+    )
+
+
+async def crawl_search_tag(
+    config: SearchTagConfig,
+    api: "AppPixivAPI",
+    storage: Storage,
+    illust_meta_dao: IllustMetaDao,
+    illust_manifest_dao: IllustManifestDao | None,
+    rate_limiter: RateLimiter,
+) -> int:
+    illust_binary_dao = IllustBinaryDao(
+        storage=storage,
+        dedup=config.dedup,
+    )
+
+    job_key = (
+        f"search_tag-{quote(config.keyword, safe='')}-"
+        f"{'desc' if config.desc else 'asc'}"
+    )
+
+    checkpoint_dao = CrawlCheckpointDao(storage=storage, job_key=job_key)
+
+    updated_at_utc = datetime.now(UTC)  # utc aware current time
+
+    first_func = partial(
+        api.search_illust,
+        word=config.keyword,
+        search_target="exact_match_for_tags",
+        sort="date_desc" if config.desc else "date_asc",
+        req_auth=True,
+    )
+
+    if config.desc:
+        return await download_illusts_desc(
+            api=api,
+            first_func=first_func,
+            next_func=api.search_illust,
+            illust_meta_dao=illust_meta_dao,
+            illust_binary_dao=illust_binary_dao,
+            ignore_existence=config.recrawl,
+            updated_at_utc=updated_at_utc,
+            rate_limiter=rate_limiter,
+            download_concurrency=config.download_concurrency,
+            illust_manifest_dao=illust_manifest_dao,
+            checkpoint_dao=checkpoint_dao,
+            resume=config.resume,
+        )
+
+    watermark_dao: CrawlWatermarkDao | None = None
+    watermark: CrawlWatermark | None = None
+    if config.incremental:
+        watermark_dao = CrawlWatermarkDao(storage=storage, job_key=job_key)
+
+        if not config.recrawl:
+            watermark = await watermark_dao.get_watermark(CrawlWatermark)
+
+        if watermark is not None:
+            start_date = get_watermark_start_date(watermark)
+            first_func = partial(first_func, start_date=start_date)
+
+            emit_progress(
+                "watermark",
+                f"Search from {start_date} "
+                f"(watermark: {watermark.create_date.isoformat()} "
+                f"{watermark.illust_id})",
+                start_date=start_date,
+                watermark_create_date=watermark.create_date.isoformat(),
+                watermark_illust_id=watermark.illust_id,
+            )
+
+    return await download_illusts_asc(
+        api=api,
+        first_func=first_func,
+        next_func=api.search_illust,
+        illust_meta_dao=illust_meta_dao,
+        illust_binary_dao=illust_binary_dao,
+        ignore_existence=config.recrawl,
+        updated_at_utc=updated_at_utc,
+        rate_limiter=rate_limiter,
+        download_concurrency=config.download_concurrency,
+        illust_manifest_dao=illust_manifest_dao,
+        checkpoint_dao=checkpoint_dao,
+        resume=config.resume,
+        watermark_dao=watermark_dao,
+        watermark=watermark,
+    )
+
+
+async def __run_search_tag(config: SearchTagConfig) -> None:
+    async with create_storage(
+        config, download_concurrency=config.download_concurrency
+    ) as storage:
+        illust_meta_dao = create_illust_meta_dao(storage=storage, config=config)
+
+        illust_manifest_dao = (
+            IllustManifestDao(manifest_path=Path(config.manifest_path))
+            if config.manifest_path
+            else None
+        )
+
+        api = create_pixiv_api()
+
+        rate_limiter = RateLimiter.from_intervals(
+            page_interval=config.page_interval,
+            download_interval=config.download_interval,
+            retry_interval=config.retry_interval,
+            max_retries=config.max_retries,
+            download_concurrency=config.download_concurrency,
+            download_interval_per_worker=config.download_interval_per_worker,
+        )
+
+        try:
+            async with PixivAuthKeeper(api=api, refresh_token=config.refresh_token):
+                await poll_crawl(
+                    config=config,
+                    crawl_func=partial(
+                        crawl_search_tag,
+                        api=api,
+                        storage=storage,
+                        illust_meta_dao=illust_meta_dao,
+                        illust_manifest_dao=illust_manifest_dao,
+                        rate_limiter=rate_limiter,
+                    ),
+                )
+        finally:
+            await illust_meta_dao.flush()
+
+            if illust_manifest_dao is not None:
+                illust_manifest_dao.close()
+
+        logger.info(
+            f"Illust meta cache: hits={illust_meta_dao.cache_hits}, "
+            f"misses={illust_meta_dao.cache_misses}"
+        )
+
+
+async def run_search_tag(args: Namespace) -> None:
+    await __run_search_tag(
+        config=SearchTagConfig(
+            storage_type=args.storage_type,
+            root_dir=args.root_dir,
+            storage_s3_bucket=args.storage_s3_bucket,
+            storage_s3_region=args.storage_s3_region,
+            storage_s3_endpoint_url=args.storage_s3_endpoint_url,
+            storage_s3_force_path_style=args.storage_s3_force_path_style,
+            storage_s3_access_key_id=args.storage_s3_access_key_id,
+            storage_s3_secret_access_key=args.storage_s3_secret_access_key,
+            storage_s3_session_token=args.storage_s3_session_token,
+            storage_s3_max_pool_connections=args.storage_s3_max_pool_connections,
+            storage_s3_multipart_threshold_mib=args.storage_s3_multipart_threshold_mib,
+            storage_s3_multipart_chunksize_mib=args.storage_s3_multipart_chunksize_mib,
+            storage_s3_transfer_concurrency=args.storage_s3_transfer_concurrency,
+            storage_s3_checksum_algorithm=args.storage_s3_checksum_algorithm,
+            storage_io_concurrency=args.storage_io_concurrency,
+            refresh_token=args.refresh_token,
+            keyword=args.keyword,
+            recrawl=args.recrawl,
+            resume=args.resume,
+            incremental=args.incremental,
+            desc=args.desc,
+            download_interval=args.download_interval,
+            page_interval=args.page_interval,
+            retry_interval=args.retry_interval,
+            max_retries=args.max_retries,
+            download_concurrency=args.download_concurrency,
+            download_interval_per_worker=args.download_interval_per_worker,
+            dedup=args.dedup,
+            meta_cache_size=args.meta_cache_size,
+            packed_meta=args.packed_meta,
+            meta_compression=args.meta_compression,
+            meta_segment_size=args.meta_segment_size,
+            manifest_path=args.manifest_path,
+            watch=args.watch,
+            watch_interval=args.watch_interval,
+            watch_min_interval=args.watch_min_interval,
+            watch_max_interval=args.watch_max_interval,
+        )
+    )
+
+
+def get_search_tag_shard_job_key(keyword: str) -> str:
+    return f"search_tag-{quote(keyword, safe='')}"
+
+
+async def crawl_search_tag_shard(
+    config: SearchTagShardConfig,
+    shard: CrawlShard,
+    api: "AppPixivAPI",
+    storage: Storage,
+    illust_meta_dao: IllustMetaDao,
+    illust_manifest_dao: IllustManifestDao | None,
+    rate_limiter: RateLimiter,
+) -> int:
+    illust_binary_dao = IllustBinaryDao(
+        storage=storage,
+        dedup=config.dedup,
+    )
+
+    # a shard taken over from a stopped worker resumes from its checkpoint
+    checkpoint_dao = CrawlCheckpointDao(
+        storage=storage,
+        job_key=(
+            f"{get_search_tag_shard_job_key(config.keyword)}-shard-{shard.shard_id}"
+        ),
+    )
+
+    updated_at_utc = datetime.now(UTC)  # utc aware current time
+
+    return await download_illusts_asc(
+        api=api,
+        first_func=partial(
+            api.search_illust,
+            word=config.keyword,
+            search_target="exact_match_for_tags",
+            sort="date_asc",
+            start_date=shard.start_date.isoformat(),
+            end_date=shard.end_date.isoformat(),
+            req_auth=True,
+        ),
+        next_func=api.search_illust,
+        illust_meta_dao=illust_meta_dao,
+        illust_binary_dao=illust_binary_dao,
+        ignore_existence=config.recrawl,
+        updated_at_utc=updated_at_utc,
+        rate_limiter=rate_limiter,
+        download_concurrency=config.download_concurrency,
+        illust_manifest_dao=illust_manifest_dao,
+        checkpoint_dao=checkpoint_dao,
+        resume=True,
+    )
+
+
+async def run_crawl_shard_worker(
+    shard_dao: CrawlShardDao,
+    crawl_shard_func: Callable[[CrawlShard], Coroutine[Any, Any, int]],
+    worker_id: str,
+    lease_seconds: float,
+    lease_settle_seconds: float,
+) -> int:
+    plan = await shard_dao.get_plan()
+    if plan is None:
+        raise ValueError(
+            f"No shard plan found, run shard-plan first: {shard_dao.job_key}"
+        )
+
+    num_new_illusts = 0
+    while True:
+        done_shard_ids = await shard_dao.get_done_shard_ids()
+        pending_shards = [
+            shard for shard in plan.shards if shard.shard_id not in done_shard_ids
+        ]
+        if len(pending_shards) == 0:
+            break
+
+        shard: CrawlShard | None = None
+        lease: StorageLease | None = None
+        for pending_shard in pending_shards:
+            lease = await shard_dao.acquire_lease(
+                shard_id=pending_shard.shard_id,
+                worker_id=worker_id,
+                lease_seconds=lease_seconds,
+                settle_seconds=lease_settle_seconds,
+            )
+            if lease is not None:
+                shard = pending_shard
+                break
+
+        if shard is None or lease is None:
+            # the rest are leased by other workers,
+            # wait to take over the shards of stopped workers
+            emit_progress(
+                "shard_wait",
+                f"Waiting for {len(pending_shards)} shards leased by other workers",
+                num_pending_shards=len(pending_shards),
+            )
+            await asyncio.sleep(lease_seconds / 3)
+            continue
+
+        emit_progress(
+            "shard_start",
+            f"Shard {shard.shard_id} ({len(done_shard_ids)}/{len(plan.shards)} done)",
+            shard_id=shard.shard_id,
+            worker_id=worker_id,
+            num_done_shards=len(done_shard_ids),
+            num_shards=len(plan.shards),
+        )
+
+        try:
+            num_shard_new_illusts = await run_with_lease(
+                lease=lease,
+                lease_seconds=lease_seconds,
+                renew_lease=partial(
+                    shard_dao.renew_lease, shard.shard_id, lease_seconds=lease_seconds
+                ),
+                func=partial(crawl_shard_func, shard),
             )
+        except StorageLeaseLostError:
+            # the shard is crawled by the worker taking it over
+            logger.warning(f"Lease of shard {shard.shard_id} is taken over")
+            ERRORS.inc(target="shard", reason="lease_lost")
+            continue
+        except BaseException:
+            # let another worker retry the shard from its checkpoint
+            await shard_dao.release_lease(shard_id=shard.shard_id, lease=lease)
+            raise
+
+        await shard_dao.mark_done(
+            shard_id=shard.shard_id,
+            worker_id=worker_id,
+            num_new_illusts=num_shard_new_illusts,
+        )
+        await shard_dao.release_lease(shard_id=shard.shard_id, lease=lease)
+
+        num_new_illusts += num_shard_new_illusts
+        emit_progress(
+            "shard_done",
+            f"Shard {shard.shard_id} done (new: {num_shard_new_illusts})",
+            shard_id=shard.shard_id,
+            worker_id=worker_id,
+            num_new_illusts=num_shard_new_illusts,
+        )
+
+    return num_new_illusts
+
+
+async def __run_shard_worker(config: SearchTagShardConfig) -> None:
+    async with create_storage(
+        config, download_concurrency=config.download_concurrency
+    ) as storage:
+        illust_meta_dao = create_illust_meta_dao(storage=storage, config=config)
+
+        illust_manifest_dao = (
+            IllustManifestDao(manifest_path=Path(config.manifest_path))
+            if config.manifest_path
+            else None
+        )
+
+        api = create_pixiv_api()
+
+        rate_limiter = RateLimiter.from_intervals(
+            page_interval=config.page_interval,
+            download_interval=config.download_interval,
+            retry_interval=config.retry_interval,
+            max_retries=config.max_retries,
+            download_concurrency=config.download_concurrency,
+            download_interval_per_worker=config.download_interval_per_worker,
+        )
+
+        worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+
+        try:
+            async with PixivAuthKeeper(api=api, refresh_token=config.refresh_token):
+                num_new_illusts = await run_crawl_shard_worker(
+                    shard_dao=CrawlShardDao(
+                        storage=storage,
+                        job_key=get_search_tag_shard_job_key(config.keyword),
+                    ),
+                    crawl_shard_func=partial(
+                        crawl_search_tag_shard,
+                        config,
+                        api=api,
+                        storage=storage,
+                        illust_meta_dao=illust_meta_dao,
+                        illust_manifest_dao=illust_manifest_dao,
+                        rate_limiter=rate_limiter,
+                    ),
+                    worker_id=worker_id,
+                    lease_seconds=config.lease_seconds,
+                    lease_settle_seconds=config.lease_settle_seconds,
+                )
+        finally:
+            await illust_meta_dao.flush()
+
+            if illust_manifest_dao is not None:
+                illust_manifest_dao.close()
+
+        emit_progress(
+            "worker_done",
+            f"All shards done (new by this worker: {num_new_illusts})",
+            worker_id=worker_id,
+            num_new_illusts=num_new_illusts,
+        )
 
-        next_qs = api.parse_qs(result.next_url)
-        if not next_qs:
-            break
 
-        time.sleep(page_interval)
+def run_shard_worker_process(config_json: str, progress_format: ProgressFormat) -> None:
+    # entry point of local worker processes started by shard-plan
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+    set_progress_format(progress_format)
 
-        for retry_index in range(3):
-            next_result = next_func(**next_qs)
-            if next_result.illusts is not None:
-                break
-            print(next_result)
-            time.sleep(retry_interval * (retry_index + 1))
+    asyncio.run(
+        __run_shard_worker(config=SearchTagShardConfig.model_validate_json(config_json))
+    )
 
-        result = next_result
-        page_index += 1
 
+async def __run_shard_plan(
+    config: SearchTagShardConfig, progress_format: ProgressFormat
+) -> None:
+    shard_end_date = config.shard_end_date or datetime.now(UTC).date()
+    shards = plan_crawl_shards(
+        start_date=config.shard_start_date,
+        end_date=shard_end_date,
+        shard_days=config.shard_days,
+    )
 
-async def __run_bookmark(config: BookmarkConfig) -> None:
-    storage: Storage
-    if config.storage_type == "filesystem":
-        if not config.root_dir:
-            raise ValueError("root_dir is required for filesystem")
-
-        root_dir = Path(config.root_dir)
-
-        storage = StorageFilesystem(root_dir=root_dir)
-    elif config.storage_type == "s3":
-        prefix = None
-
-        root_dir_string = config.root_dir
-        if root_dir_string:
-            # 末尾にスラッシュを追加
-            if not root_dir_string.endswith("/"):
-                root_dir_string += "/"
-
-            prefix = root_dir_string
-
-        if not config.storage_s3_bucket:
-            raise ValueError("storage_s3_bucket is required for s3")
-
-        storage = StorageS3(
-            bucket_name=config.storage_s3_bucket,
-            prefix=prefix,
-            aws_region=config.storage_s3_region,
-            aws_endpoint_url=config.storage_s3_endpoint_url,
-            force_path_style=config.storage_s3_force_path_style,
-            aws_access_key_id=config.storage_s3_access_key_id,
-            aws_secret_access_key=config.storage_s3_secret_access_key,
-            aws_session_token=config.storage_s3_session_token,
+    async with create_storage(config) as storage:
+        shard_dao = CrawlShardDao(
+            storage=storage, job_key=get_search_tag_shard_job_key(config.keyword)
         )
-    else:
-        raise ValueError(f"Unknown storage_type: {config.storage_type}")
 
-    illust_meta_dao = IllustMetaDao(
-        storage=storage,
+        # done shards of the same range are kept
+        plan = await shard_dao.get_plan()
+        if plan is None or plan.shards != shards:
+            plan = await shard_dao.save_plan(shards=shards)
+
+        done_shard_ids = await shard_dao.get_done_shard_ids()
+
+    emit_progress(
+        "shard_plan",
+        f"Shards: {len(plan.shards)} "
+        f"({config.shard_start_date.isoformat()} - {shard_end_date.isoformat()}, "
+        f"done: {len(done_shard_ids & {shard.shard_id for shard in plan.shards})})",
+        num_shards=len(plan.shards),
+        start_date=config.shard_start_date.isoformat(),
+        end_date=shard_end_date.isoformat(),
     )
 
-    illust_binary_dao = IllustBinaryDao(
-        storage=storage,
+    if config.shard_workers == 0:
+        return
+
+    # local workers, more can join from other hosts with shard-worker
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(
+            target=run_shard_worker_process,
+            args=(config.model_dump_json(), progress_format),
+        )
+        for _ in range(config.shard_workers)
+    ]
+    for process in processes:
+        process.start()
+
+    try:
+        for process in processes:
+            await asyncio.to_thread(process.join)
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+    num_failed_workers = sum(1 for process in processes if process.exitcode != 0)
+    if num_failed_workers > 0:
+        raise RuntimeError(f"{num_failed_workers} shard workers failed")
+
+
+def create_search_tag_shard_config(args: Namespace) -> SearchTagShardConfig:
+    return SearchTagShardConfig(
+        storage_type=args.storage_type,
+        root_dir=args.root_dir,
+        storage_s3_bucket=args.storage_s3_bucket,
+        storage_s3_region=args.storage_s3_region,
+        storage_s3_endpoint_url=args.storage_s3_endpoint_url,
+        storage_s3_force_path_style=args.storage_s3_force_path_style,
+        storage_s3_access_key_id=args.storage_s3_access_key_id,
+        storage_s3_secret_access_key=args.storage_s3_secret_access_key,
+        storage_s3_session_token=args.storage_s3_session_token,
+        storage_s3_max_pool_connections=args.storage_s3_max_pool_connections,
+        storage_s3_multipart_threshold_mib=args.storage_s3_multipart_threshold_mib,
+        storage_s3_multipart_chunksize_mib=args.storage_s3_multipart_chunksize_mib,
+        storage_s3_transfer_concurrency=args.storage_s3_transfer_concurrency,
+        storage_s3_checksum_algorithm=args.storage_s3_checksum_algorithm,
+        storage_io_concurrency=args.storage_io_concurrency,
+        refresh_token=args.refresh_token,
+        keyword=args.keyword,
+        recrawl=args.recrawl,
+        download_interval=args.download_interval,
+        page_interval=args.page_interval,
+        retry_interval=args.retry_interval,
+        max_retries=args.max_retries,
+        download_concurrency=args.download_concurrency,
+        download_interval_per_worker=args.download_interval_per_worker,
+        dedup=args.dedup,
+        meta_cache_size=args.meta_cache_size,
+        packed_meta=args.packed_meta,
+        meta_compression=args.meta_compression,
+        meta_segment_size=args.meta_segment_size,
+        manifest_path=args.manifest_path,
+        shard_start_date=args.shard_start_date,
+        shard_end_date=args.shard_end_date,
+        shard_days=args.shard_days,
+        shard_workers=args.shard_workers,
+        lease_seconds=args.lease_seconds,
+        lease_settle_seconds=args.lease_settle_seconds,
     )
 
-    api = AppPixivAPI()
 
-    api.auth(refresh_token=config.refresh_token)
+async def run_shard_plan(args: Namespace) -> None:
+    await __run_shard_plan(
+        config=create_search_tag_shard_config(args),
+        progress_format=args.progress_format,
+    )
 
-    result = api.user_bookmarks_illust(user_id=config.user_id, req_auth=True)
 
-    updated_at_utc = datetime.now(UTC)  # utc aware current time
+async def run_shard_worker(args: Namespace) -> None:
+    await __run_shard_worker(config=create_search_tag_shard_config(args))
 
-    await download_illusts_desc(
-        api=api,
-        first_result=result,
-        next_func=api.user_bookmarks_illust,
-        illust_meta_dao=illust_meta_dao,
-        illust_binary_dao=illust_binary_dao,
-        ignore_existence=config.recrawl,
-        updated_at_utc=updated_at_utc,
-        download_interval=config.download_interval,
-        page_interval=config.page_interval,
-        retry_interval=config.retry_interval,
-    )
 
+async def __run_rebuild_index(config: RebuildIndexConfig) -> None:
+    async with create_storage(config) as storage:
+        illust_meta_dao = create_illust_meta_dao(storage=storage, config=config)
 
-async def run_bookmark(args: Namespace) -> None:
-    await __run_bookmark(
-        config=BookmarkConfig(
+        illust_manifest_dao = IllustManifestDao(
+            manifest_path=Path(config.manifest_path)
+        )
+
+        try:
+            await rebuild_illust_manifest(
+                storage=storage,
+                illust_meta_dao=illust_meta_dao,
+                illust_manifest_dao=illust_manifest_dao,
+            )
+        finally:
+            illust_manifest_dao.close()
+
+
+async def run_rebuild_index(args: Namespace) -> None:
+    if not args.manifest_path:
+        raise ValueError("manifest_path is required for rebuild-index")
+
+    await __run_rebuild_index(
+        config=RebuildIndexConfig(
             storage_type=args.storage_type,
             root_dir=args.root_dir,
             storage_s3_bucket=args.storage_s3_bucket,
@@ -373,94 +1891,78 @@ async def run_bookmark(args: Namespace) -> None:
             storage_s3_access_key_id=args.storage_s3_access_key_id,
             storage_s3_secret_access_key=args.storage_s3_secret_access_key,
             storage_s3_session_token=args.storage_s3_session_token,
-            refresh_token=args.refresh_token,
-            user_id=args.user_id,
-            recrawl=args.recrawl,
-            download_interval=args.download_interval,
-            page_interval=args.page_interval,
-            retry_interval=args.retry_interval,
+            storage_s3_max_pool_connections=args.storage_s3_max_pool_connections,
+            storage_s3_multipart_threshold_mib=args.storage_s3_multipart_threshold_mib,
+            storage_s3_multipart_chunksize_mib=args.storage_s3_multipart_chunksize_mib,
+            storage_s3_transfer_concurrency=args.storage_s3_transfer_concurrency,
+            storage_s3_checksum_algorithm=args.storage_s3_checksum_algorithm,
+            storage_io_concurrency=args.storage_io_concurrency,
+            meta_cache_size=args.meta_cache_size,
+            packed_meta=args.packed_meta,
+            meta_compression=args.meta_compression,
+            meta_segment_size=args.meta_segment_size,
+            manifest_path=args.manifest_path,
         )
     )
 
 
-async def __run_search_tag(config: SearchTagConfig) -> None:
-    storage: Storage
-    if config.storage_type == "filesystem":
-        if not config.root_dir:
-            raise ValueError("root_dir is required for filesystem")
-
-        root_dir = Path(config.root_dir)
-
-        storage = StorageFilesystem(root_dir=root_dir)
-    elif config.storage_type == "s3":
-        prefix = None
-
-        root_dir_string = config.root_dir
-        if root_dir_string:
-            # 末尾にスラッシュを追加
-            if not root_dir_string.endswith("/"):
-                root_dir_string += "/"
-
-            prefix = root_dir_string
-
-        if not config.storage_s3_bucket:
-            raise ValueError("storage_s3_bucket is required for s3")
-
-        storage = StorageS3(
-            bucket_name=config.storage_s3_bucket,
-            prefix=prefix,
-            aws_region=config.storage_s3_region,
-            aws_endpoint_url=config.storage_s3_endpoint_url,
-            force_path_style=config.storage_s3_force_path_style,
-            aws_access_key_id=config.storage_s3_access_key_id,
-            aws_secret_access_key=config.storage_s3_secret_access_key,
-            aws_session_token=config.storage_s3_session_token,
+async def __run_dedup_report(config: StorageConfig) -> None:
+    async with create_storage(config) as storage:
+        illust_binary_dao = IllustBinaryDao(
+            storage=storage,
         )
-    else:
-        raise ValueError(f"Unknown storage_type: {config.storage_type}")
-
-    illust_meta_dao = IllustMetaDao(
-        storage=storage,
-    )
 
-    illust_binary_dao = IllustBinaryDao(
-        storage=storage,
-    )
-
-    api = AppPixivAPI()
+        await report_dedup(
+            storage=storage,
+            illust_binary_dao=illust_binary_dao,
+        )
 
-    api.auth(refresh_token=config.refresh_token)
 
-    result = api.search_illust(
-        word=config.keyword,
-        search_target="exact_match_for_tags",
-        sort="date_desc" if config.desc else "date_asc",
-        req_auth=True,
+async def run_dedup_report(args: Namespace) -> None:
+    await __run_dedup_report(
+        config=StorageConfig(
+            storage_type=args.storage_type,
+            root_dir=args.root_dir,
+            storage_s3_bucket=args.storage_s3_bucket,
+            storage_s3_region=args.storage_s3_region,
+            storage_s3_endpoint_url=args.storage_s3_endpoint_url,
+            storage_s3_force_path_style=args.storage_s3_force_path_style,
+            storage_s3_access_key_id=args.storage_s3_access_key_id,
+            storage_s3_secret_access_key=args.storage_s3_secret_access_key,
+            storage_s3_session_token=args.storage_s3_session_token,
+            storage_s3_max_pool_connections=args.storage_s3_max_pool_connections,
+            storage_s3_multipart_threshold_mib=args.storage_s3_multipart_threshold_mib,
+            storage_s3_multipart_chunksize_mib=args.storage_s3_multipart_chunksize_mib,
+            storage_s3_transfer_concurrency=args.storage_s3_transfer_concurrency,
+            storage_s3_checksum_algorithm=args.storage_s3_checksum_algorithm,
+            storage_io_concurrency=args.storage_io_concurrency,
+        )
     )
 
-    updated_at_utc = datetime.now(UTC)  # utc aware current time
 
-    download_func = download_illusts_asc
-    if config.desc:
-        download_func = download_illusts_desc
+async def __run_compact_meta(config: CompactMetaConfig) -> None:
+    async with create_storage(config) as storage:
+        illust_meta_dao = IllustMetaDao(
+            storage=storage,
+            cache_size=config.meta_cache_size,
+            packed=True,
+            compression=config.meta_compression,
+            segment_size=config.meta_segment_size,
+        )
 
-    await download_func(
-        api=api,
-        first_result=result,
-        next_func=api.search_illust,
-        illust_meta_dao=illust_meta_dao,
-        illust_binary_dao=illust_binary_dao,
-        ignore_existence=config.recrawl,
-        updated_at_utc=updated_at_utc,
-        download_interval=config.download_interval,
-        page_interval=config.page_interval,
-        retry_interval=config.retry_interval,
-    )
+        await compact_illust_meta(
+            storage=storage,
+            illust_meta_dao=illust_meta_dao,
+            keep_loose=config.keep_loose,
+            worker_id=f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}",
+            lease_seconds=config.lease_seconds,
+            lease_settle_seconds=config.lease_settle_seconds,
+        )
 
 
-async def run_search_tag(args: Namespace) -> None:
-    await __run_search_tag(
-        config=SearchTagConfig(
+async def run_compact_meta(args: Namespace) -> None:
+    await __run_compact_meta(
+        config=CompactMetaConfig(
             storage_type=args.storage_type,
             root_dir=args.root_dir,
             storage_s3_bucket=args.storage_s3_bucket,
@@ -470,178 +1972,571 @@ async def run_search_tag(args: Namespace) -> None:
             storage_s3_access_key_id=args.storage_s3_access_key_id,
             storage_s3_secret_access_key=args.storage_s3_secret_access_key,
             storage_s3_session_token=args.storage_s3_session_token,
-            refresh_token=args.refresh_token,
-            keyword=args.keyword,
-            recrawl=args.recrawl,
-            desc=args.desc,
-            download_interval=args.download_interval,
-            page_interval=args.page_interval,
-            retry_interval=args.retry_interval,
+            storage_s3_max_pool_connections=args.storage_s3_max_pool_connections,
+            storage_s3_multipart_threshold_mib=args.storage_s3_multipart_threshold_mib,
+            storage_s3_multipart_chunksize_mib=args.storage_s3_multipart_chunksize_mib,
+            storage_s3_transfer_concurrency=args.storage_s3_transfer_concurrency,
+            storage_s3_checksum_algorithm=args.storage_s3_checksum_algorithm,
+            storage_io_concurrency=args.storage_io_concurrency,
+            meta_cache_size=args.meta_cache_size,
+            meta_compression=args.meta_compression,
+            meta_segment_size=args.meta_segment_size,
+            keep_loose=args.keep_loose,
+            lease_seconds=args.lease_seconds,
+            lease_settle_seconds=args.lease_settle_seconds,
         )
     )
 
 
-async def main() -> None:
-    load_dotenv()
+ILLUST_META_FIELDS = {
+    "meta_cache_size",
+    "packed_meta",
+    "meta_compression",
+    "meta_segment_size",
+}
+
+
+def load_job_configs(
+    job_file: Path,
+    defaults: dict[str, Any],
+) -> list[BookmarkConfig | SearchTagConfig]:
+    # each job overrides the defaults given by arguments and environment variables
+    jobs = json.loads(job_file.read_text(encoding="utf-8"))
+    if not isinstance(jobs, list):
+        raise ValueError(f"Job file must be a list of jobs: {job_file}")
+
+    job_configs: list[BookmarkConfig | SearchTagConfig] = []
+    for job in jobs:
+        job = dict(job)
+        job_type = job.pop("type", None)
+
+        if job_type == "bookmark":
+            job_configs.append(BookmarkConfig.model_validate({**defaults, **job}))
+        elif job_type == "search_tag":
+            job_configs.append(
+                SearchTagConfig.model_validate({"desc": False, **defaults, **job})
+            )
+        else:
+            raise ValueError(f"Unknown job type: {job_type}")
+
+    # jobs on a storage share an IllustMetaDao, so they must agree on its settings
+    storage_fields = set(StorageConfig.model_fields)
+    meta_settings: dict[str, str] = {}
+    for job_index, job_config in enumerate(job_configs):
+        storage_key = job_config.model_dump_json(include=storage_fields)
+        meta_setting = job_config.model_dump_json(include=ILLUST_META_FIELDS)
+        if meta_settings.setdefault(storage_key, meta_setting) != meta_setting:
+            raise ValueError(
+                f"Job {job_index + 1} has illust meta settings different from "
+                f"the other jobs on the same storage: {meta_setting}"
+            )
 
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    return job_configs
+
+
+async def __run_jobs(
+    job_configs: list[BookmarkConfig | SearchTagConfig],
+    rate_limiter: RateLimiter,
+    job_concurrency: int,
+) -> None:
+    async with AsyncExitStack() as exit_stack:
+        # share storage clients, DAOs and API sessions between jobs
+        storages: dict[str, Storage] = {}
+        illust_meta_daos: dict[str, IllustMetaDao] = {}
+        illust_manifest_daos: dict[str, IllustManifestDao] = {}
+        apis: dict[str, AppPixivAPI] = {}
+
+        storage_fields = set(StorageConfig.model_fields)
+
+        for job_config in job_configs:
+            storage_key = job_config.model_dump_json(include=storage_fields)
+            if storage_key not in storages:
+                storage = await exit_stack.enter_async_context(
+                    create_storage(
+                        job_config,
+                        download_concurrency=sum(
+                            other_config.download_concurrency
+                            for other_config in job_configs
+                            if other_config.model_dump_json(include=storage_fields)
+                            == storage_key
+                        ),
+                    )
+                )
+                storages[storage_key] = storage
+                illust_meta_daos[storage_key] = create_illust_meta_dao(
+                    storage=storage, config=job_config
+                )
+                # store buffered illust meta before the storage is closed
+                exit_stack.push_async_callback(illust_meta_daos[storage_key].flush)
+
+            manifest_path = job_config.manifest_path
+            if manifest_path and manifest_path not in illust_manifest_daos:
+                illust_manifest_dao = IllustManifestDao(
+                    manifest_path=Path(manifest_path)
+                )
+                exit_stack.callback(illust_manifest_dao.close)
+                illust_manifest_daos[manifest_path] = illust_manifest_dao
+
+            if job_config.refresh_token not in apis:
+                api = create_pixiv_api()
+                await exit_stack.enter_async_context(
+                    PixivAuthKeeper(api=api, refresh_token=job_config.refresh_token)
+                )
+                apis[job_config.refresh_token] = api
+
+        job_semaphore = asyncio.Semaphore(job_concurrency)
+
+        async def run_job(job_config: BookmarkConfig | SearchTagConfig) -> None:
+            storage_key = job_config.model_dump_json(include=storage_fields)
+
+            crawl_func: Any = crawl_bookmark
+            if isinstance(job_config, SearchTagConfig):
+                crawl_func = crawl_search_tag
+
+            # hold the slot only while crawling, not while waiting for the next poll
+            async def crawl_job(config: BookmarkConfig | SearchTagConfig) -> int:
+                async with job_semaphore:
+                    num_new_illusts: int = await crawl_func(
+                        config=config,
+                        api=apis[config.refresh_token],
+                        storage=storages[storage_key],
+                        illust_meta_dao=illust_meta_daos[storage_key],
+                        illust_manifest_dao=(
+                            illust_manifest_daos[config.manifest_path]
+                            if config.manifest_path
+                            else None
+                        ),
+                        rate_limiter=rate_limiter,
+                    )
+
+                return num_new_illusts
+
+            await poll_crawl(config=job_config, crawl_func=crawl_job)
+
+        # a failed job does not stop the others
+        results = await asyncio.gather(
+            *(run_job(job_config) for job_config in job_configs),
+            return_exceptions=True,
+        )
+
+        num_failed_jobs = 0
+        for job_index, result in enumerate(results):
+            if isinstance(result, BaseException):
+                num_failed_jobs += 1
+                logger.error(f"Job {job_index + 1} failed", exc_info=result)
+
+        for illust_meta_dao in illust_meta_daos.values():
+            logger.info(
+                f"Illust meta cache: hits={illust_meta_dao.cache_hits}, "
+                f"misses={illust_meta_dao.cache_misses}"
+            )
+
+        if num_failed_jobs > 0:
+            raise RuntimeError(f"{num_failed_jobs}/{len(job_configs)} jobs failed")
+
+
+async def run_jobs(args: Namespace) -> None:
+    if not args.job_file:
+        raise ValueError("job_file is required for run-jobs")
+
+    job_configs = load_job_configs(
+        job_file=Path(args.job_file),
+        defaults={
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("handler", "job_file", "job_concurrency")
+        },
     )
 
-    parser = ArgumentParser()
+    # one rate budget for all jobs, sized by the arguments of run-jobs
+    rate_limiter = RateLimiter.from_intervals(
+        page_interval=args.page_interval,
+        download_interval=args.download_interval,
+        retry_interval=args.retry_interval,
+        max_retries=args.max_retries,
+        download_concurrency=args.download_concurrency,
+        download_interval_per_worker=args.download_interval_per_worker,
+    )
 
-    subparsers = parser.add_subparsers()
+    await __run_jobs(
+        job_configs=job_configs,
+        rate_limiter=rate_limiter,
+        job_concurrency=args.job_concurrency,
+    )
 
-    subparser_bookmark = subparsers.add_parser("bookmark")
-    subparser_bookmark.add_argument(
+
+def add_storage_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument(
         "--storage_type",
         type=str,
         default=os.environ.get("XIVBKMDL_STORAGE_TYPE") or "filesystem",
         choices=["filesystem", "s3"],
     )
-    subparser_bookmark.add_argument(
+    parser.add_argument(
         "--root_dir",
         type=str,
         default=os.environ.get("XIVBKMDL_ROOT_DIR"),
     )
-    subparser_bookmark.add_argument(
+    parser.add_argument(
         "--storage_s3_bucket",
         type=str,
         default=os.environ.get("XIVBKMDL_STORAGE_S3_BUCKET"),
     )
-    subparser_bookmark.add_argument(
+    parser.add_argument(
         "--storage_s3_region",
         type=str,
         default=os.environ.get("XIVBKMDL_STORAGE_S3_REGION"),
     )
-    subparser_bookmark.add_argument(
+    parser.add_argument(
         "--storage_s3_endpoint_url",
         type=str,
         default=os.environ.get("XIVBKMDL_STORAGE_S3_ENDPOINT_URL"),
     )
-    subparser_bookmark.add_argument(
+    parser.add_argument(
         "--storage_s3_force_path_style",
         type=bool,
         default=os.environ.get("XIVBKMDL_STORAGE_S3_FORCE_PATH_STYLE") == "true",
     )
-    subparser_bookmark.add_argument(
+    parser.add_argument(
         "--storage_s3_access_key_id",
         type=str,
-        default=os.environ.get("XIVBKMDL_STORAGE_S3_ACCESS_KEY_ID"),
+        default=os.environ.get("XIVBKMDL_STORAGE_S3_ACCESS_KEY_ID") or None,
     )
-    subparser_bookmark.add_argument(
+    parser.add_argument(
         "--storage_s3_secret_access_key",
         type=str,
-        default=os.environ.get("XIVBKMDL_STORAGE_S3_SECRET_ACCESS_KEY"),
+        default=os.environ.get("XIVBKMDL_STORAGE_S3_SECRET_ACCESS_KEY") or None,
     )
-    subparser_bookmark.add_argument(
+    parser.add_argument(
         "--storage_s3_session_token",
         type=str,
         default=os.environ.get("XIVBKMDL_STORAGE_S3_SESSION_TOKEN"),
     )
-    subparser_bookmark.add_argument(
+    parser.add_argument(
+        "--storage_s3_max_pool_connections",
+        type=int,
+        default=os.environ.get("XIVBKMDL_STORAGE_S3_MAX_POOL_CONNECTIONS") or None,
+    )
+    parser.add_argument(
+        "--storage_s3_multipart_threshold_mib",
+        type=int,
+        default=os.environ.get("XIVBKMDL_STORAGE_S3_MULTIPART_THRESHOLD_MIB", "8"),
+    )
+    parser.add_argument(
+        "--storage_s3_multipart_chunksize_mib",
+        type=int,
+        default=os.environ.get("XIVBKMDL_STORAGE_S3_MULTIPART_CHUNKSIZE_MIB", "8"),
+        help="part size of multipart uploads, 5 MiB or more",
+    )
+    parser.add_argument(
+        "--storage_s3_transfer_concurrency",
+        type=int,
+        default=os.environ.get("XIVBKMDL_STORAGE_S3_TRANSFER_CONCURRENCY", "10"),
+        help="parts of an object transferred concurrently",
+    )
+    parser.add_argument(
+        "--storage_s3_checksum_algorithm",
+        type=str,
+        default=os.environ.get("XIVBKMDL_STORAGE_S3_CHECKSUM_ALGORITHM", "CRC32"),
+        choices=["none", "CRC32", "CRC32C", "SHA1", "SHA256"],
+        help="checksum verified by S3 on upload, CRC32C requires awscrt",
+    )
+    parser.add_argument(
+        "--storage_io_concurrency",
+        type=int,
+        default=os.environ.get("XIVBKMDL_STORAGE_IO_CONCURRENCY") or None,
+        help="threads running blocking storage operations",
+    )
+    parser.add_argument(
+        "--meta_cache_size",
+        type=int,
+        default=os.environ.get("XIVBKMDL_META_CACHE_SIZE", "4096"),
+    )
+    parser.add_argument(
+        "--packed_meta",
+        action="store_true",
+        default=os.environ.get("XIVBKMDL_PACKED_META") == "true",
+    )
+    parser.add_argument(
+        "--meta_compression",
+        type=str,
+        default=os.environ.get("XIVBKMDL_META_COMPRESSION") or "none",
+        choices=["none", "gzip", "zstd"],
+    )
+    parser.add_argument(
+        "--meta_segment_size",
+        type=int,
+        default=os.environ.get("XIVBKMDL_META_SEGMENT_SIZE", "1000"),
+    )
+    parser.add_argument(
+        "--manifest_path",
+        type=str,
+        default=os.environ.get("XIVBKMDL_MANIFEST_PATH") or None,
+    )
+
+
+def add_crawl_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument(
         "--refresh_token", type=str, default=os.environ.get("XIVBKMDL_REFRESH_TOKEN")
     )
-    subparser_bookmark.add_argument(
-        "--user_id", type=int, default=os.environ.get("XIVBKMDL_USER_ID")
+    parser.add_argument("--recrawl", action="store_true")
+    parser.add_argument("--resume", action="store_true")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=os.environ.get("XIVBKMDL_INCREMENTAL") == "true",
     )
-    subparser_bookmark.add_argument("--recrawl", action="store_true")
-    subparser_bookmark.add_argument(
+    parser.add_argument(
+        "--incremental_max_empty_pages",
+        type=int,
+        default=os.environ.get("XIVBKMDL_INCREMENTAL_MAX_EMPTY_PAGES", "3"),
+        help="bookmark pages without new illusts before stopping short of "
+        "the watermark",
+    )
+    parser.add_argument(
         "--download_interval",
         type=float,
         default=os.environ.get("XIVBKMDL_DOWNLOAD_INTERVAL", "1.0"),
     )
-    subparser_bookmark.add_argument(
+    parser.add_argument(
         "--page_interval",
         type=float,
         default=os.environ.get("XIVBKMDL_PAGE_INTERVAL", "3.0"),
     )
-    subparser_bookmark.add_argument(
+    parser.add_argument(
         "--retry_interval",
         type=float,
         default=os.environ.get("XIVBKMDL_RETRY_INTERVAL", "10.0"),
     )
-    subparser_bookmark.set_defaults(handler=run_bookmark)
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        default=os.environ.get("XIVBKMDL_MAX_RETRIES", "5"),
+    )
+    parser.add_argument(
+        "--download_concurrency",
+        type=int,
+        default=os.environ.get("XIVBKMDL_DOWNLOAD_CONCURRENCY", "4"),
+    )
+    parser.add_argument(
+        "--download_interval_per_worker",
+        action="store_true",
+        default=os.environ.get("XIVBKMDL_DOWNLOAD_INTERVAL_PER_WORKER") == "true",
+        help="apply --download_interval to each concurrent download",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        default=os.environ.get("XIVBKMDL_DEDUP") == "true",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        default=os.environ.get("XIVBKMDL_WATCH") == "true",
+    )
+    parser.add_argument(
+        "--watch_interval",
+        type=float,
+        default=os.environ.get("XIVBKMDL_WATCH_INTERVAL", "60.0"),
+    )
+    parser.add_argument(
+        "--watch_min_interval",
+        type=float,
+        default=os.environ.get("XIVBKMDL_WATCH_MIN_INTERVAL", "30.0"),
+    )
+    parser.add_argument(
+        "--watch_max_interval",
+        type=float,
+        default=os.environ.get("XIVBKMDL_WATCH_MAX_INTERVAL", "120.0"),
+    )
 
-    subparser_search_tag = subparsers.add_parser("search_tag")
-    subparser_search_tag.add_argument(
-        "--storage_type",
-        type=str,
-        default=os.environ.get("XIVBKMDL_STORAGE_TYPE") or "filesystem",
-        choices=["filesystem", "s3"],
+
+def add_shard_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--keyword", type=str, default=os.environ.get("XIVBKMDL_KEYWORD")
     )
-    subparser_search_tag.add_argument(
-        "--root_dir",
-        type=str,
-        default=os.environ.get("XIVBKMDL_ROOT_DIR"),
+    parser.add_argument(
+        "--shard_start_date",
+        type=date.fromisoformat,
+        # the oldest illusts on pixiv
+        default=os.environ.get("XIVBKMDL_SHARD_START_DATE", "2007-09-10"),
     )
-    subparser_search_tag.add_argument(
-        "--storage_s3_bucket",
-        type=str,
-        default=os.environ.get("XIVBKMDL_STORAGE_S3_BUCKET"),
+    parser.add_argument(
+        "--shard_end_date",
+        type=date.fromisoformat,
+        default=os.environ.get("XIVBKMDL_SHARD_END_DATE") or None,
+        help="today by default",
     )
-    subparser_search_tag.add_argument(
-        "--storage_s3_region",
-        type=str,
-        default=os.environ.get("XIVBKMDL_STORAGE_S3_REGION"),
+    parser.add_argument(
+        "--shard_days",
+        type=int,
+        default=os.environ.get("XIVBKMDL_SHARD_DAYS", "30"),
     )
-    subparser_search_tag.add_argument(
-        "--storage_s3_endpoint_url",
+    parser.add_argument(
+        "--shard_workers",
+        type=int,
+        default=os.environ.get("XIVBKMDL_SHARD_WORKERS", "0"),
+        help="local worker processes started by shard-plan",
+    )
+    add_lease_arguments(parser)
+
+
+def add_lease_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--lease_seconds",
+        type=float,
+        default=os.environ.get("XIVBKMDL_LEASE_SECONDS", "300.0"),
+        help="leases of workers stopped for this long are taken over",
+    )
+    parser.add_argument(
+        "--lease_settle_seconds",
+        type=float,
+        default=os.environ.get("XIVBKMDL_LEASE_SETTLE_SECONDS", "2.0"),
+        help="wait for racing workers before reading a lease back",
+    )
+
+
+def add_output_arguments(parser: ArgumentParser) -> None:
+    parser.add_argument(
+        "--progress_format",
         type=str,
-        default=os.environ.get("XIVBKMDL_STORAGE_S3_ENDPOINT_URL"),
+        default=os.environ.get("XIVBKMDL_PROGRESS_FORMAT") or "text",
+        choices=["text", "json"],
     )
-    subparser_search_tag.add_argument(
-        "--storage_s3_force_path_style",
-        type=bool,
-        default=os.environ.get("XIVBKMDL_STORAGE_S3_FORCE_PATH_STYLE") == "true",
+    parser.add_argument(
+        "--metrics_port",
+        type=int,
+        default=os.environ.get("XIVBKMDL_METRICS_PORT") or None,
     )
-    subparser_search_tag.add_argument(
-        "--storage_s3_access_key_id",
+    parser.add_argument(
+        "--metrics_file",
         type=str,
-        default=os.environ.get("XIVBKMDL_STORAGE_S3_ACCESS_KEY_ID") or None,
+        default=os.environ.get("XIVBKMDL_METRICS_FILE") or None,
     )
-    subparser_search_tag.add_argument(
-        "--storage_s3_secret_access_key",
+    parser.add_argument(
+        "--metrics_interval",
+        type=float,
+        default=os.environ.get("XIVBKMDL_METRICS_INTERVAL", "15.0"),
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=os.environ.get("XIVBKMDL_PROFILE") == "true",
+    )
+    parser.add_argument(
+        "--profile_cprofile",
         type=str,
-        default=os.environ.get("XIVBKMDL_STORAGE_S3_SECRET_ACCESS_KEY") or None,
+        default=os.environ.get("XIVBKMDL_PROFILE_CPROFILE") or None,
+        help="write cProfile stats of the event loop thread",
     )
-    subparser_search_tag.add_argument(
-        "--storage_s3_session_token",
+    parser.add_argument(
+        "--profile_trace",
         type=str,
-        default=os.environ.get("XIVBKMDL_STORAGE_S3_SESSION_TOKEN"),
+        default=os.environ.get("XIVBKMDL_PROFILE_TRACE") or None,
+        help="write spans in the Chrome trace event format",
     )
-    subparser_search_tag.add_argument(
-        "--refresh_token", type=str, default=os.environ.get("XIVBKMDL_REFRESH_TOKEN")
+
+
+async def main() -> None:
+    load_dotenv()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    )
+
+    parser = ArgumentParser()
+
+    subparsers = parser.add_subparsers()
+
+    subparser_bookmark = subparsers.add_parser("bookmark")
+    add_storage_arguments(subparser_bookmark)
+    add_output_arguments(subparser_bookmark)
+    add_crawl_arguments(subparser_bookmark)
+    subparser_bookmark.add_argument(
+        "--user_id", type=int, default=os.environ.get("XIVBKMDL_USER_ID")
     )
+    subparser_bookmark.set_defaults(handler=run_bookmark)
+
+    subparser_search_tag = subparsers.add_parser("search_tag")
+    add_storage_arguments(subparser_search_tag)
+    add_output_arguments(subparser_search_tag)
+    add_crawl_arguments(subparser_search_tag)
     subparser_search_tag.add_argument(
         "--keyword", type=str, default=os.environ.get("XIVBKMDL_KEYWORD")
     )
-    subparser_search_tag.add_argument("--recrawl", action="store_true")
     subparser_search_tag.add_argument("--desc", action="store_true")
-    subparser_search_tag.add_argument(
-        "--download_interval",
-        type=float,
-        default=os.environ.get("XIVBKMDL_DOWNLOAD_INTERVAL", "1.0"),
+    subparser_search_tag.set_defaults(handler=run_search_tag)
+
+    subparser_shard_plan = subparsers.add_parser("shard-plan")
+    add_storage_arguments(subparser_shard_plan)
+    add_output_arguments(subparser_shard_plan)
+    add_crawl_arguments(subparser_shard_plan)
+    add_shard_arguments(subparser_shard_plan)
+    subparser_shard_plan.set_defaults(handler=run_shard_plan)
+
+    subparser_shard_worker = subparsers.add_parser("shard-worker")
+    add_storage_arguments(subparser_shard_worker)
+    add_output_arguments(subparser_shard_worker)
+    add_crawl_arguments(subparser_shard_worker)
+    add_shard_arguments(subparser_shard_worker)
+    subparser_shard_worker.set_defaults(handler=run_shard_worker)
+
+    subparser_run_jobs = subparsers.add_parser("run-jobs")
+    add_storage_arguments(subparser_run_jobs)
+    add_output_arguments(subparser_run_jobs)
+    add_crawl_arguments(subparser_run_jobs)
+    subparser_run_jobs.add_argument(
+        "--job_file", type=str, default=os.environ.get("XIVBKMDL_JOB_FILE")
     )
-    subparser_search_tag.add_argument(
-        "--page_interval",
-        type=float,
-        default=os.environ.get("XIVBKMDL_PAGE_INTERVAL", "3.0"),
+    subparser_run_jobs.add_argument(
+        "--job_concurrency",
+        type=int,
+        default=os.environ.get("XIVBKMDL_JOB_CONCURRENCY", "4"),
     )
-    subparser_search_tag.add_argument(
-        "--retry_interval",
-        type=float,
-        default=os.environ.get("XIVBKMDL_RETRY_INTERVAL", "10.0"),
+    subparser_run_jobs.set_defaults(handler=run_jobs)
+
+    subparser_rebuild_index = subparsers.add_parser("rebuild-index")
+    add_storage_arguments(subparser_rebuild_index)
+    add_output_arguments(subparser_rebuild_index)
+    subparser_rebuild_index.set_defaults(handler=run_rebuild_index)
+
+    subparser_dedup_report = subparsers.add_parser("dedup-report")
+    add_storage_arguments(subparser_dedup_report)
+    add_output_arguments(subparser_dedup_report)
+    subparser_dedup_report.set_defaults(handler=run_dedup_report)
+
+    subparser_compact_meta = subparsers.add_parser("compact-meta")
+    add_storage_arguments(subparser_compact_meta)
+    add_output_arguments(subparser_compact_meta)
+    add_lease_arguments(subparser_compact_meta)
+    subparser_compact_meta.add_argument(
+        "--keep_loose",
+        action="store_true",
+        help="keep loose illust.json files folded into segments",
     )
-    subparser_search_tag.set_defaults(handler=run_search_tag)
+    subparser_compact_meta.set_defaults(handler=run_compact_meta)
 
     args = parser.parse_args()
 
     if hasattr(args, "handler"):
-        if iscoroutinefunction(args.handler):
-            await args.handler(args)
-        else:
-            args.handler(args)
+        set_progress_format(args.progress_format)
+
+        with profile_run(
+            enabled=args.profile,
+            cprofile_path=(
+                Path(args.profile_cprofile) if args.profile_cprofile else None
+            ),
+            trace_path=Path(args.profile_trace) if args.profile_trace else None,
+        ):
+            async with MetricsExporter(
+                port=args.metrics_port,
+                file_path=Path(args.metrics_file) if args.metrics_file else None,
+                write_interval=args.metrics_interval,
+            ):
+                if iscoroutinefunction(args.handler):
+                    await args.handler(args)
+                else:
+                    args.handler(args)
     else:
         parser.print_help()
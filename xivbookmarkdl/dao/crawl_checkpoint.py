@@ -0,0 +1,154 @@
+from datetime import UTC, datetime
+from logging import getLogger
+from typing import Any
+
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+from ..storage.base import Storage, StorageDownloadNotFoundError
+
+logger = getLogger(__name__)
+
+CHECKPOINT_PREFIX = ".xivbookmarkdl/checkpoints/"
+
+
+class CrawlCheckpoint(BaseModel):
+    # query of the next page to fetch, None if paging has finished
+    next_qs: dict[str, Any] | None
+    num_pages: int
+    updated_at: datetime
+
+
+class CrawlCheckpointPage(BaseModel):
+    illusts: list[dict[str, Any]]
+
+
+# paging cursor and pending illusts of a crawl job,
+# stored page by page to keep each save proportional to the page size.
+# a dao is used for a single run, and touches the storage only when the run
+# has something pending, so an idle run costs no storage round trips
+class CrawlCheckpointDao:
+    def __init__(self, storage: Storage, job_key: str):
+        self.storage = storage
+        self.job_key = job_key
+
+        # whether this run loaded or wrote the checkpoint
+        self._stored = False
+        # the checkpoint of an interrupted run is discarded before the first write
+        self._discard_before_write = False
+
+    @property
+    def checkpoint_prefix(self) -> str:
+        return f"{CHECKPOINT_PREFIX}{self.job_key}/"
+
+    def _get_page_key(self, page_index: int) -> str:
+        return f"{self.checkpoint_prefix}pages/{page_index:08d}.json"
+
+    async def get_checkpoint(self) -> CrawlCheckpoint | None:
+        checkpoint_key = f"{self.checkpoint_prefix}checkpoint.json"
+
+        try:
+            checkpoint_bytes = await self.storage.read_bytes(key=checkpoint_key)
+        except StorageDownloadNotFoundError:
+            return None
+
+        try:
+            checkpoint = CrawlCheckpoint.model_validate_json(checkpoint_bytes)
+        except Exception as error:
+            logger.error(f"Failed to load checkpoint: {checkpoint_key}")
+            logger.exception(error)
+
+            # overwritten by this run
+            self._discard_before_write = True
+
+            return None
+
+        self._stored = True
+
+        return checkpoint
+
+    async def get_pending_illusts(
+        self, checkpoint: CrawlCheckpoint
+    ) -> list[dict[str, Any]]:
+        illusts: list[dict[str, Any]] = []
+        for page_index in range(checkpoint.num_pages):
+            page_key = self._get_page_key(page_index=page_index)
+
+            try:
+                page_bytes = await self.storage.read_bytes(key=page_key)
+            except StorageDownloadNotFoundError:
+                # pages without pending illusts are not stored
+                continue
+
+            page = CrawlCheckpointPage.model_validate_json(page_bytes)
+            illusts.extend(page.illusts)
+
+        return illusts
+
+    async def save_page(
+        self,
+        page_index: int,
+        illusts: list[dict[str, Any]],
+        next_qs: dict[str, Any] | None,
+    ) -> None:
+        # store the page before the cursor,
+        # so that the cursor never points beyond stored pages
+        if len(illusts) > 0:
+            await self._prepare_write()
+            await self.storage.upload_bytes(
+                dest_key=self._get_page_key(page_index=page_index),
+                data=to_json(CrawlCheckpointPage(illusts=illusts)),
+            )
+
+        await self.save_cursor(num_pages=page_index + 1, next_qs=next_qs)
+
+    async def save_cursor(
+        self,
+        num_pages: int,
+        next_qs: dict[str, Any] | None,
+    ) -> None:
+        await self._prepare_write()
+
+        await self.storage.upload_bytes(
+            dest_key=f"{self.checkpoint_prefix}checkpoint.json",
+            data=to_json(
+                CrawlCheckpoint(
+                    next_qs=next_qs,
+                    num_pages=num_pages,
+                    updated_at=datetime.now(tz=UTC),
+                )
+            ),
+        )
+
+    def discard_checkpoint(self) -> None:
+        # pages of an interrupted run must not be mixed with the pages of this run.
+        # if this run writes nothing, the stale checkpoint is left as is:
+        # resuming it only re-checks illusts that are skipped as stored
+        self._discard_before_write = True
+
+    async def _prepare_write(self) -> None:
+        if self._discard_before_write:
+            self._discard_before_write = False
+            await self._delete_all()
+
+        self._stored = True
+
+    async def delete_checkpoint(self) -> None:
+        if not self._stored:
+            return
+
+        await self._delete_all()
+        self._stored = False
+
+    async def _delete_all(self) -> None:
+        keys = [
+            key
+            async for key in self.storage.iter_with_prefix(
+                prefix=self.checkpoint_prefix
+            )
+        ]
+
+        # delete the cursor first, so that a partially deleted checkpoint is ignored
+        keys.sort(key=lambda key: not key.endswith("/checkpoint.json"))
+        for key in keys:
+            await self.storage.delete(key=key)
@@ -0,0 +1,149 @@
+from datetime import UTC, date, datetime, timedelta
+
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+from ..storage.base import Storage, StorageDownloadNotFoundError
+from .storage_lease import StorageLease, StorageLeaseDao
+
+SHARD_PREFIX = ".xivbookmarkdl/shards/"
+
+
+class CrawlShard(BaseModel):
+    shard_id: str
+    # inclusive days of the search
+    start_date: date
+    end_date: date
+
+
+class CrawlShardPlan(BaseModel):
+    shards: list[CrawlShard]
+    created_at: datetime
+
+
+class CrawlShardDone(BaseModel):
+    worker_id: str
+    num_new_illusts: int
+    done_at: datetime
+
+
+def plan_crawl_shards(
+    start_date: date, end_date: date, shard_days: int
+) -> list[CrawlShard]:
+    if shard_days < 1:
+        raise ValueError(f"shard_days must be positive: {shard_days}")
+
+    shards: list[CrawlShard] = []
+    shard_start_date = start_date
+    while shard_start_date <= end_date:
+        shard_end_date = min(
+            shard_start_date + timedelta(days=shard_days - 1), end_date
+        )
+        shards.append(
+            CrawlShard(
+                shard_id=f"{shard_start_date.isoformat()}_{shard_end_date.isoformat()}",
+                start_date=shard_start_date,
+                end_date=shard_end_date,
+            )
+        )
+        shard_start_date = shard_end_date + timedelta(days=1)
+
+    return shards
+
+
+# shard plan of a crawl job and the leases of its shards (see storage_lease),
+# shared by workers through the storage
+class CrawlShardDao:
+    def __init__(self, storage: Storage, job_key: str):
+        self.storage = storage
+        self.job_key = job_key
+
+        self._lease_dao = StorageLeaseDao(storage=storage)
+
+    @property
+    def shard_prefix(self) -> str:
+        return f"{SHARD_PREFIX}{self.job_key}/"
+
+    def _get_lease_key(self, shard_id: str) -> str:
+        return f"{self.shard_prefix}{shard_id}/lease.json"
+
+    def _get_done_key(self, shard_id: str) -> str:
+        return f"{self.shard_prefix}{shard_id}/done.json"
+
+    async def get_plan(self) -> CrawlShardPlan | None:
+        try:
+            plan_bytes = await self.storage.read_bytes(
+                key=f"{self.shard_prefix}plan.json"
+            )
+        except StorageDownloadNotFoundError:
+            return None
+
+        return CrawlShardPlan.model_validate_json(plan_bytes)
+
+    async def save_plan(self, shards: list[CrawlShard]) -> CrawlShardPlan:
+        plan = CrawlShardPlan(shards=shards, created_at=datetime.now(tz=UTC))
+
+        await self.storage.upload_bytes(
+            dest_key=f"{self.shard_prefix}plan.json",
+            data=to_json(plan),
+        )
+
+        return plan
+
+    async def get_done_shard_ids(self) -> set[str]:
+        # one listing instead of a read per shard
+        done_shard_ids: set[str] = set()
+        async for key in self.storage.iter_with_prefix(prefix=self.shard_prefix):
+            relative_key = key[len(self.shard_prefix) :]
+            shard_id, _, filename = relative_key.partition("/")
+            if filename == "done.json":
+                done_shard_ids.add(shard_id)
+
+        return done_shard_ids
+
+    async def mark_done(
+        self, shard_id: str, worker_id: str, num_new_illusts: int
+    ) -> None:
+        await self.storage.upload_bytes(
+            dest_key=self._get_done_key(shard_id=shard_id),
+            data=to_json(
+                CrawlShardDone(
+                    worker_id=worker_id,
+                    num_new_illusts=num_new_illusts,
+                    done_at=datetime.now(tz=UTC),
+                )
+            ),
+        )
+
+    async def get_lease(self, shard_id: str) -> StorageLease | None:
+        return await self._lease_dao.get_lease(
+            lease_key=self._get_lease_key(shard_id=shard_id)
+        )
+
+    async def acquire_lease(
+        self,
+        shard_id: str,
+        worker_id: str,
+        lease_seconds: float,
+        settle_seconds: float,
+    ) -> StorageLease | None:
+        return await self._lease_dao.acquire_lease(
+            lease_key=self._get_lease_key(shard_id=shard_id),
+            worker_id=worker_id,
+            lease_seconds=lease_seconds,
+            settle_seconds=settle_seconds,
+        )
+
+    async def renew_lease(
+        self, shard_id: str, lease: StorageLease, lease_seconds: float
+    ) -> StorageLease | None:
+        return await self._lease_dao.renew_lease(
+            lease_key=self._get_lease_key(shard_id=shard_id),
+            lease=lease,
+            lease_seconds=lease_seconds,
+        )
+
+    async def release_lease(self, shard_id: str, lease: StorageLease) -> bool:
+        return await self._lease_dao.release_lease(
+            lease_key=self._get_lease_key(shard_id=shard_id), lease=lease
+        )
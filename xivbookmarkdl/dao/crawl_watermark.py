@@ -0,0 +1,125 @@
+from collections.abc import Collection, Sequence
+from datetime import UTC, datetime
+from logging import getLogger
+from typing import TypeVar
+
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+from ..storage.base import Storage, StorageDownloadNotFoundError
+
+logger = getLogger(__name__)
+
+WATERMARK_PREFIX = ".xivbookmarkdl/watermarks/"
+
+# the newest bookmarks kept to find the boundary of the last sync
+BOOKMARK_WATERMARK_SIZE = 5
+
+
+class CrawlWatermark(BaseModel):
+    # the newest illust committed by an asc crawl
+    create_date: datetime
+    illust_id: int
+    updated_at: datetime
+
+    def covers(self, create_date: datetime, illust_id: int) -> bool:
+        return (create_date, illust_id) <= (self.create_date, self.illust_id)
+
+
+class BookmarkWatermark(BaseModel):
+    # ids of the newest bookmarked illusts at the last sync, newest first
+    illust_ids: list[int]
+    # cursor to the page after them
+    max_bookmark_id: int | None
+    updated_at: datetime
+
+    def find_boundary(self, illust_ids: Sequence[int]) -> int | None:
+        # index of the newest illust of the last sync in a page, if the following
+        # illusts are also in the same order (not re-bookmarked since)
+        if len(self.illust_ids) == 0:
+            return None
+
+        for index, illust_id in enumerate(illust_ids):
+            if illust_id != self.illust_ids[0]:
+                continue
+
+            following_ids = list(illust_ids[index + 1 : index + len(self.illust_ids)])
+            if following_ids == self.illust_ids[1 : 1 + len(following_ids)]:
+                return index
+
+        return None
+
+    def covers_cursor(self, max_bookmark_id: int) -> bool:
+        # pages after the cursor hold only bookmarks older than the last sync
+        return self.max_bookmark_id is not None and (
+            max_bookmark_id <= self.max_bookmark_id
+        )
+
+
+def make_bookmark_watermark(
+    pages: Sequence[tuple[Sequence[int], int | None]],
+    incomplete_illust_ids: Collection[int],
+) -> BookmarkWatermark | None:
+    # pages: illust ids (newest first) and the cursor to the next page of each page.
+    # the watermark starts after the oldest illust committed with missing pages,
+    # so that the next run reaches it again. None if no synced illust follows it
+    following_illusts = [
+        (illust_id, next_max_bookmark_id)
+        for illust_ids, next_max_bookmark_id in pages
+        for illust_id in illust_ids
+    ]
+    for index, (illust_id, _) in reversed(list(enumerate(following_illusts))):
+        if illust_id in incomplete_illust_ids:
+            following_illusts = following_illusts[index + 1 :]
+            break
+
+    if len(following_illusts) == 0:
+        return None
+
+    return BookmarkWatermark(
+        illust_ids=[
+            illust_id for illust_id, _ in following_illusts[:BOOKMARK_WATERMARK_SIZE]
+        ],
+        # the pages after the page of the newest illust hold older bookmarks
+        max_bookmark_id=following_illusts[0][1],
+        updated_at=datetime.now(tz=UTC),
+    )
+
+
+WatermarkT = TypeVar("WatermarkT", CrawlWatermark, BookmarkWatermark)
+
+
+# high-water mark of a crawl job in the order of the results,
+# kept across runs unlike the checkpoint
+class CrawlWatermarkDao:
+    def __init__(self, storage: Storage, job_key: str):
+        self.storage = storage
+        self.job_key = job_key
+
+    @property
+    def watermark_key(self) -> str:
+        return f"{WATERMARK_PREFIX}{self.job_key}.json"
+
+    async def get_watermark(
+        self, watermark_type: type[WatermarkT]
+    ) -> WatermarkT | None:
+        try:
+            watermark_bytes = await self.storage.read_bytes(key=self.watermark_key)
+        except StorageDownloadNotFoundError:
+            return None
+
+        try:
+            return watermark_type.model_validate_json(watermark_bytes)
+        except Exception as error:
+            logger.error(f"Failed to load watermark: {self.watermark_key}")
+            logger.exception(error)
+
+            return None
+
+    async def save_watermark(
+        self, watermark: CrawlWatermark | BookmarkWatermark
+    ) -> None:
+        await self.storage.upload_bytes(
+            dest_key=self.watermark_key,
+            data=to_json(watermark),
+        )
@@ -1,6 +1,14 @@
+import asyncio
+import hashlib
+from collections.abc import AsyncIterable
 from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Literal
 
-from ..storage.base import Storage
+from pydantic import BaseModel, ValidationError
+from pydantic_core import to_json
+
+from ..storage.base import Storage, StorageObject
 
 IMAGE_EXTS = [
     ".jpg",
@@ -13,9 +21,80 @@ IMAGE_EXTS = [
 ]
 
 
+# content-addressed binaries shared by illust keys with the same content
+BLOB_PREFIX = "_blobs/sha256/"
+
+# reference objects are tiny, larger objects are not read to check for a reference
+BLOB_REF_MAX_SIZE = 1024
+
+# a listing of a user prefix is given up beyond a page of S3 listing,
+# users with more objects are listed per illust
+USER_LISTING_MAX_OBJECTS = 1000
+
+
+def is_illust_binary_key(key: str) -> bool:
+    return Path(key).suffix.lower() in IMAGE_EXTS
+
+
+def get_illust_binary_key(illust_id: int, user_id: int, filename: str) -> str:
+    return f"{user_id}/{illust_id}/{filename}"
+
+
+def get_blob_key(sha256: str, filename: str) -> str:
+    return f"{BLOB_PREFIX}{sha256[:2]}/{sha256}{Path(filename).suffix.lower()}"
+
+
+def hash_file(file: Path) -> str:
+    sha256 = hashlib.sha256()
+    with file.open("rb") as fp:
+        while chunk := fp.read(1024 * 1024):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
+
+
+# record of a stored page of an illust to check its completeness.
+# size and etag are of the object stored at the key
+# (a reference object if deduplicated without link support),
+# etag is None if the storage reported none or the page was recorded before it.
+# sha256 is known only if deduplicated, others are not hashed
+class IllustPageRecord(BaseModel):
+    key: str
+    size: int
+    etag: str | None = None
+    sha256: str | None = None
+
+
+# stored at an illust key in place of the binary
+# if the storage cannot link the key to the blob
+class IllustBinaryBlobRef(BaseModel):
+    ref_type: Literal["xivbookmarkdl.blob"] = "xivbookmarkdl.blob"
+    blob_key: str
+    size: int
+    sha256: str
+
+
+def add_illust_object(
+    objects_by_illust: dict[tuple[int, int], list[StorageObject]],
+    user_id: int,
+    obj: StorageObject,
+) -> None:
+    # objects of illusts not asked for are ignored
+    parts = obj.key.split("/")
+    if len(parts) != 3 or not parts[1].isdigit():
+        return
+
+    illust_objects = objects_by_illust.get((int(parts[1]), user_id))
+    if illust_objects is None:
+        return
+
+    illust_objects.append(obj)
+
+
 class IllustBinaryDao:
-    def __init__(self, storage: Storage):
+    def __init__(self, storage: Storage, dedup: bool = False):
         self.storage = storage
+        self.dedup = dedup
 
     async def get_downloaded_illust_keys(
         self, illust_id: int, user_id: int
@@ -24,16 +103,169 @@ class IllustBinaryDao:
 
         keys: list[str] = []
         async for key in self.storage.iter_with_prefix(prefix=illust_prefix):
-            if Path(key).suffix.lower() not in IMAGE_EXTS:
+            if not is_illust_binary_key(key):
                 continue
 
             keys.append(key)
 
         return keys
 
+    async def list_illust_objects_many(
+        self,
+        illust_ids: list[tuple[int, int]],
+        user_listing_max_objects: int = USER_LISTING_MAX_OBJECTS,
+    ) -> dict[tuple[int, int], list[StorageObject]]:
+        # list objects of many illusts with one listing per user if possible
+        # illust_ids: list of (illust_id, user_id)
+        illust_ids_by_user: dict[int, set[int]] = {}
+        for illust_id, user_id in illust_ids:
+            illust_ids_by_user.setdefault(user_id, set()).add(illust_id)
+
+        objects_by_illust: dict[tuple[int, int], list[StorageObject]] = {
+            (illust_id, user_id): [] for illust_id, user_id in illust_ids
+        }
+        for user_id, user_illust_ids in illust_ids_by_user.items():
+            if len(user_illust_ids) > 1:
+                user_objects = await self._list_user_objects(
+                    user_id=user_id, max_objects=user_listing_max_objects
+                )
+                if user_objects is not None:
+                    for obj in user_objects:
+                        add_illust_object(objects_by_illust, user_id=user_id, obj=obj)
+                    continue
+
+            for illust_id in sorted(user_illust_ids):
+                async for obj in self.storage.list_tree(
+                    prefix=f"{user_id}/{illust_id}/"
+                ):
+                    add_illust_object(objects_by_illust, user_id=user_id, obj=obj)
+
+        return objects_by_illust
+
+    async def _list_user_objects(
+        self, user_id: int, max_objects: int
+    ) -> list[StorageObject] | None:
+        # None if the user has more objects than max_objects
+        objects: list[StorageObject] = []
+        async for obj in self.storage.list_tree(prefix=f"{user_id}/"):
+            if len(objects) >= max_objects:
+                return None
+
+            objects.append(obj)
+
+        return objects
+
     async def store_illust_binary(
         self, illust_id: int, user_id: int, file: Path
-    ) -> None:
-        illust_key = f"{user_id}/{illust_id}/{file.name}"
+    ) -> IllustPageRecord:
+        illust_key = get_illust_binary_key(
+            illust_id=illust_id, user_id=user_id, filename=file.name
+        )
+
+        if self.dedup:
+            return await self._store_deduplicated(file=file, dest_key=illust_key)
+
+        obj = await self.storage.upload(source_path=file, dest_key=illust_key)
+
+        return IllustPageRecord(key=illust_key, size=obj.size, etag=obj.etag)
+
+    async def store_illust_binary_stream(
+        self,
+        illust_id: int,
+        user_id: int,
+        filename: str,
+        chunks: AsyncIterable[bytes],
+    ) -> IllustPageRecord:
+        illust_key = get_illust_binary_key(
+            illust_id=illust_id, user_id=user_id, filename=filename
+        )
+
+        if self.dedup:
+            # the blob key depends on the content,
+            # so the stream is staged in a local file to hash it
+            with TemporaryDirectory() as _tmpdir:
+                file = Path(_tmpdir) / filename
+
+                with file.open("wb") as fp:
+                    async for chunk in chunks:
+                        await asyncio.to_thread(fp.write, chunk)
+
+                return await self._store_deduplicated(file=file, dest_key=illust_key)
+
+        obj = await self.storage.upload_stream(dest_key=illust_key, chunks=chunks)
+
+        return IllustPageRecord(key=illust_key, size=obj.size, etag=obj.etag)
+
+    async def _store_deduplicated(self, file: Path, dest_key: str) -> IllustPageRecord:
+        sha256 = await asyncio.to_thread(hash_file, file)
+        size = (await asyncio.to_thread(file.stat)).st_size
+
+        blob_key = get_blob_key(sha256=sha256, filename=dest_key)
+
+        if not await self.storage.exists_many(keys=[blob_key]):
+            await self.storage.upload(source_path=file, dest_key=blob_key)
+
+        if self.storage.link_shares_data:
+            obj = await self.storage.link(source_key=blob_key, dest_key=dest_key)
+
+            return IllustPageRecord(
+                key=dest_key, size=obj.size, etag=obj.etag, sha256=sha256
+            )
+
+        ref_bytes = to_json(
+            IllustBinaryBlobRef(blob_key=blob_key, size=size, sha256=sha256)
+        )
+
+        obj = await self.storage.upload_bytes(dest_key=dest_key, data=ref_bytes)
+
+        return IllustPageRecord(
+            key=dest_key, size=obj.size, etag=obj.etag, sha256=sha256
+        )
+
+    async def get_blob_ref(self, obj: StorageObject) -> IllustBinaryBlobRef | None:
+        if obj.size > BLOB_REF_MAX_SIZE:
+            return None
+
+        try:
+            return IllustBinaryBlobRef.model_validate_json(
+                await self.storage.read_bytes(key=obj.key)
+            )
+        except ValidationError:
+            return None
+
+
+def get_valid_illust_pages(
+    image_keys: list[str],
+    objects_by_key: dict[str, StorageObject],
+    recorded_pages: list[IllustPageRecord] | None,
+) -> list[IllustPageRecord]:
+    # pages stored completely, compared with the records in illust.json if any
+    recorded_pages_by_key = {page.key: page for page in recorded_pages or []}
+
+    valid_pages: list[IllustPageRecord] = []
+    for image_key in image_keys:
+        obj = objects_by_key.get(image_key)
+        if obj is None or obj.size == 0:
+            continue
+
+        recorded_page = recorded_pages_by_key.get(image_key)
+        if recorded_page is not None:
+            # cut off or replaced after it was recorded,
+            # etags tell replacements of the same size if both are known
+            if recorded_page.size != obj.size:
+                continue
+            if (
+                recorded_page.etag is not None
+                and obj.etag is not None
+                and recorded_page.etag != obj.etag
+            ):
+                continue
+
+            valid_pages.append(recorded_page)
+        elif recorded_pages is None:
+            # illust.json written before page records, trust the stored object
+            valid_pages.append(
+                IllustPageRecord(key=image_key, size=obj.size, etag=obj.etag)
+            )
 
-        await self.storage.upload(source_path=file, dest_key=illust_key)
+    return valid_pages
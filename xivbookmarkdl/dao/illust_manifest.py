@@ -0,0 +1,156 @@
+import sqlite3
+from datetime import UTC, datetime
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from ..profiling import profiled
+from .illust_binary import IllustPageRecord
+
+
+class IllustManifest(BaseModel):
+    illust_id: int
+    user_id: int
+    page_count: int
+    pages: list[IllustPageRecord]
+    found_at: datetime | None
+
+
+# local SQLite index of committed illusts
+# to check existence of illusts without storage round trips
+class IllustManifestDao:
+    def __init__(self, manifest_path: Path):
+        self.manifest_path = manifest_path
+
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.connection = sqlite3.connect(manifest_path)
+        self._create_tables()
+
+    def _create_tables(self) -> None:
+        with self.connection:
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS illusts (
+                    user_id INTEGER NOT NULL,
+                    illust_id INTEGER NOT NULL,
+                    page_count INTEGER NOT NULL,
+                    found_at TEXT,
+                    PRIMARY KEY (user_id, illust_id)
+                )
+                """
+            )
+            self.connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS illust_keys (
+                    user_id INTEGER NOT NULL,
+                    illust_id INTEGER NOT NULL,
+                    key TEXT NOT NULL,
+                    size INTEGER,
+                    etag TEXT,
+                    sha256 TEXT,
+                    PRIMARY KEY (user_id, illust_id, key)
+                )
+                """
+            )
+
+            # add page record columns to manifests created by older versions
+            columns = {
+                row[1]
+                for row in self.connection.execute("PRAGMA table_info(illust_keys)")
+            }
+            if "size" not in columns:
+                self.connection.execute(
+                    "ALTER TABLE illust_keys ADD COLUMN size INTEGER"
+                )
+            if "sha256" not in columns:
+                self.connection.execute(
+                    "ALTER TABLE illust_keys ADD COLUMN sha256 TEXT"
+                )
+            if "etag" not in columns:
+                self.connection.execute("ALTER TABLE illust_keys ADD COLUMN etag TEXT")
+
+    def close(self) -> None:
+        self.connection.close()
+
+    async def get_illust_manifest(
+        self,
+        illust_id: int,
+        user_id: int,
+    ) -> IllustManifest | None:
+        row = self.connection.execute(
+            "SELECT page_count, found_at FROM illusts "
+            "WHERE user_id = ? AND illust_id = ?",
+            (user_id, illust_id),
+        ).fetchone()
+        if row is None:
+            return None
+
+        page_count, found_at_string = row
+
+        # keys indexed by older versions have no size and are not treated as records,
+        # so that the illust is checked against storage and indexed again
+        pages = [
+            IllustPageRecord(key=key, size=size, etag=etag, sha256=sha256)
+            for (key, size, etag, sha256) in self.connection.execute(
+                "SELECT key, size, etag, sha256 FROM illust_keys "
+                "WHERE user_id = ? AND illust_id = ? AND size IS NOT NULL "
+                "ORDER BY key",
+                (user_id, illust_id),
+            )
+        ]
+
+        return IllustManifest(
+            illust_id=illust_id,
+            user_id=user_id,
+            page_count=page_count,
+            pages=pages,
+            found_at=(
+                datetime.fromisoformat(found_at_string) if found_at_string else None
+            ),
+        )
+
+    @profiled("manifest_upsert")
+    async def upsert_illust_manifest(self, manifest: IllustManifest) -> None:
+        found_at_string = (
+            manifest.found_at.astimezone(UTC).isoformat()
+            if manifest.found_at is not None
+            else None
+        )
+
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO illusts "
+                "(user_id, illust_id, page_count, found_at) VALUES (?, ?, ?, ?)",
+                (
+                    manifest.user_id,
+                    manifest.illust_id,
+                    manifest.page_count,
+                    found_at_string,
+                ),
+            )
+            self.connection.execute(
+                "DELETE FROM illust_keys WHERE user_id = ? AND illust_id = ?",
+                (manifest.user_id, manifest.illust_id),
+            )
+            self.connection.executemany(
+                "INSERT INTO illust_keys "
+                "(user_id, illust_id, key, size, etag, sha256) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        manifest.user_id,
+                        manifest.illust_id,
+                        page.key,
+                        page.size,
+                        page.etag,
+                        page.sha256,
+                    )
+                    for page in manifest.pages
+                ],
+            )
+
+    async def clear(self) -> None:
+        with self.connection:
+            self.connection.execute("DELETE FROM illusts")
+            self.connection.execute("DELETE FROM illust_keys")
@@ -1,12 +1,35 @@
-from datetime import UTC, datetime
+import asyncio
+from collections import OrderedDict
+from collections.abc import Iterable
+from datetime import UTC, datetime, timedelta
 from logging import getLogger
-from pathlib import Path
-from tempfile import TemporaryDirectory
 from typing import Any
 
 from pydantic import BaseModel
+from pydantic_core import to_json
 
+from ..profiling import profiled
 from ..storage.base import Storage, StorageDownloadNotFoundError
+from .illust_binary import IllustPageRecord
+from .illust_meta_pack import (
+    META_PACK_DELTA_PREFIX,
+    META_PACK_INDEX_KEY,
+    META_PACK_SEGMENT_PREFIX,
+    IllustMetaPackDelta,
+    IllustMetaPackIndex,
+    MetaCompression,
+    check_meta_compression,
+    decode_meta_pack_segment,
+    encode_meta_pack_segment,
+    get_meta_pack_delta_key,
+    get_meta_pack_segment_created_at,
+    get_meta_pack_segment_key,
+    make_meta_pack_index,
+    merge_meta_pack_index,
+    new_meta_pack_segment_name,
+    parse_meta_pack_delta_key,
+    parse_meta_pack_segment_key,
+)
 
 logger = getLogger(__name__)
 
@@ -17,55 +40,175 @@ class IllustMetaWithId(BaseModel):
     illust: dict[str, Any]
     found_at: datetime | None
     updated_at: datetime | None
+    # None for illust.json written before page records were introduced
+    pages: list[IllustPageRecord] | None = None
 
 
 class IllustMeta(BaseModel):
     illust: dict[str, Any]
     found_at: datetime | None = None
     updated_at: datetime | None = None
+    pages: list[IllustPageRecord] | None = None
 
 
+def get_illust_meta_key(illust_id: int, user_id: int) -> str:
+    return f"{user_id}/{illust_id}/illust.json"
+
+
+# with packed, illust metadata are buffered and written in a segment at each flush
+# (see illust_meta_pack) instead of an illust.json per illust.
+# loose illust.json written before are still read.
 class IllustMetaDao:
-    def __init__(self, storage: Storage):
+    def __init__(
+        self,
+        storage: Storage,
+        cache_size: int = 4096,
+        packed: bool = False,
+        compression: MetaCompression = "none",
+        segment_size: int = 1000,
+    ):
+        if packed:
+            check_meta_compression(compression)
+
+        if segment_size < 1:
+            raise ValueError("segment_size must be greater than or equal to 1")
+
         self.storage = storage
+        self.cache_size = cache_size
+        self.packed = packed
+        self.compression: MetaCompression = compression
+        self.segment_size = segment_size
+
+        # in-run LRU cache of illust.json, including absence (None)
+        self._cache: OrderedDict[tuple[int, int], IllustMetaWithId | None] = (
+            OrderedDict()
+        )
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        # packed records not written yet, and being written
+        self._pending: dict[tuple[int, int], IllustMetaWithId] = {}
+        self._flushing: dict[tuple[int, int], IllustMetaWithId] = {}
+        self._flush_lock = asyncio.Lock()
+        self._pack_index_lock = asyncio.Lock()
+        self._pack_index: IllustMetaPackIndex | None = None
+
+        # sequence number of the last record upserted, and the one up to which
+        # records are written, for callers to tell when their records are stored
+        self.upserted_seq = 0
+        self.flushed_seq = 0
+
+    def _set_cached_illust_meta(
+        self,
+        illust_id: int,
+        user_id: int,
+        illust_meta: IllustMetaWithId | None,
+    ) -> None:
+        if self.cache_size <= 0:
+            return
+
+        cache_key = (user_id, illust_id)
+
+        self._cache[cache_key] = illust_meta
+        self._cache.move_to_end(cache_key)
+
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def set_illust_meta_absent(self, illust_id: int, user_id: int) -> None:
+        # let callers tell the absence of illust.json known from a listing
+        self._set_cached_illust_meta(
+            illust_id=illust_id, user_id=user_id, illust_meta=None
+        )
 
     async def get_illust_meta(
         self,
         illust_id: int,
         user_id: int,
+        check_loose: bool = True,
     ) -> IllustMetaWithId | None:
-        meta_key = f"{user_id}/{illust_id}/illust.json"
+        # check_loose: False if illust.json is known to be absent from a listing
+        cache_key = (user_id, illust_id)
 
-        try:
-            async with self.storage.download(key=meta_key) as meta_file:
-                try:
-                    illust_meta = IllustMeta.model_validate_json(
-                        meta_file.read_text(encoding="utf-8")
-                    )
-                except Exception as inner_error:
-                    logger.error(f"Failed to load illust meta: {meta_key}")
-                    logger.exception(inner_error)
+        pending_illust_meta = self._pending.get(cache_key) or self._flushing.get(
+            cache_key
+        )
+        if pending_illust_meta is not None:
+            return pending_illust_meta
+
+        if cache_key in self._cache:
+            self.cache_hits += 1
+            self._cache.move_to_end(cache_key)
+            return self._cache[cache_key]
+
+        self.cache_misses += 1
+
+        illust_meta = await self._load_illust_meta(
+            illust_id=illust_id, user_id=user_id, check_loose=check_loose
+        )
+        self._set_cached_illust_meta(
+            illust_id=illust_id, user_id=user_id, illust_meta=illust_meta
+        )
+
+        return illust_meta
+
+    @profiled("meta_read")
+    async def _load_illust_meta(
+        self,
+        illust_id: int,
+        user_id: int,
+        check_loose: bool = True,
+    ) -> IllustMetaWithId | None:
+        if self.packed:
+            illust_meta = await self._load_packed_illust_meta(
+                illust_id=illust_id, user_id=user_id
+            )
+            if illust_meta is not None or not check_loose:
+                return illust_meta
+
+        return await self._load_loose_illust_meta(illust_id=illust_id, user_id=user_id)
+
+    async def _load_loose_illust_meta(
+        self,
+        illust_id: int,
+        user_id: int,
+    ) -> IllustMetaWithId | None:
+        meta_key = get_illust_meta_key(illust_id=illust_id, user_id=user_id)
 
-                    return None
+        try:
+            meta_bytes = await self.storage.read_bytes(key=meta_key)
         except StorageDownloadNotFoundError:
             return None
 
-        return IllustMetaWithId(
+        # parse the bytes directly, without decoding them to text first
+        try:
+            illust_meta = IllustMeta.model_validate_json(meta_bytes)
+        except Exception as error:
+            logger.error(f"Failed to load illust meta: {meta_key}")
+            logger.exception(error)
+
+            return None
+
+        # fields are already validated
+        return IllustMetaWithId.model_construct(
             illust_id=illust_id,
             user_id=user_id,
             illust=illust_meta.illust,
             found_at=illust_meta.found_at,
             updated_at=illust_meta.updated_at,
+            pages=illust_meta.pages,
         )
 
+    @profiled("meta_upsert")
     async def upsert_illust_meta(
         self,
         illust_id: int,
         user_id: int,
         illust: dict[str, Any],
         found_at: datetime,
-    ) -> None:
-        meta_key = f"{user_id}/{illust_id}/illust.json"
+        pages: list[IllustPageRecord] | None = None,
+    ) -> IllustMetaWithId:
+        meta_key = get_illust_meta_key(illust_id=illust_id, user_id=user_id)
 
         found_at_utc = found_at.astimezone(UTC)
 
@@ -73,23 +216,412 @@ class IllustMetaDao:
         if old_meta is not None and old_meta.found_at is not None:
             found_at_utc = old_meta.found_at.astimezone(UTC)
 
-        with TemporaryDirectory() as _tmpdir:
-            tmpdir = Path(_tmpdir)
+        new_illust_meta = IllustMetaWithId(
+            illust_id=illust_id,
+            user_id=user_id,
+            illust=illust,
+            found_at=found_at_utc,
+            updated_at=datetime.now(tz=UTC),
+            pages=pages,
+        )
+
+        if self.packed:
+            self._pending[(user_id, illust_id)] = new_illust_meta
+            self.upserted_seq += 1
+            self._set_cached_illust_meta(
+                illust_id=illust_id, user_id=user_id, illust_meta=new_illust_meta
+            )
+
+            if len(self._pending) >= self.segment_size:
+                await self.flush()
+
+            return new_illust_meta
+
+        # serialized in the format of IllustMeta straight into bytes in memory
+        await self.storage.upload_bytes(
+            dest_key=meta_key,
+            data=new_illust_meta.model_dump_json(
+                exclude={"illust_id", "user_id"}
+            ).encode("utf-8"),
+        )
+
+        # write-through
+        self._set_cached_illust_meta(
+            illust_id=illust_id, user_id=user_id, illust_meta=new_illust_meta
+        )
+
+        self.upserted_seq += 1
+        self.flushed_seq = self.upserted_seq
 
-            meta_file = tmpdir / "illust.json"
+        return new_illust_meta
 
-            illust_meta = IllustMeta(
-                illust=illust,
-                found_at=found_at_utc,
-                updated_at=datetime.now(tz=UTC),
+    async def _read_base_pack_index(self) -> IllustMetaPackIndex:
+        try:
+            return IllustMetaPackIndex.model_validate_json(
+                await self.storage.read_bytes(key=META_PACK_INDEX_KEY)
             )
+        except StorageDownloadNotFoundError:
+            return IllustMetaPackIndex()
+
+    async def _load_pack_delta(self, segment_name: str) -> IllustMetaPackDelta | None:
+        delta_key = get_meta_pack_delta_key(segment_name=segment_name)
+
+        # not found is raised, the delta has been folded and deleted by a compaction
+        delta_bytes = await self.storage.read_bytes(key=delta_key)
 
-            with meta_file.open(mode="w", encoding="utf-8") as fp:
-                fp.write(
-                    illust_meta.model_dump_json(),
+        try:
+            return IllustMetaPackDelta.model_validate_json(delta_bytes)
+        except Exception as error:
+            logger.error(f"Failed to load illust meta delta: {delta_key}")
+            logger.exception(error)
+
+            return None
+
+    async def _read_pack_index(self) -> IllustMetaPackIndex:
+        # the base index merged with the deltas not folded in it.
+        # deltas are listed before the base index is read, so that deltas folded
+        # and deleted by a compaction in between are folded in the index read
+        for _ in range(3):
+            delta_segment_names = [
+                segment_name
+                async for key in self.storage.iter_with_prefix(
+                    prefix=META_PACK_DELTA_PREFIX
                 )
+                if (segment_name := parse_meta_pack_delta_key(key)) is not None
+            ]
+
+            pack_index = await self._read_base_pack_index()
 
-            await self.storage.upload(
-                source_path=meta_file,
-                dest_key=meta_key,
+            folded_segment_names = set(pack_index.deltas)
+            try:
+                deltas = await asyncio.gather(
+                    *(
+                        self._load_pack_delta(segment_name=segment_name)
+                        for segment_name in delta_segment_names
+                        if segment_name not in folded_segment_names
+                    )
+                )
+            except StorageDownloadNotFoundError:
+                # compacted after the base index was read
+                continue
+
+            # the deltas of the index are those in the storage,
+            # which a compaction folds and deletes
+            listed_segment_names = set(delta_segment_names)
+            pack_index.deltas = [
+                segment_name
+                for segment_name in pack_index.deltas
+                if segment_name in listed_segment_names
+            ]
+
+            return merge_meta_pack_index(
+                pack_index=pack_index,
+                deltas=[delta for delta in deltas if delta is not None],
             )
+
+        raise RuntimeError("Illust meta index kept changing while being read")
+
+    async def _get_pack_index(self) -> IllustMetaPackIndex:
+        # kept for the run with the deltas of this writer,
+        # deltas of other writers are read when the index is reloaded
+        async with self._pack_index_lock:
+            if self._pack_index is None:
+                self._pack_index = await self._read_pack_index()
+
+            return self._pack_index
+
+    async def _reload_pack_index(
+        self, pack_index: IllustMetaPackIndex
+    ) -> IllustMetaPackIndex:
+        # reloaded once for all of the lookups finding a segment of pack_index
+        # deleted by a compaction
+        async with self._pack_index_lock:
+            if self._pack_index is pack_index or self._pack_index is None:
+                self._pack_index = await self._read_pack_index()
+
+            return self._pack_index
+
+    async def _load_pack_segment(self, segment_name: str) -> list[IllustMetaWithId]:
+        segment_key = get_meta_pack_segment_key(segment_name=segment_name)
+
+        # not found is raised, the segment has been deleted by a compaction
+        lines = decode_meta_pack_segment(
+            segment_name=segment_name,
+            data=await self.storage.read_bytes(key=segment_key),
+        )
+
+        records: list[IllustMetaWithId] = []
+        for line_index, line in enumerate(lines):
+            try:
+                records.append(IllustMetaWithId.model_validate_json(line))
+            except Exception as error:
+                logger.error(
+                    f"Failed to load illust meta: {segment_key} (line: {line_index})"
+                )
+                logger.exception(error)
+
+        return records
+
+    async def _load_packed_illust_meta(
+        self,
+        illust_id: int,
+        user_id: int,
+    ) -> IllustMetaWithId | None:
+        pack_index = await self._get_pack_index()
+
+        segment_name = pack_index.get_segment_name(illust_id)
+        if segment_name is None:
+            return None
+
+        try:
+            records = await self._load_pack_segment(segment_name=segment_name)
+        except StorageDownloadNotFoundError:
+            # compacted into other segments since the index was read
+            pack_index = await self._reload_pack_index(pack_index=pack_index)
+
+            segment_name = pack_index.get_segment_name(illust_id)
+            if segment_name is None:
+                return None
+
+            try:
+                records = await self._load_pack_segment(segment_name=segment_name)
+            except StorageDownloadNotFoundError:
+                logger.error(
+                    "Illust meta segment not found: "
+                    f"{get_meta_pack_segment_key(segment_name=segment_name)}"
+                )
+                return None
+
+        illust_meta: IllustMetaWithId | None = None
+        for record in records:
+            # only the latest records, older ones are superseded by later segments
+            if pack_index.get_segment_name(record.illust_id) != segment_name:
+                continue
+
+            if record.illust_id == illust_id and record.user_id == user_id:
+                illust_meta = record
+            else:
+                # illusts stored together are likely to be looked up together
+                self._set_cached_illust_meta(
+                    illust_id=record.illust_id,
+                    user_id=record.user_id,
+                    illust_meta=record,
+                )
+
+        return illust_meta
+
+    async def _upload_pack_segment(self, records: list[IllustMetaWithId]) -> str:
+        segment_name = new_meta_pack_segment_name(compression=self.compression)
+        await self.storage.upload_bytes(
+            dest_key=get_meta_pack_segment_key(segment_name=segment_name),
+            data=encode_meta_pack_segment(
+                lines=[to_json(record) for record in records],
+                compression=self.compression,
+            ),
+        )
+
+        return segment_name
+
+    async def _upload_pack_delta(self, delta: IllustMetaPackDelta) -> None:
+        await self.storage.upload_bytes(
+            dest_key=get_meta_pack_delta_key(segment_name=delta.segment),
+            data=to_json(delta),
+        )
+
+    async def flush(self) -> None:
+        # write the buffered records of all users in a segment
+        if not self.packed:
+            return
+
+        async with self._flush_lock:
+            if len(self._pending) == 0:
+                self.flushed_seq = self.upserted_seq
+                return
+
+            flushing_seq = self.upserted_seq
+            self._flushing = self._pending
+            self._pending = {}
+
+            try:
+                records = list(self._flushing.values())
+
+                # the segment is written before the delta refers to it,
+                # so an interrupted flush leaves only an unreferenced segment
+                segment_name = await self._upload_pack_segment(records=records)
+
+                delta = IllustMetaPackDelta(
+                    segment=segment_name,
+                    illust_ids=[record.illust_id for record in records],
+                    created_at=datetime.now(tz=UTC),
+                )
+                await self._upload_pack_delta(delta=delta)
+
+                async with self._pack_index_lock:
+                    if self._pack_index is not None:
+                        self._pack_index.apply_delta(delta)
+
+                self._flushing = {}
+                self.flushed_seq = flushing_seq
+            finally:
+                # records failed to be written are retried in the next flush,
+                # records upserted while flushing are newer
+                self._pending = {**self._flushing, **self._pending}
+                self._flushing = {}
+
+    async def compact(
+        self,
+        loose_illust_ids: Iterable[tuple[int, int]],
+        delete_loose: bool = True,
+        orphan_seconds: float = 3600.0,
+    ) -> int:
+        # fold loose illust.json, the segments and the deltas into segments of
+        # segment_size illusts, written as they are read not to hold all of the
+        # records in memory. the caller holds META_PACK_LEASE_KEY: writers keep
+        # flushing while compacting, and their deltas written after the snapshot
+        # are left to supersede the compacted segments.
+        # loose_illust_ids: (illust_id, user_id) of loose illust.json,
+        # orphan_seconds: unreferenced segments older than this are deleted,
+        # newer ones may be waiting for the delta of a running flush.
+        # returns the number of illusts in the segments
+        if not self.packed:
+            raise ValueError("compact is available only for packed illust meta")
+
+        await self.flush()
+
+        snapshot_at = datetime.now(tz=UTC)
+        snapshot_pack_index = await self._read_pack_index()
+        old_segment_names = snapshot_pack_index.get_segment_names()
+
+        new_segment_names: dict[int, str] = {}
+        records: list[IllustMetaWithId] = []
+
+        async def write_records() -> None:
+            if len(records) == 0:
+                return
+
+            segment_name = await self._upload_pack_segment(records=records)
+            for record in records:
+                new_segment_names[record.illust_id] = segment_name
+
+            records.clear()
+
+        packed_updated_ats: dict[int, datetime | None] = {}
+        for segment_name in sorted(set(old_segment_names.values())):
+            for record in await self._load_pack_segment(segment_name=segment_name):
+                if old_segment_names.get(record.illust_id) != segment_name:
+                    continue
+
+                packed_updated_ats[record.illust_id] = record.updated_at
+                records.append(record)
+                if len(records) >= self.segment_size:
+                    await write_records()
+
+        folded_loose_records: list[IllustMetaWithId] = []
+        for illust_id, user_id in loose_illust_ids:
+            loose_record = await self._load_loose_illust_meta(
+                illust_id=illust_id, user_id=user_id
+            )
+            if loose_record is None:
+                continue
+
+            folded_loose_records.append(loose_record)
+
+            # keep the newer one of the loose and the packed record,
+            # a newer loose record supersedes the packed one in a later segment
+            if illust_id in packed_updated_ats:
+                packed_updated_at = packed_updated_ats[illust_id]
+                if (
+                    loose_record.updated_at is None
+                    or packed_updated_at is None
+                    or loose_record.updated_at <= packed_updated_at
+                ):
+                    continue
+
+            records.append(loose_record)
+            if len(records) >= self.segment_size:
+                await write_records()
+
+        await write_records()
+
+        if len(new_segment_names) == 0:
+            return 0
+
+        # the new segments are left unreferenced if the index has been rewritten
+        # by another compaction since the snapshot
+        base_pack_index = await self._read_base_pack_index()
+        if base_pack_index.updated_at != snapshot_pack_index.updated_at:
+            raise RuntimeError("Illust meta index has been compacted by another worker")
+
+        await self.storage.upload_bytes(
+            dest_key=META_PACK_INDEX_KEY,
+            data=to_json(
+                make_meta_pack_index(
+                    segment_names=new_segment_names,
+                    deltas=snapshot_pack_index.deltas,
+                )
+            ),
+        )
+
+        async with self._pack_index_lock:
+            self._pack_index = None
+
+        # delete only after the new index refers to the new segments
+        for segment_name in snapshot_pack_index.deltas:
+            await self.storage.delete(
+                key=get_meta_pack_delta_key(segment_name=segment_name)
+            )
+
+        await self._delete_old_pack_segments(
+            segment_names=set(snapshot_pack_index.segments),
+            orphan_created_before=snapshot_at - timedelta(seconds=orphan_seconds),
+            new_segment_names=set(new_segment_names.values()),
+        )
+
+        if delete_loose:
+            for folded_loose_record in folded_loose_records:
+                # keep illust.json rewritten since it was folded
+                loose_record = await self._load_loose_illust_meta(
+                    illust_id=folded_loose_record.illust_id,
+                    user_id=folded_loose_record.user_id,
+                )
+                if (
+                    loose_record is None
+                    or loose_record.updated_at != folded_loose_record.updated_at
+                ):
+                    continue
+
+                await self.storage.delete(
+                    key=get_illust_meta_key(
+                        illust_id=folded_loose_record.illust_id,
+                        user_id=folded_loose_record.user_id,
+                    )
+                )
+
+        return len(new_segment_names)
+
+    async def _delete_old_pack_segments(
+        self,
+        segment_names: set[str],
+        orphan_created_before: datetime,
+        new_segment_names: set[str],
+    ) -> None:
+        # segment_names: segments of the snapshot compacted into the new segments.
+        # segments referred by deltas written since the snapshot are kept
+        referred_segment_names = set(new_segment_names)
+        async for key in self.storage.iter_with_prefix(prefix=META_PACK_DELTA_PREFIX):
+            segment_name = parse_meta_pack_delta_key(key)
+            if segment_name is not None:
+                referred_segment_names.add(segment_name)
+
+        async for key in self.storage.iter_with_prefix(prefix=META_PACK_SEGMENT_PREFIX):
+            segment_name = parse_meta_pack_segment_key(key)
+            if segment_name is None or segment_name in referred_segment_names:
+                continue
+
+            if segment_name not in segment_names:
+                # left by an interrupted flush, or waiting for the delta
+                created_at = get_meta_pack_segment_created_at(segment_name)
+                if created_at is None or created_at >= orphan_created_before:
+                    continue
+
+            await self.storage.delete(key=key)
@@ -0,0 +1,193 @@
+import gzip
+import importlib
+from collections.abc import Iterable, Mapping
+from datetime import UTC, datetime
+from typing import Any, Literal
+from uuid import uuid4
+
+from pydantic import BaseModel
+
+# packed metadata: illust metadata of all users are appended in JSONL segments
+# written at each flush (illust ids are unique across users).
+# each flush also writes a small delta telling the illusts of its segment,
+# so writers never rewrite an object shared with other writers.
+# compaction folds the deltas into the base index, and readers merge the base
+# index with the deltas not folded yet, later segments superseding earlier ones
+#   {META_PACK_PREFIX}index.json
+#   {META_PACK_PREFIX}deltas/{segment_name}.json
+#   {META_PACK_PREFIX}segments/{segment_name}.jsonl[.gz|.zst]
+#   {META_PACK_PREFIX}lease.json (held while compacting)
+META_PACK_PREFIX = ".xivbookmarkdl/meta/"
+META_PACK_INDEX_KEY = f"{META_PACK_PREFIX}index.json"
+META_PACK_DELTA_PREFIX = f"{META_PACK_PREFIX}deltas/"
+META_PACK_SEGMENT_PREFIX = f"{META_PACK_PREFIX}segments/"
+META_PACK_LEASE_KEY = f"{META_PACK_PREFIX}lease.json"
+
+MetaCompression = Literal["none", "gzip", "zstd"]
+
+SEGMENT_EXTENSIONS: dict[MetaCompression, str] = {
+    "none": ".jsonl",
+    "gzip": ".jsonl.gz",
+    "zstd": ".jsonl.zst",
+}
+
+SEGMENT_TIME_FORMAT = "%Y%m%dT%H%M%S%f"
+
+
+class IllustMetaPackDelta(BaseModel):
+    segment: str
+    illust_ids: list[int]
+    created_at: datetime
+
+
+# segment names are stored once and illusts refer to them by position
+class IllustMetaPackIndex(BaseModel):
+    segments: list[str] = []
+    # illust_id -> position in segments
+    illusts: dict[int, int] = {}
+    # segments whose deltas are folded in the index
+    deltas: list[str] = []
+    updated_at: datetime | None = None
+
+    def get_segment_name(self, illust_id: int) -> str | None:
+        segment_index = self.illusts.get(illust_id)
+        if segment_index is None:
+            return None
+
+        return self.segments[segment_index]
+
+    def get_segment_names(self) -> dict[int, str]:
+        # illust_id -> segment name
+        return {
+            illust_id: self.segments[segment_index]
+            for illust_id, segment_index in self.illusts.items()
+        }
+
+    def apply_delta(self, delta: IllustMetaPackDelta) -> None:
+        if delta.segment in self.deltas:
+            return
+
+        self.deltas.append(delta.segment)
+
+        segment_index = len(self.segments)
+        self.segments.append(delta.segment)
+        for illust_id in delta.illust_ids:
+            self.illusts[illust_id] = segment_index
+
+
+def make_meta_pack_index(
+    segment_names: Mapping[int, str], deltas: Iterable[str] = ()
+) -> IllustMetaPackIndex:
+    # segment_names: illust_id -> segment name, segments no longer referred are dropped
+    segment_indexes: dict[str, int] = {}
+    for segment_name in sorted(set(segment_names.values())):
+        segment_indexes[segment_name] = len(segment_indexes)
+
+    return IllustMetaPackIndex(
+        segments=list(segment_indexes),
+        illusts={
+            illust_id: segment_indexes[segment_name]
+            for illust_id, segment_name in segment_names.items()
+        },
+        deltas=sorted(deltas),
+        updated_at=datetime.now(tz=UTC),
+    )
+
+
+def merge_meta_pack_index(
+    pack_index: IllustMetaPackIndex, deltas: Iterable[IllustMetaPackDelta]
+) -> IllustMetaPackIndex:
+    # deltas not folded in the index supersede it, in the order of the segments
+    merged_pack_index = pack_index.model_copy(deep=True)
+    for delta in sorted(deltas, key=lambda delta: delta.segment):
+        merged_pack_index.apply_delta(delta)
+
+    return merged_pack_index
+
+
+def get_meta_pack_segment_key(segment_name: str) -> str:
+    return f"{META_PACK_SEGMENT_PREFIX}{segment_name}"
+
+
+def parse_meta_pack_segment_key(key: str) -> str | None:
+    # returns the segment name of a segment key
+    if not key.startswith(META_PACK_SEGMENT_PREFIX):
+        return None
+
+    segment_name = key[len(META_PACK_SEGMENT_PREFIX) :]
+    if "/" in segment_name:
+        return None
+
+    return segment_name
+
+
+def get_meta_pack_delta_key(segment_name: str) -> str:
+    return f"{META_PACK_DELTA_PREFIX}{segment_name}.json"
+
+
+def parse_meta_pack_delta_key(key: str) -> str | None:
+    # returns the segment name of a delta key
+    if not key.startswith(META_PACK_DELTA_PREFIX) or not key.endswith(".json"):
+        return None
+
+    segment_name = key[len(META_PACK_DELTA_PREFIX) : -len(".json")]
+    if "/" in segment_name:
+        return None
+
+    return segment_name
+
+
+def new_meta_pack_segment_name(compression: MetaCompression) -> str:
+    # sortable by creation time
+    return (
+        f"{datetime.now(UTC).strftime(SEGMENT_TIME_FORMAT)}-{uuid4().hex[:8]}"
+        f"{SEGMENT_EXTENSIONS[compression]}"
+    )
+
+
+def get_meta_pack_segment_created_at(segment_name: str) -> datetime | None:
+    try:
+        return datetime.strptime(
+            segment_name.partition("-")[0], SEGMENT_TIME_FORMAT
+        ).replace(tzinfo=UTC)
+    except ValueError:
+        return None
+
+
+def get_zstandard() -> Any:
+    # zstandard is optional, gzip is always available
+    try:
+        return importlib.import_module("zstandard")
+    except ImportError as error:
+        raise RuntimeError(
+            "zstandard is required for zstd compressed metadata segments, "
+            "install it with `pip install zstandard`"
+        ) from error
+
+
+def check_meta_compression(compression: MetaCompression) -> None:
+    if compression == "zstd":
+        get_zstandard()
+
+
+def encode_meta_pack_segment(lines: list[bytes], compression: MetaCompression) -> bytes:
+    body = b"".join(line + b"\n" for line in lines)
+
+    if compression == "gzip":
+        return gzip.compress(body)
+    if compression == "zstd":
+        compressed: bytes = get_zstandard().ZstdCompressor().compress(body)
+        return compressed
+
+    return body
+
+
+def decode_meta_pack_segment(segment_name: str, data: bytes) -> list[bytes]:
+    # compression is told by the extension, so segments of any compression can be read
+    if segment_name.endswith(SEGMENT_EXTENSIONS["gzip"]):
+        data = gzip.decompress(data)
+    elif segment_name.endswith(SEGMENT_EXTENSIONS["zstd"]):
+        # the content size may be absent in frames written by streaming compressors
+        data = get_zstandard().ZstdDecompressor().decompressobj().decompress(data)
+
+    return [line for line in data.splitlines() if line]
@@ -0,0 +1,152 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Coroutine
+from datetime import UTC, datetime, timedelta
+from logging import getLogger
+from typing import Any
+from uuid import uuid4
+
+from pydantic import BaseModel
+from pydantic_core import to_json
+
+from ..storage.base import Storage, StorageDownloadNotFoundError
+
+logger = getLogger(__name__)
+
+
+class StorageLeaseLostError(Exception):
+    pass
+
+
+class StorageLease(BaseModel):
+    worker_id: str
+    # distinguishes acquisitions of the same worker
+    token: str
+    expires_at: datetime
+
+
+# leases shared by workers through the storage, held by one worker at a time.
+# storages have no conditional writes, so a lease is acquired by writing it
+# and reading it back after a settle time:
+# of workers racing for a lease, only the last writer keeps it
+class StorageLeaseDao:
+    def __init__(self, storage: Storage):
+        self.storage = storage
+
+    async def get_lease(self, lease_key: str) -> StorageLease | None:
+        try:
+            lease_bytes = await self.storage.read_bytes(key=lease_key)
+        except StorageDownloadNotFoundError:
+            return None
+
+        try:
+            return StorageLease.model_validate_json(lease_bytes)
+        except Exception as error:
+            # a broken lease is taken over
+            logger.error(f"Failed to load lease: {lease_key}")
+            logger.exception(error)
+
+            return None
+
+    async def _write_lease(
+        self, lease_key: str, worker_id: str, token: str, lease_seconds: float
+    ) -> StorageLease:
+        lease = StorageLease(
+            worker_id=worker_id,
+            token=token,
+            expires_at=datetime.now(tz=UTC) + timedelta(seconds=lease_seconds),
+        )
+
+        await self.storage.upload_bytes(dest_key=lease_key, data=to_json(lease))
+
+        return lease
+
+    async def acquire_lease(
+        self,
+        lease_key: str,
+        worker_id: str,
+        lease_seconds: float,
+        settle_seconds: float,
+    ) -> StorageLease | None:
+        current_lease = await self.get_lease(lease_key=lease_key)
+        if current_lease is not None and current_lease.expires_at > datetime.now(
+            tz=UTC
+        ):
+            return None
+
+        lease = await self._write_lease(
+            lease_key=lease_key,
+            worker_id=worker_id,
+            token=uuid4().hex,
+            lease_seconds=lease_seconds,
+        )
+
+        # a worker racing for the lease has written its lease by then
+        await asyncio.sleep(settle_seconds)
+
+        current_lease = await self.get_lease(lease_key=lease_key)
+        if current_lease is None or current_lease.token != lease.token:
+            return None
+
+        return lease
+
+    async def renew_lease(
+        self, lease_key: str, lease: StorageLease, lease_seconds: float
+    ) -> StorageLease | None:
+        # None if the lease has been taken over
+        current_lease = await self.get_lease(lease_key=lease_key)
+        if current_lease is None or current_lease.token != lease.token:
+            return None
+
+        return await self._write_lease(
+            lease_key=lease_key,
+            worker_id=lease.worker_id,
+            token=lease.token,
+            lease_seconds=lease_seconds,
+        )
+
+    async def release_lease(self, lease_key: str, lease: StorageLease) -> bool:
+        # False if the lease has been taken over, keeping the lease of the new owner
+        current_lease = await self.get_lease(lease_key=lease_key)
+        if current_lease is None or current_lease.token != lease.token:
+            return False
+
+        await self.storage.delete(key=lease_key)
+        return True
+
+
+async def run_with_lease(
+    lease: StorageLease,
+    lease_seconds: float,
+    renew_lease: Callable[[StorageLease], Awaitable[StorageLease | None]],
+    func: Callable[[], Coroutine[Any, Any, int]],
+) -> int:
+    # renew the lease while running func, and stop func when it is taken over
+    async def renew_lease_periodically() -> None:
+        nonlocal lease
+
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+
+            renewed_lease = await renew_lease(lease)
+            if renewed_lease is None:
+                raise StorageLeaseLostError(
+                    f"Lease of worker {lease.worker_id} is taken over"
+                )
+
+            lease = renewed_lease
+
+    func_task = asyncio.create_task(func())
+    renew_task = asyncio.create_task(renew_lease_periodically())
+    try:
+        await asyncio.wait([func_task, renew_task], return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in (func_task, renew_task):
+            task.cancel()
+        await asyncio.gather(func_task, renew_task, return_exceptions=True)
+
+    if func_task.cancelled():
+        renew_error = renew_task.exception()
+        assert renew_error is not None
+        raise renew_error
+
+    return func_task.result()
@@ -0,0 +1,297 @@
+import asyncio
+import posixpath
+import time
+from collections.abc import AsyncGenerator
+from contextlib import aclosing
+from logging import getLogger
+from typing import TYPE_CHECKING, Any
+from urllib.parse import urlparse
+
+from .dao.illust_binary import (
+    IllustBinaryDao,
+    IllustPageRecord,
+    get_illust_binary_key,
+)
+from .metrics import (
+    ERRORS,
+    IMAGE_DOWNLOAD_BYTES,
+    IMAGE_DOWNLOAD_SECONDS,
+    RETRIES,
+)
+from .profiling import PROFILER
+from .progress import emit_progress
+from .rate_limiter import RateLimiter, RetryLimitExceededError
+
+if TYPE_CHECKING:
+    # pixivpy3 pulls in requests, imported only when an API session is created
+    from pixivpy3 import AppPixivAPI
+
+logger = getLogger(__name__)
+
+PIXIV_REFERER = "https://app-api.pixiv.net/"
+
+# status codes of the image server when requests are too frequent
+RATE_LIMITED_STATUS_CODES = {429, 503}
+
+
+class IncompleteDownloadError(Exception):
+    pass
+
+
+def get_illust_image_urls(illust: Any) -> list[str]:
+    if illust.meta_single_page:
+        return [illust.meta_single_page.original_image_url]
+
+    return [page.image_urls.original for page in illust.meta_pages]
+
+
+def get_illust_image_filename(image_url: str) -> str:
+    return posixpath.basename(urlparse(image_url).path)
+
+
+def get_illust_image_keys(illust: Any) -> list[str]:
+    return [
+        get_illust_binary_key(
+            illust_id=int(illust.id),
+            user_id=int(illust.user.id),
+            filename=get_illust_image_filename(image_url),
+        )
+        for image_url in get_illust_image_urls(illust)
+    ]
+
+
+async def iter_illust_image_chunks(
+    response: Any,
+    chunk_size: int = 1024 * 1024,
+) -> AsyncGenerator[bytes, None]:
+    # the body is not decoded if Content-Encoding is set,
+    # so Content-Length is comparable only without it
+    content_length_string = response.headers.get("Content-Length")
+    expected_size = (
+        int(content_length_string)
+        if content_length_string and not response.headers.get("Content-Encoding")
+        else None
+    )
+
+    # imported here as requests is already loaded by the API session
+    from requests.exceptions import ChunkedEncodingError
+    from urllib3.exceptions import ProtocolError
+
+    # requests is blocking, so read each chunk of the response in a thread
+    chunk_iterator = response.iter_content(chunk_size=chunk_size)
+    size = 0
+    while True:
+        try:
+            chunk = await asyncio.to_thread(next, chunk_iterator, None)
+        except (ChunkedEncodingError, ProtocolError) as error:
+            # the connection was cut in the middle of the body
+            raise IncompleteDownloadError(
+                f"Incomplete download (size: {size}, error: {error!r})"
+            ) from error
+        if chunk is None:
+            break
+
+        size += len(chunk)
+        IMAGE_DOWNLOAD_BYTES.inc(len(chunk))
+        yield chunk
+
+    # raise before the end of the stream to abort the upload of a cut-off body
+    if expected_size is not None and size != expected_size:
+        raise IncompleteDownloadError(
+            f"Incomplete download (size: {size}, expected: {expected_size})"
+        )
+
+
+async def download_illust_image(
+    api: "AppPixivAPI",
+    illust: Any,
+    image_url: str,
+    illust_binary_dao: IllustBinaryDao,
+    rate_limiter: RateLimiter,
+) -> IllustPageRecord | None:
+    emit_progress(
+        "image_download",
+        image_url,
+        illust_id=int(illust.id),
+        url=image_url,
+    )
+
+    for retry_index in range(rate_limiter.max_retries + 1):
+        await rate_limiter.download.acquire()
+
+        started_at = time.perf_counter()
+
+        # stream the response body into storage without staging it on disk
+        with PROFILER.span("download"):
+            response = await asyncio.to_thread(
+                api.requests_call,
+                "GET",
+                image_url,
+                headers={"Referer": PIXIV_REFERER},
+                stream=True,
+            )
+
+        retry_reason = "rate_limited"
+        try:
+            if response.status_code in RATE_LIMITED_STATUS_CODES:
+                rate_limiter.download.on_rate_limited()
+                logger.warning(
+                    f"Rate limited (status: {response.status_code}, "
+                    f"retry: {retry_index}): {image_url}"
+                )
+            elif response.status_code != 200:
+                # the illust will be retried in the next run
+                # because the number of pages does not match
+                logger.warning(
+                    f"Failed to download image (status: {response.status_code}): "
+                    f"{image_url}"
+                )
+                ERRORS.inc(target="download", reason="status")
+                return None
+            else:
+                try:
+                    # the response body is streamed while storing
+                    async with aclosing(
+                        iter_illust_image_chunks(response=response)
+                    ) as chunks:
+                        with PROFILER.span("store"):
+                            page = await illust_binary_dao.store_illust_binary_stream(
+                                illust_id=int(illust.id),
+                                user_id=int(illust.user.id),
+                                filename=get_illust_image_filename(image_url),
+                                chunks=chunks,
+                            )
+                except IncompleteDownloadError as error:
+                    # the connection was cut, retry without slowing down
+                    logger.warning(f"{error} (retry: {retry_index}): {image_url}")
+                    retry_reason = "incomplete"
+                else:
+                    rate_limiter.download.on_success()
+                    IMAGE_DOWNLOAD_SECONDS.observe(time.perf_counter() - started_at)
+                    return page
+        finally:
+            response.close()
+
+        if retry_index < rate_limiter.max_retries:
+            RETRIES.inc(target="download", reason=retry_reason)
+            await rate_limiter.backoff(retry_index=retry_index)
+
+    ERRORS.inc(target="download", reason="retry_limit")
+    raise RetryLimitExceededError(f"Failed to download image: {image_url}")
+
+
+# pool of download workers to download images of illusts in the background
+# as soon as they are discovered.
+# with lifo, the latest submitted image is downloaded first,
+# which suits desc paging followed by asc commits.
+class IllustDownloadPipeline:
+    def __init__(
+        self,
+        api: "AppPixivAPI",
+        illust_binary_dao: IllustBinaryDao,
+        rate_limiter: RateLimiter,
+        download_concurrency: int,
+        lifo: bool = False,
+    ):
+        if download_concurrency < 1:
+            raise ValueError("download_concurrency must be greater than or equal to 1")
+
+        self.api = api
+        self.illust_binary_dao = illust_binary_dao
+        self.rate_limiter = rate_limiter
+
+        self._queue: asyncio.Queue[
+            tuple[Any, str, asyncio.Future[IllustPageRecord | None]]
+        ] = asyncio.LifoQueue() if lifo else asyncio.Queue()
+        self._illust_tasks: dict[
+            tuple[int, int], asyncio.Task[list[IllustPageRecord]]
+        ] = {}
+        self._workers = [
+            asyncio.create_task(self._work()) for _ in range(download_concurrency)
+        ]
+
+    async def _work(self) -> None:
+        while True:
+            illust, image_url, future = await self._queue.get()
+
+            try:
+                if future.cancelled():
+                    continue
+
+                try:
+                    page = await download_illust_image(
+                        api=self.api,
+                        illust=illust,
+                        image_url=image_url,
+                        illust_binary_dao=self.illust_binary_dao,
+                        rate_limiter=self.rate_limiter,
+                    )
+                except Exception as error:
+                    if not future.done():
+                        future.set_exception(error)
+                    continue
+
+                if not future.done():
+                    future.set_result(page)
+            finally:
+                self._queue.task_done()
+
+    async def _gather_illust_images(
+        self, image_futures: list[asyncio.Future[IllustPageRecord | None]]
+    ) -> list[IllustPageRecord]:
+        pages = await asyncio.gather(*image_futures)
+
+        return [page for page in pages if page is not None]
+
+    def submit(
+        self,
+        illust: Any,
+        stored_pages: list[IllustPageRecord] | None = None,
+    ) -> None:
+        # stored_pages: valid pages already in storage, which are not downloaded again
+        illust_key = (int(illust.user.id), int(illust.id))
+        if illust_key in self._illust_tasks:
+            return
+
+        loop = asyncio.get_running_loop()
+
+        stored_pages_by_key = {page.key: page for page in stored_pages or []}
+
+        image_futures: list[asyncio.Future[IllustPageRecord | None]] = []
+        for image_url, image_key in zip(
+            get_illust_image_urls(illust), get_illust_image_keys(illust), strict=True
+        ):
+            future: asyncio.Future[IllustPageRecord | None] = loop.create_future()
+
+            stored_page = stored_pages_by_key.get(image_key)
+            if stored_page is not None:
+                future.set_result(stored_page)
+            else:
+                self._queue.put_nowait((illust, image_url, future))
+
+            image_futures.append(future)
+
+        self._illust_tasks[illust_key] = asyncio.create_task(
+            self._gather_illust_images(image_futures=image_futures)
+        )
+
+    async def wait(self, illust: Any) -> list[IllustPageRecord]:
+        # returns records of the stored images of the illust
+        self.submit(illust)
+
+        illust_key = (int(illust.user.id), int(illust.id))
+        illust_task = self._illust_tasks.pop(illust_key)
+
+        return await illust_task
+
+    async def close(self) -> None:
+        for illust_task in self._illust_tasks.values():
+            illust_task.cancel()
+
+        for worker in self._workers:
+            worker.cancel()
+
+        await asyncio.gather(
+            *self._illust_tasks.values(), *self._workers, return_exceptions=True
+        )
+        self._illust_tasks.clear()
@@ -0,0 +1,408 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections.abc import Iterator, Sequence
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from logging import getLogger
+from pathlib import Path
+from types import TracebackType
+from typing import Self
+
+logger = getLogger(__name__)
+
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+
+    return repr(float(value))
+
+
+# metrics are updated from the event loop and from storage threads
+class Metric(ABC):
+    type_name = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+        self._lock = threading.Lock()
+
+    def _get_label_values(self, labels: dict[str, str]) -> tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"Labels of {self.name} must be {self.labelnames}: {tuple(labels)}"
+            )
+
+        return tuple(str(labels[labelname]) for labelname in self.labelnames)
+
+    def _format_labels(
+        self,
+        label_values: tuple[str, ...],
+        extra_labels: Sequence[tuple[str, str]] = (),
+    ) -> str:
+        labels = [*zip(self.labelnames, label_values, strict=True), *extra_labels]
+        if len(labels) == 0:
+            return ""
+
+        return (
+            "{"
+            + ",".join(
+                f'{labelname}="{escape_label_value(value)}"'
+                for labelname, value in labels
+            )
+            + "}"
+        )
+
+    # sample lines of the metric in the text exposition format
+    @abstractmethod
+    def collect(self) -> list[str]: ...
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type_name}",
+            *self.collect(),
+        ]
+
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name=name, help=help, labelnames=labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        if amount < 0:
+            raise ValueError("Counter can only be increased")
+
+        label_values = self._get_label_values(labels)
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def get(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._get_label_values(labels), 0.0)
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+
+        return [
+            f"{self.name}{self._format_labels(label_values)} {format_value(value)}"
+            for label_values, value in values
+        ]
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name=name, help=help, labelnames=labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        label_values = self._get_label_values(labels)
+        with self._lock:
+            self._values[label_values] = value
+
+    def set_to_current_time(self, **labels: str) -> None:
+        self.set(time.time(), **labels)
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+
+        return [
+            f"{self.name}{self._format_labels(label_values)} {format_value(value)}"
+            for label_values, value in values
+        ]
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name=name, help=help, labelnames=labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+        # non-cumulative counts per bucket, the last one is +Inf
+        self._bucket_counts: dict[tuple[str, ...], list[int]] = {}
+        self._sums: dict[tuple[str, ...], float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        label_values = self._get_label_values(labels)
+
+        bucket_index = len(self.buckets)
+        for index, upper_bound in enumerate(self.buckets):
+            if value <= upper_bound:
+                bucket_index = index
+                break
+
+        with self._lock:
+            bucket_counts = self._bucket_counts.setdefault(
+                label_values, [0] * (len(self.buckets) + 1)
+            )
+            bucket_counts[bucket_index] += 1
+            self._sums[label_values] = self._sums.get(label_values, 0.0) + value
+
+    # observe the elapsed seconds of the block, also when it raises
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def get_count(self, **labels: str) -> int:
+        with self._lock:
+            return sum(self._bucket_counts.get(self._get_label_values(labels), []))
+
+    def collect(self) -> list[str]:
+        with self._lock:
+            items = sorted(
+                (label_values, list(bucket_counts), self._sums[label_values])
+                for label_values, bucket_counts in self._bucket_counts.items()
+            )
+
+        lines: list[str] = []
+        for label_values, bucket_counts, value_sum in items:
+            cumulative_count = 0
+            for upper_bound, count in zip(
+                (*self.buckets, math.inf), bucket_counts, strict=True
+            ):
+                cumulative_count += count
+                labels = self._format_labels(
+                    label_values, extra_labels=[("le", format_value(upper_bound))]
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative_count}")
+
+            labels = self._format_labels(label_values)
+            lines.append(f"{self.name}_sum{labels} {format_value(value_sum)}")
+            lines.append(f"{self.name}_count{labels} {cumulative_count}")
+
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self._metrics: list[Metric] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name=name, help=help, labelnames=labelnames)
+        self._metrics.append(metric)
+
+        return metric
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        metric = Gauge(name=name, help=help, labelnames=labelnames)
+        self._metrics.append(metric)
+
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        metric = Histogram(name=name, help=help, labelnames=labelnames, buckets=buckets)
+        self._metrics.append(metric)
+
+        return metric
+
+    # Prometheus text exposition format
+    def render(self) -> str:
+        return "".join(metric.render() for metric in self._metrics)
+
+
+REGISTRY = MetricsRegistry()
+
+API_PAGE_SECONDS = REGISTRY.histogram(
+    "xivbookmarkdl_api_page_seconds",
+    "Latency of pixiv API page requests",
+)
+IMAGE_DOWNLOAD_SECONDS = REGISTRY.histogram(
+    "xivbookmarkdl_image_download_seconds",
+    "Latency of image downloads until stored",
+)
+IMAGE_DOWNLOAD_BYTES = REGISTRY.counter(
+    "xivbookmarkdl_image_download_bytes_total",
+    "Bytes of downloaded images",
+)
+STORAGE_OPERATION_SECONDS = REGISTRY.histogram(
+    "xivbookmarkdl_storage_operation_seconds",
+    "Latency of storage operations",
+    labelnames=["backend", "operation"],
+)
+STORAGE_ERRORS = REGISTRY.counter(
+    "xivbookmarkdl_storage_errors_total",
+    "Failed storage operations",
+    labelnames=["backend", "operation"],
+)
+SKIP_CHECKS = REGISTRY.counter(
+    "xivbookmarkdl_skip_checks_total",
+    "Illusts checked for existence, by where they were found (manifest, storage),"
+    " skipped by the watermark or new",
+    labelnames=["result"],
+)
+ILLUSTS_COMMITTED = REGISTRY.counter(
+    "xivbookmarkdl_illusts_committed_total",
+    "Illusts committed with all of their images",
+)
+RETRIES = REGISTRY.counter(
+    "xivbookmarkdl_retries_total",
+    "Retried requests",
+    labelnames=["target", "reason"],
+)
+ERRORS = REGISTRY.counter(
+    "xivbookmarkdl_errors_total",
+    "Requests and polls given up",
+    labelnames=["target", "reason"],
+)
+LAST_PROGRESS_TIMESTAMP = REGISTRY.gauge(
+    "xivbookmarkdl_last_progress_timestamp_seconds",
+    "Unix time of the last fetched page or committed illust, to detect stalls",
+)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    server: "MetricsServer"
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = self.server.registry.render().encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MetricsServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address: tuple[str, int], registry: MetricsRegistry):
+        super().__init__(server_address, MetricsHandler)
+        self.registry = registry
+
+
+# exposes metrics at an HTTP endpoint and/or writes them to a file periodically
+# (for the textfile collector of node_exporter)
+class MetricsExporter:
+    def __init__(
+        self,
+        registry: MetricsRegistry = REGISTRY,
+        port: int | None = None,
+        host: str = "0.0.0.0",
+        file_path: Path | None = None,
+        write_interval: float = 15.0,
+    ):
+        self.registry = registry
+        self.port = port
+        self.host = host
+        self.file_path = file_path
+        self.write_interval = write_interval
+
+        self._server: MetricsServer | None = None
+        self._server_thread: threading.Thread | None = None
+        self._write_task: asyncio.Task[None] | None = None
+
+    def write_file(self) -> None:
+        if self.file_path is None:
+            return
+
+        # replace atomically not to expose a partially written file
+        tmp_path = self.file_path.with_name(self.file_path.name + ".tmp")
+        tmp_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.write_text(self.registry.render(), encoding="utf-8")
+        os.replace(tmp_path, self.file_path)
+
+    async def _write_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.write_interval)
+
+            try:
+                await asyncio.to_thread(self.write_file)
+            except OSError as error:
+                logger.warning(f"Failed to write metrics: {error}")
+
+    async def __aenter__(self) -> Self:
+        if self.port is not None:
+            self._server = MetricsServer((self.host, self.port), registry=self.registry)
+            self._server_thread = threading.Thread(
+                target=self._server.serve_forever, daemon=True
+            )
+            self._server_thread.start()
+
+            logger.info(
+                f"Serving metrics at http://{self.host}:"
+                f"{self._server.server_address[1]}/metrics"
+            )
+
+        if self.file_path is not None:
+            self._write_task = asyncio.create_task(self._write_periodically())
+
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        if self._write_task is not None:
+            self._write_task.cancel()
+            await asyncio.gather(self._write_task, return_exceptions=True)
+            self._write_task = None
+
+        # keep the final values after the process exits
+        self.write_file()
+
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
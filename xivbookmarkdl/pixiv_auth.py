@@ -0,0 +1,70 @@
+import asyncio
+from logging import getLogger
+from types import TracebackType
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from pixivpy3 import AppPixivAPI
+
+logger = getLogger(__name__)
+
+
+# authenticate an API session and refresh its access token in the background
+# before it expires (about an hour), to keep long-running crawls authenticated
+class PixivAuthKeeper:
+    def __init__(
+        self,
+        api: "AppPixivAPI",
+        refresh_token: str,
+        refresh_margin: float = 300.0,
+        retry_interval: float = 60.0,
+    ):
+        self.api = api
+        self.refresh_token = refresh_token
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+
+        self._expires_in = 3600.0
+        self._refresh_task: asyncio.Task[None] | None = None
+
+    async def __aenter__(self) -> "PixivAuthKeeper":
+        await self.auth(refresh_token=self.refresh_token)
+
+        self._refresh_task = asyncio.create_task(self._keep_alive())
+
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+
+    async def auth(self, refresh_token: str | None = None) -> None:
+        # without refresh_token, the latest one issued to the session is used
+        token: Any = await asyncio.to_thread(self.api.auth, refresh_token=refresh_token)
+
+        expires_in = token.response.expires_in if token is not None else None
+        self._expires_in = float(expires_in or 3600)
+
+    async def _keep_alive(self) -> None:
+        refresh_after = self._expires_in - self.refresh_margin
+        while True:
+            await asyncio.sleep(max(refresh_after, self.retry_interval))
+
+            try:
+                await self.auth()
+            except Exception as error:
+                logger.error("Failed to refresh access token")
+                logger.exception(error)
+
+                refresh_after = self.retry_interval
+                continue
+
+            logger.info("Refreshed access token")
+            refresh_after = self._expires_in - self.refresh_margin
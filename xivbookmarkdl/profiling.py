@@ -0,0 +1,204 @@
+import asyncio
+import cProfile
+import json
+import math
+import threading
+import time
+from collections.abc import Awaitable, Callable, Iterator
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from typing import Any, ParamSpec, TypeVar
+
+from pydantic import BaseModel
+
+from .progress import emit_progress
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+
+class SpanSummary(BaseModel):
+    name: str
+    count: int
+    total_seconds: float
+    p50_seconds: float
+    p95_seconds: float
+    max_seconds: float
+
+
+def get_percentile(sorted_values: list[float], percentile: float) -> float:
+    # nearest-rank percentile
+    rank = math.ceil(percentile / 100 * len(sorted_values))
+
+    return sorted_values[max(rank, 1) - 1]
+
+
+# records named timing spans of the crawl stages while enabled.
+# spans of concurrent downloads overlap, so their totals can exceed the wall time
+class Profiler:
+    def __init__(self) -> None:
+        self.enabled = False
+
+        self._durations: dict[str, list[float]] = {}
+        # Chrome trace events, only recorded when a trace file is requested
+        self._trace_events: list[dict[str, Any]] | None = None
+        self._track_ids: dict[int, int] = {}
+        self._started_at = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def start(self, trace: bool = False) -> None:
+        self.enabled = True
+
+        self._durations = {}
+        self._trace_events = [] if trace else None
+        self._track_ids = {}
+        self._started_at = time.perf_counter()
+
+    def stop(self) -> None:
+        self.enabled = False
+
+    def _get_track_id(self) -> int:
+        # one track per asyncio task (or thread) in the trace viewer
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+
+        owner_id = id(task) if task is not None else threading.get_ident()
+
+        return self._track_ids.setdefault(owner_id, len(self._track_ids) + 1)
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started_at
+
+            with self._lock:
+                self._durations.setdefault(name, []).append(duration)
+
+                if self._trace_events is not None:
+                    self._trace_events.append(
+                        {
+                            "name": name,
+                            "ph": "X",
+                            "ts": (started_at - self._started_at) * 1_000_000,
+                            "dur": duration * 1_000_000,
+                            "pid": 1,
+                            "tid": self._get_track_id(),
+                        }
+                    )
+
+    def summarize(self) -> list[SpanSummary]:
+        with self._lock:
+            durations_by_name = {
+                name: sorted(durations) for name, durations in self._durations.items()
+            }
+
+        return [
+            SpanSummary(
+                name=name,
+                count=len(durations),
+                total_seconds=sum(durations),
+                p50_seconds=get_percentile(durations, 50),
+                p95_seconds=get_percentile(durations, 95),
+                max_seconds=durations[-1],
+            )
+            for name, durations in sorted(durations_by_name.items())
+        ]
+
+    def write_trace(self, trace_path: Path) -> None:
+        with self._lock:
+            trace_events = list(self._trace_events or [])
+
+        trace_path.parent.mkdir(parents=True, exist_ok=True)
+        with trace_path.open(mode="w", encoding="utf-8") as fp:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, fp)
+
+
+PROFILER = Profiler()
+
+
+def profiled(
+    name: str,
+) -> Callable[[Callable[P, Awaitable[T]]], Callable[P, Awaitable[T]]]:
+    # wraps a coroutine function in a span
+    def decorator(func: Callable[P, Awaitable[T]]) -> Callable[P, Awaitable[T]]:
+        @wraps(func)
+        async def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+            with PROFILER.span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def format_span_summaries(
+    span_summaries: list[SpanSummary], wall_seconds: float
+) -> str:
+    lines = [
+        f"Profile (wall: {wall_seconds:.3f}s)",
+        f"{'span':<16} {'count':>8} {'total s':>10} {'p50 ms':>10} {'p95 ms':>10} "
+        f"{'max ms':>10}",
+    ]
+    for span_summary in span_summaries:
+        lines.append(
+            f"{span_summary.name:<16} {span_summary.count:>8} "
+            f"{span_summary.total_seconds:>10.3f} "
+            f"{span_summary.p50_seconds * 1000:>10.1f} "
+            f"{span_summary.p95_seconds * 1000:>10.1f} "
+            f"{span_summary.max_seconds * 1000:>10.1f}"
+        )
+
+    return "\n".join(lines)
+
+
+@contextmanager
+def profile_run(
+    enabled: bool,
+    cprofile_path: Path | None = None,
+    trace_path: Path | None = None,
+) -> Iterator[None]:
+    # a file option implies profiling
+    if not enabled and cprofile_path is None and trace_path is None:
+        yield
+        return
+
+    PROFILER.start(trace=trace_path is not None)
+
+    # cProfile sees only the event loop thread, not the API and storage threads
+    cprofile = cProfile.Profile() if cprofile_path is not None else None
+    if cprofile is not None:
+        cprofile.enable()
+
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall_seconds = time.perf_counter() - started_at
+
+        if cprofile is not None and cprofile_path is not None:
+            cprofile.disable()
+            cprofile_path.parent.mkdir(parents=True, exist_ok=True)
+            cprofile.dump_stats(cprofile_path)
+
+        PROFILER.stop()
+
+        if trace_path is not None:
+            PROFILER.write_trace(trace_path)
+
+        span_summaries = PROFILER.summarize()
+        emit_progress(
+            "profile_summary",
+            format_span_summaries(span_summaries, wall_seconds=wall_seconds),
+            wall_seconds=wall_seconds,
+            spans=[span_summary.model_dump() for span_summary in span_summaries],
+        )
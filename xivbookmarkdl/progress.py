@@ -0,0 +1,29 @@
+import json
+import sys
+from datetime import UTC, datetime
+from typing import Any, Literal
+
+ProgressFormat = Literal["text", "json"]
+
+_progress_format: ProgressFormat = "text"
+
+
+def set_progress_format(progress_format: ProgressFormat) -> None:
+    global _progress_format
+    _progress_format = progress_format
+
+
+# progress is printed as a human readable line,
+# or as a JSON line with the event name and its fields for log collectors
+def emit_progress(event: str, message: str, **fields: Any) -> None:
+    if _progress_format == "json":
+        record = {
+            "time": datetime.now(UTC).isoformat(),
+            "event": event,
+            **fields,
+        }
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+        sys.stdout.flush()
+        return
+
+    print(message)
@@ -0,0 +1,135 @@
+import asyncio
+import random
+import time
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+class RetryLimitExceededError(Exception):
+    pass
+
+
+# token bucket whose rate is adjusted by AIMD:
+# additive increase on success, multiplicative decrease on rate limit
+class AdaptiveTokenBucket:
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        min_rate: float,
+        max_rate: float,
+        increase_step: float,
+        decrease_factor: float = 0.5,
+        burst: float = 1.0,
+        jitter: float = 0.2,
+    ):
+        if not 0 < min_rate <= rate <= max_rate:
+            raise ValueError("rate must satisfy 0 < min_rate <= rate <= max_rate")
+
+        if not 0 < decrease_factor < 1:
+            raise ValueError("decrease_factor must be between 0 and 1")
+
+        self.name = name
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.burst = burst
+        self.jitter = jitter
+
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.burst, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    async def acquire(self) -> None:
+        # waiters are served one by one to keep the order of requests
+        async with self._lock:
+            self._refill()
+
+            if self._tokens < 1:
+                wait_seconds = (1 - self._tokens) / self.rate
+                await asyncio.sleep(wait_seconds * random.uniform(1, 1 + self.jitter))
+                self._refill()
+
+            # tokens can go negative if the rate has been decreased while waiting,
+            # the debt is paid by the next waiter
+            self._tokens -= 1
+
+    def on_success(self) -> None:
+        self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_rate_limited(self) -> None:
+        # tokens saved until now are refilled at the old rate and then dropped,
+        # not to send a burst right after the rate limit
+        self._refill()
+        self._tokens = min(self._tokens, 0)
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+
+        logger.warning(f"Rate limited ({self.name}), slow down to {self.rate:.3f}/s")
+
+
+# shared pacing of pixiv API calls and image downloads
+class RateLimiter:
+    def __init__(
+        self,
+        api: AdaptiveTokenBucket,
+        download: AdaptiveTokenBucket,
+        retry_interval: float,
+        max_retries: int,
+    ):
+        self.api = api
+        self.download = download
+        self.retry_interval = retry_interval
+        self.max_retries = max_retries
+
+    @classmethod
+    def from_intervals(
+        cls,
+        page_interval: float,
+        download_interval: float,
+        retry_interval: float,
+        max_retries: int,
+        download_concurrency: int = 1,
+        download_interval_per_worker: bool = False,
+    ) -> "RateLimiter":
+        # intervals are used as initial pacing,
+        # rates can go up to 4x faster and down to 8x slower.
+        # downloads share the download interval unless it is applied
+        # to each of the concurrent downloads
+        api_rate = 1 / max(page_interval, 0.001)
+        download_workers = download_concurrency if download_interval_per_worker else 1
+        download_rate = download_workers / max(download_interval, 0.001)
+
+        return cls(
+            api=AdaptiveTokenBucket(
+                name="api",
+                rate=api_rate,
+                min_rate=api_rate / 8,
+                max_rate=api_rate * 4,
+                increase_step=api_rate / 10,
+            ),
+            download=AdaptiveTokenBucket(
+                name="download",
+                rate=download_rate,
+                min_rate=download_rate / 8,
+                max_rate=download_rate * 4,
+                increase_step=download_rate / 10,
+                burst=download_workers,
+            ),
+            retry_interval=retry_interval,
+            max_retries=max_retries,
+        )
+
+    async def backoff(self, retry_index: int) -> None:
+        # exponential backoff with jitter
+        backoff_seconds = self.retry_interval * (2**retry_index)
+        await asyncio.sleep(backoff_seconds * random.uniform(0.5, 1.5))
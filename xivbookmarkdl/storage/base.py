@@ -1,19 +1,120 @@
+import asyncio
 from abc import ABC, abstractmethod
-from collections.abc import AsyncIterator
+from collections.abc import AsyncIterable, AsyncIterator, Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import AbstractAsyncContextManager
+from dataclasses import dataclass
+from functools import partial
 from pathlib import Path
+from types import TracebackType
+from typing import Literal, ParamSpec, Self, TypeVar
+
+P = ParamSpec("P")
+T = TypeVar("T")
+
+# アップロード時にオブジェクトストレージ側で検証させるチェックサム
+ChecksumAlgorithm = Literal["none", "CRC32", "CRC32C", "SHA1", "SHA256"]
 
 
 class StorageDownloadNotFoundError(Exception):
     pass
 
 
+@dataclass(frozen=True)
+class StorageObject:
+    key: str
+    size: int
+    # 内容が書き換えられると変わる識別子 (S3 の ETag など)
+    etag: str | None = None
+    # ハードリンクなど同じ実体を共有するオブジェクトで一致する識別子
+    file_id: str | None = None
+
+
+# バックエンドのブロッキングする I/O を専用のスレッドプールで実行する
+# 既定のスレッドプールを画像のダウンロードなどと奪い合わず、
+# 同時に実行される I/O の数はスレッド数で上限が決まる
+class StorageExecutor:
+    def __init__(self, max_workers: int, thread_name_prefix: str):
+        self.max_workers = max_workers
+        self.thread_name_prefix = thread_name_prefix
+
+        # close 後に再び使われた場合は作り直す
+        self._executor: ThreadPoolExecutor | None = None
+
+    async def run(self, func: Callable[P, T], *args: P.args, **kwargs: P.kwargs) -> T:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix=self.thread_name_prefix,
+            )
+
+        loop = asyncio.get_running_loop()
+
+        return await loop.run_in_executor(
+            self._executor, partial(func, *args, **kwargs)
+        )
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+
 class Storage(ABC):
+    # link が内容を複製せずに共有するか (False ならストレージ内でコピーする)
+    link_shares_data: bool = False
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        await self.close()
+
+    @abstractmethod
+    async def delete(self, key: str) -> None: ...
+
+    @abstractmethod
+    async def close(self) -> None: ...
+
     @abstractmethod
     def iter_with_prefix(self, prefix: str) -> AsyncIterator[str]: ...
 
+    @abstractmethod
+    def list_tree(self, prefix: str) -> AsyncIterator[StorageObject]: ...
+
+    @abstractmethod
+    async def exists_many(self, keys: Iterable[str]) -> set[str]: ...
+
+    # the yielded path may be the stored file itself, so it must not be modified
     @abstractmethod
     def download(self, key: str) -> AbstractAsyncContextManager[Path]: ...
 
+    # 書き込みは書き込んだオブジェクトを返す
+    @abstractmethod
+    async def upload(self, source_path: Path, dest_key: str) -> StorageObject: ...
+
+    @abstractmethod
+    async def upload_stream(
+        self, dest_key: str, chunks: AsyncIterable[bytes]
+    ) -> StorageObject: ...
+
+    # 小さいオブジェクトを一時ファイルを経由せずにメモリ上で読み書きする
+    # 読み込みはバックエンドごとに StorageExecutor 上で実装する
+    @abstractmethod
+    async def read_bytes(self, key: str) -> bytes: ...
+
+    async def upload_bytes(self, dest_key: str, data: bytes) -> StorageObject:
+        async def iter_chunks() -> AsyncIterator[bytes]:
+            yield data
+
+        return await self.upload_stream(dest_key=dest_key, chunks=iter_chunks())
+
+    # source_key と同じ内容を dest_key から参照できるようにする
+    # (source_key が存在しない場合は StorageDownloadNotFoundError)
     @abstractmethod
-    async def upload(self, source_path: Path, dest_key: str) -> None: ...
+    async def link(self, source_key: str, dest_key: str) -> StorageObject: ...
@@ -1,49 +1,237 @@
-import asyncio
+import os
 import shutil
-from collections.abc import AsyncIterator
+from collections.abc import AsyncIterable, AsyncIterator, Iterable
 from contextlib import asynccontextmanager
 from pathlib import Path
-from tempfile import TemporaryDirectory
+from tempfile import NamedTemporaryFile
+from typing import IO
+from uuid import uuid4
 
-from .base import Storage, StorageDownloadNotFoundError
+from .base import (
+    Storage,
+    StorageDownloadNotFoundError,
+    StorageExecutor,
+    StorageObject,
+)
+
+
+def is_tmp_filename(filename: str) -> bool:
+    # アップロード途中の一時ファイル: .{name}.{random}.tmp
+    return filename.startswith(".") and filename.endswith(".tmp")
 
 
 class StorageFilesystem(Storage):
+    link_shares_data = True
+
     def __init__(
         self,
         root_dir: Path,
+        io_concurrency: int = 8,
     ):
         self.root_dir = root_dir
 
+        self._executor = StorageExecutor(
+            max_workers=io_concurrency, thread_name_prefix="storage-filesystem"
+        )
+
     async def iter_with_prefix(self, prefix: str) -> AsyncIterator[str]:
-        for p in self.root_dir.glob(f"{prefix}*"):
-            yield str(p.relative_to(self.root_dir))
+        async for obj in self.list_tree(prefix=prefix):
+            yield obj.key
+
+    async def list_tree(self, prefix: str) -> AsyncIterator[StorageObject]:
+        # S3と同様に、prefixで始まるすべてのファイルを再帰的に列挙する
+        # ディレクトリの走査はイベントループを止めないようにスレッドで行い、
+        # 直下のエントリごとにまとめて返す
+        parent_key, _, name_prefix = prefix.rpartition("/")
+        parent_dir = self.root_dir / parent_key
+
+        paths = await self._executor.run(self._list_dir, parent_dir, name_prefix)
+
+        for p in paths:
+            for obj in await self._executor.run(self._list_subtree, p):
+                yield obj
+
+    def _list_dir(self, parent_dir: Path, name_prefix: str) -> list[Path]:
+        try:
+            paths = sorted(parent_dir.iterdir())
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+
+        return [
+            p
+            for p in paths
+            if p.name.startswith(name_prefix) and not is_tmp_filename(p.name)
+        ]
+
+    def _list_subtree(self, path: Path) -> list[StorageObject]:
+        if not path.is_dir():
+            obj = self._to_storage_object(path)
+            return [obj] if obj is not None else []
+
+        objs: list[StorageObject] = []
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if is_tmp_filename(filename):
+                    continue
+
+                obj = self._to_storage_object(Path(dirpath) / filename)
+                if obj is not None:
+                    objs.append(obj)
+
+        return objs
+
+    def _to_storage_object(self, path: Path) -> StorageObject | None:
+        # 列挙中に削除・置き換えられたファイルは None を返す
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+
+        return self._make_storage_object(dest_path=path, stat=stat)
+
+    def _make_storage_object(
+        self, dest_path: Path, stat: os.stat_result
+    ) -> StorageObject:
+        return StorageObject(
+            key=dest_path.relative_to(self.root_dir).as_posix(),
+            size=stat.st_size,
+            # 書き込みはリネームで行うため、内容が変われば更新時刻も変わる
+            etag=f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"',
+            file_id=f"{stat.st_dev}:{stat.st_ino}",
+        )
+
+    async def exists_many(self, keys: Iterable[str]) -> set[str]:
+        def get_existing_keys() -> set[str]:
+            return {key for key in keys if (self.root_dir / key).is_file()}
+
+        return await self._executor.run(get_existing_keys)
 
     @asynccontextmanager
     async def download(self, key: str) -> AsyncIterator[Path]:
-        with TemporaryDirectory() as _tmpdir:
-            tmpdir = Path(_tmpdir)
+        file = self.root_dir / key
+
+        # コピーせずに実ファイルのパスを返す (呼び出し側は読み取り専用として扱う)
+        # 書き込みは一時ファイルからのリネームで行うため、読み取り中に内容は変わらない
+        if not await self._executor.run(file.is_file):
+            raise StorageDownloadNotFoundError(key)
+
+        yield file
+
+    async def read_bytes(self, key: str) -> bytes:
+        try:
+            return await self._executor.run((self.root_dir / key).read_bytes)
+        except (FileNotFoundError, IsADirectoryError) as error:
+            raise StorageDownloadNotFoundError(key) from error
+
+    async def upload_bytes(self, dest_key: str, data: bytes) -> StorageObject:
+        dest_path = self.root_dir / dest_key
+
+        return await self._executor.run(self._write_bytes_atomic, data, dest_path)
 
-            file = tmpdir / "a"
+    def _write_bytes_atomic(self, data: bytes, dest_path: Path) -> StorageObject:
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = dest_path.parent / f".{dest_path.name}.{uuid4().hex}.tmp"
+
+        try:
+            tmp_path.write_bytes(data)
+            return self._replace(tmp_path=tmp_path, dest_path=dest_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def _replace(self, tmp_path: Path, dest_path: Path) -> StorageObject:
+        # リネーム後に置き換えられても、書き込んだファイルの情報を返す
+        stat = tmp_path.stat()
+        os.replace(tmp_path, dest_path)
+
+        return self._make_storage_object(dest_path=dest_path, stat=stat)
+
+    async def upload(self, source_path: Path, dest_key: str) -> StorageObject:
+        dest_path = self.root_dir / dest_key
+
+        # 呼び出し元のファイルは後で書き換えられうるため、リンクせずにコピーする
+        # (Linux では copyfile はカーネル内でコピーする)
+        return await self._executor.run(self._copy_atomic, source_path, dest_path)
+
+    def _copy_atomic(self, source_path: Path, dest_path: Path) -> StorageObject:
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = dest_path.parent / f".{dest_path.name}.{uuid4().hex}.tmp"
+
+        try:
+            shutil.copyfile(source_path, tmp_path)
+
+            return self._replace(tmp_path=tmp_path, dest_path=dest_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
 
+    def _link_or_copy_atomic(self, source_path: Path, dest_path: Path) -> StorageObject:
+        dest_path.parent.mkdir(parents=True, exist_ok=True)
+
+        tmp_path = dest_path.parent / f".{dest_path.name}.{uuid4().hex}.tmp"
+
+        try:
             try:
-                await asyncio.to_thread(
-                    shutil.copyfile,
-                    self.root_dir / key,
-                    file,
-                )
-            except FileNotFoundError as error:
-                raise StorageDownloadNotFoundError from error
+                # 同じファイルシステム上であれば、データをコピーせずにハードリンクする
+                os.link(source_path, tmp_path)
+            except OSError:
+                # 別デバイスなどでリンクできない場合はコピーする
+                shutil.copyfile(source_path, tmp_path)
 
-            yield file
+            return self._replace(tmp_path=tmp_path, dest_path=dest_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
 
-    async def upload(self, source_path: Path, dest_key: str) -> None:
+    async def upload_stream(
+        self, dest_key: str, chunks: AsyncIterable[bytes]
+    ) -> StorageObject:
         dest_path = self.root_dir / dest_key
 
+        # 書き込み途中のファイルが見えないように、同じディレクトリの一時ファイルに
+        # 書き込んでからリネームする
+        tmp_file = await self._executor.run(self._create_tmp_file, dest_path)
+        tmp_path = Path(tmp_file.name)
+
+        try:
+            with tmp_file:
+                async for chunk in chunks:
+                    await self._executor.run(tmp_file.write, chunk)
+
+            return await self._executor.run(
+                self._replace, tmp_path=tmp_path, dest_path=dest_path
+            )
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def _create_tmp_file(self, dest_path: Path) -> IO[bytes]:
         dest_path.parent.mkdir(parents=True, exist_ok=True)
 
-        await asyncio.to_thread(
-            shutil.copyfile,
-            source_path,
-            dest_path,
+        return NamedTemporaryFile(
+            mode="wb",
+            dir=dest_path.parent,
+            prefix=f".{dest_path.name}.",
+            suffix=".tmp",
+            delete=False,
         )
+
+    async def link(self, source_key: str, dest_key: str) -> StorageObject:
+        source_path = self.root_dir / source_key
+        dest_path = self.root_dir / dest_key
+
+        if not await self._executor.run(source_path.is_file):
+            raise StorageDownloadNotFoundError(source_key)
+
+        return await self._executor.run(
+            self._link_or_copy_atomic, source_path, dest_path
+        )
+
+    async def delete(self, key: str) -> None:
+        await self._executor.run((self.root_dir / key).unlink, missing_ok=True)
+
+    async def close(self) -> None:
+        self._executor.shutdown()
@@ -0,0 +1,81 @@
+from collections.abc import AsyncIterable, AsyncIterator, Iterable, Iterator
+from contextlib import AsyncExitStack, asynccontextmanager, contextmanager
+from pathlib import Path
+
+from ..metrics import STORAGE_ERRORS, STORAGE_OPERATION_SECONDS
+from .base import Storage, StorageDownloadNotFoundError, StorageObject
+
+
+# 各操作の所要時間と失敗をバックエンドごとに記録するプロキシ
+class MeteredStorage(Storage):
+    def __init__(self, storage: Storage, backend: str):
+        self.storage = storage
+        self.backend = backend
+        self.link_shares_data = storage.link_shares_data
+
+    @contextmanager
+    def _measure(self, operation: str) -> Iterator[None]:
+        with STORAGE_OPERATION_SECONDS.time(backend=self.backend, operation=operation):
+            try:
+                yield
+            except StorageDownloadNotFoundError:
+                # 存在しないキーの参照は失敗として数えない
+                raise
+            except Exception:
+                STORAGE_ERRORS.inc(backend=self.backend, operation=operation)
+                raise
+
+    async def delete(self, key: str) -> None:
+        with self._measure("delete"):
+            await self.storage.delete(key=key)
+
+    async def close(self) -> None:
+        await self.storage.close()
+
+    # 一覧は最後まで列挙するまでの時間を記録する
+    async def iter_with_prefix(self, prefix: str) -> AsyncIterator[str]:
+        with self._measure("list"):
+            async for key in self.storage.iter_with_prefix(prefix=prefix):
+                yield key
+
+    async def list_tree(self, prefix: str) -> AsyncIterator[StorageObject]:
+        with self._measure("list"):
+            async for obj in self.storage.list_tree(prefix=prefix):
+                yield obj
+
+    async def exists_many(self, keys: Iterable[str]) -> set[str]:
+        with self._measure("exists_many"):
+            return await self.storage.exists_many(keys=keys)
+
+    @asynccontextmanager
+    async def download(self, key: str) -> AsyncIterator[Path]:
+        async with AsyncExitStack() as exit_stack:
+            # 呼び出し側がファイルを使う時間は含めない
+            with self._measure("download"):
+                file = await exit_stack.enter_async_context(
+                    self.storage.download(key=key)
+                )
+
+            yield file
+
+    async def upload(self, source_path: Path, dest_key: str) -> StorageObject:
+        with self._measure("upload"):
+            return await self.storage.upload(source_path=source_path, dest_key=dest_key)
+
+    async def upload_stream(
+        self, dest_key: str, chunks: AsyncIterable[bytes]
+    ) -> StorageObject:
+        with self._measure("upload_stream"):
+            return await self.storage.upload_stream(dest_key=dest_key, chunks=chunks)
+
+    async def read_bytes(self, key: str) -> bytes:
+        with self._measure("read_bytes"):
+            return await self.storage.read_bytes(key=key)
+
+    async def upload_bytes(self, dest_key: str, data: bytes) -> StorageObject:
+        with self._measure("upload_bytes"):
+            return await self.storage.upload_bytes(dest_key=dest_key, data=data)
+
+    async def link(self, source_key: str, dest_key: str) -> StorageObject:
+        with self._measure("link"):
+            return await self.storage.link(source_key=source_key, dest_key=dest_key)
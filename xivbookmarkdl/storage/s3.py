@@ -1,18 +1,49 @@
 import asyncio
-from collections.abc import AsyncIterator
+from collections.abc import AsyncIterable, AsyncIterator, Iterable
 from contextlib import asynccontextmanager
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any
 
 import boto3
 import botocore.exceptions
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
 
-from .base import Storage, StorageDownloadNotFoundError
+from .base import (
+    ChecksumAlgorithm,
+    Storage,
+    StorageDownloadNotFoundError,
+    StorageExecutor,
+    StorageObject,
+)
 
 if TYPE_CHECKING:
     from mypy_boto3_s3 import S3Client
+    from mypy_boto3_s3.type_defs import CompletedPartTypeDef, UploadPartOutputTypeDef
+
+MIB = 1024 * 1024
+
+
+def get_completed_part(
+    part: "UploadPartOutputTypeDef", part_number: int
+) -> "CompletedPartTypeDef":
+    completed_part: CompletedPartTypeDef = {
+        "ETag": part["ETag"],
+        "PartNumber": part_number,
+    }
+
+    # チェックサム付きでアップロードしたパートは、完了時にもチェックサムを渡す
+    if "ChecksumCRC32" in part:
+        completed_part["ChecksumCRC32"] = part["ChecksumCRC32"]
+    if "ChecksumCRC32C" in part:
+        completed_part["ChecksumCRC32C"] = part["ChecksumCRC32C"]
+    if "ChecksumSHA1" in part:
+        completed_part["ChecksumSHA1"] = part["ChecksumSHA1"]
+    if "ChecksumSHA256" in part:
+        completed_part["ChecksumSHA256"] = part["ChecksumSHA256"]
+
+    return completed_part
 
 
 class StorageS3(Storage):
@@ -26,6 +57,14 @@ class StorageS3(Storage):
         aws_access_key_id: str | None,
         aws_secret_access_key: str | None,
         aws_session_token: str | None,
+        max_pool_connections: int = 10,
+        io_concurrency: int | None = None,
+        # 最後以外のパートは5MiB以上が必要
+        multipart_threshold: int = 8 * MIB,
+        multipart_chunksize: int = 8 * MIB,
+        # 1つのオブジェクトのパートを同時にアップロード・ダウンロードする数
+        transfer_concurrency: int = 10,
+        checksum_algorithm: ChecksumAlgorithm = "CRC32",
     ):
         self.bucket_name = bucket_name
         self.prefix = prefix
@@ -35,6 +74,35 @@ class StorageS3(Storage):
         self.aws_access_key_id = aws_access_key_id
         self.aws_secret_access_key = aws_secret_access_key
         self.aws_session_token = aws_session_token
+        self.max_pool_connections = max_pool_connections
+        self.multipart_threshold = multipart_threshold
+        self.multipart_chunksize = multipart_chunksize
+        self.transfer_concurrency = transfer_concurrency
+        self.checksum_algorithm = checksum_algorithm
+
+        # upload_file と download_file も upload_stream と同じ設定で転送する
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=transfer_concurrency,
+        )
+
+        self._s3_client: S3Client | None = None
+
+        # boto3 は同期 API なので、専用のスレッドプールで呼び出す
+        # 既定ではコネクションプールと同じ数だけ同時に実行する
+        self._executor = StorageExecutor(
+            max_workers=io_concurrency or max_pool_connections,
+            thread_name_prefix="storage-s3",
+        )
+
+    def _get_s3_client(self) -> "S3Client":
+        # クライアントはスレッドセーフなので、
+        # 1つのクライアントとコネクションプールを使い回す
+        if self._s3_client is None:
+            self._s3_client = self._create_s3_client()
+
+        return self._s3_client
 
     def _create_s3_client(self) -> "S3Client":
         return boto3.client(
@@ -45,18 +113,193 @@ class StorageS3(Storage):
             aws_secret_access_key=self.aws_secret_access_key,
             aws_session_token=self.aws_session_token,
             config=Config(
-                s3={"addressing_style": "path" if self.force_path_style else "auto"}
+                s3={"addressing_style": "path" if self.force_path_style else "auto"},
+                max_pool_connections=self.max_pool_connections,
+                # none の場合は、チェックサムに対応しない S3 互換ストレージのために
+                # 必須の操作以外でチェックサムを計算・検証しない
+                request_checksum_calculation=(
+                    "when_required"
+                    if self.checksum_algorithm == "none"
+                    else "when_supported"
+                ),
+                response_checksum_validation=(
+                    "when_required"
+                    if self.checksum_algorithm == "none"
+                    else "when_supported"
+                ),
             ),
         )
 
+    # アップロード時にチェックサムを送る引数
+    @property
+    def _checksum_upload_args(self) -> dict[str, Any]:
+        if self.checksum_algorithm == "none":
+            return {}
+
+        return {"ChecksumAlgorithm": self.checksum_algorithm}
+
+    # ダウンロード時に保存されたチェックサムで検証する引数
+    @property
+    def _checksum_download_args(self) -> dict[str, Any]:
+        if self.checksum_algorithm == "none":
+            return {}
+
+        return {"ChecksumMode": "ENABLED"}
+
+    async def upload_stream(
+        self, dest_key: str, chunks: AsyncIterable[bytes]
+    ) -> StorageObject:
+        s3_client = self._get_s3_client()
+
+        bucket_dest_key = self.prefix + dest_key if self.prefix else dest_key
+
+        size = 0
+        buffer = bytearray()
+        upload_id: str | None = None
+        part_tasks: list[asyncio.Task[CompletedPartTypeDef]] = []
+
+        # 同時にアップロードするパートの数を制限し、バッファするパートの数も抑える
+        part_semaphore = asyncio.Semaphore(self.transfer_concurrency)
+
+        async def upload_part(
+            upload_id: str, part_number: int, body: bytes
+        ) -> "CompletedPartTypeDef":
+            try:
+                part = await self._executor.run(
+                    s3_client.upload_part,
+                    Bucket=self.bucket_name,
+                    Key=bucket_dest_key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=body,
+                    **self._checksum_upload_args,
+                )
+            finally:
+                part_semaphore.release()
+
+            return get_completed_part(part=part, part_number=part_number)
+
+        async def start_part(upload_id: str, body: bytes) -> None:
+            await part_semaphore.acquire()
+
+            # 失敗したパートがあれば、残りを読まずに中断する
+            for part_task in part_tasks:
+                if part_task.done() and part_task.exception() is not None:
+                    part_semaphore.release()
+                    await part_task
+
+            part_tasks.append(
+                asyncio.create_task(
+                    upload_part(
+                        upload_id=upload_id,
+                        part_number=len(part_tasks) + 1,
+                        body=body,
+                    )
+                )
+            )
+
+        try:
+            async for chunk in chunks:
+                buffer += chunk
+                size += len(chunk)
+
+                if upload_id is None and len(buffer) >= self.multipart_threshold:
+                    multipart_upload = await self._executor.run(
+                        s3_client.create_multipart_upload,
+                        Bucket=self.bucket_name,
+                        Key=bucket_dest_key,
+                        **self._checksum_upload_args,
+                    )
+                    upload_id = multipart_upload["UploadId"]
+
+                while upload_id is not None and (
+                    len(buffer) >= self.multipart_chunksize
+                ):
+                    await start_part(
+                        upload_id=upload_id,
+                        body=bytes(buffer[: self.multipart_chunksize]),
+                    )
+
+                    del buffer[: self.multipart_chunksize]
+
+            if upload_id is None:
+                # しきい値未満の小さいファイルは1回のPUTでアップロードする
+                put_result = await self._executor.run(
+                    s3_client.put_object,
+                    Bucket=self.bucket_name,
+                    Key=bucket_dest_key,
+                    Body=bytes(buffer),
+                    **self._checksum_upload_args,
+                )
+                return StorageObject(
+                    key=dest_key, size=size, etag=put_result.get("ETag")
+                )
+
+            if len(buffer) > 0 or len(part_tasks) == 0:
+                await start_part(upload_id=upload_id, body=bytes(buffer))
+
+            parts = await asyncio.gather(*part_tasks)
+
+            complete_result = await self._executor.run(
+                s3_client.complete_multipart_upload,
+                Bucket=self.bucket_name,
+                Key=bucket_dest_key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            for part_task in part_tasks:
+                part_task.cancel()
+            await asyncio.gather(*part_tasks, return_exceptions=True)
+
+            # 途中で失敗した場合は、アップロード済みのパートを破棄する
+            if upload_id is not None:
+                await self._executor.run(
+                    s3_client.abort_multipart_upload,
+                    Bucket=self.bucket_name,
+                    Key=bucket_dest_key,
+                    UploadId=upload_id,
+                )
+            raise
+
+        return StorageObject(key=dest_key, size=size, etag=complete_result.get("ETag"))
+
+    async def delete(self, key: str) -> None:
+        s3_client = self._get_s3_client()
+
+        bucket_key = self.prefix + key if self.prefix else key
+
+        await self._executor.run(
+            s3_client.delete_object,
+            Bucket=self.bucket_name,
+            Key=bucket_key,
+        )
+
+    async def close(self) -> None:
+        if self._s3_client is not None:
+            self._s3_client.close()
+            self._s3_client = None
+
+        self._executor.shutdown()
+
     async def iter_with_prefix(self, prefix: str) -> AsyncIterator[str]:
-        s3_client = self._create_s3_client()
+        async for obj in self.list_tree(prefix=prefix):
+            yield obj.key
+
+    async def list_tree(self, prefix: str) -> AsyncIterator[StorageObject]:
+        s3_client = self._get_s3_client()
 
         paginator = s3_client.get_paginator("list_objects_v2")
 
         bucket_prefix = self.prefix + prefix if self.prefix else prefix
 
-        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=bucket_prefix):
+        # ページの取得はブロッキングするので、イベントループの外で1ページずつ進める
+        pages = iter(paginator.paginate(Bucket=self.bucket_name, Prefix=bucket_prefix))
+        while True:
+            page = await self._executor.run(next, pages, None)
+            if page is None:
+                break
+
             if "Contents" not in page:
                 continue
 
@@ -64,11 +307,36 @@ class StorageS3(Storage):
                 if "Key" not in obj:
                     continue
 
-                yield obj["Key"]
+                # Storageのキーとして返すため、バケット内のprefixを取り除く
+                key = obj["Key"]
+                if self.prefix:
+                    key = key.removeprefix(self.prefix)
+
+                yield StorageObject(
+                    key=key,
+                    size=obj.get("Size", 0),
+                    etag=obj.get("ETag"),
+                )
+
+    async def exists_many(self, keys: Iterable[str]) -> set[str]:
+        # 同じディレクトリのキーをまとめて、ディレクトリごとに1回だけ一覧を取得する
+        keys_by_parent: dict[str, set[str]] = {}
+        for key in keys:
+            parent_key, _, _ = key.rpartition("/")
+            parent_prefix = parent_key + "/" if parent_key else ""
+            keys_by_parent.setdefault(parent_prefix, set()).add(key)
+
+        existing_keys: set[str] = set()
+        for parent_prefix, parent_keys in keys_by_parent.items():
+            async for obj in self.list_tree(prefix=parent_prefix):
+                if obj.key in parent_keys:
+                    existing_keys.add(obj.key)
+
+        return existing_keys
 
     @asynccontextmanager
     async def download(self, key: str) -> AsyncIterator[Path]:
-        s3_client = self._create_s3_client()
+        s3_client = self._get_s3_client()
 
         with TemporaryDirectory() as _tmpdir:
             tmpdir = Path(_tmpdir)
@@ -78,11 +346,13 @@ class StorageS3(Storage):
             bucket_key = self.prefix + key if self.prefix else key
 
             try:
-                await asyncio.to_thread(
+                await self._executor.run(
                     s3_client.download_file,
                     Bucket=self.bucket_name,
                     Key=bucket_key,
                     Filename=str(file),
+                    ExtraArgs=self._checksum_download_args,
+                    Config=self.transfer_config,
                 )
             except botocore.exceptions.ClientError as error:
                 error_obj = error.response.get("Error", {})
@@ -98,14 +368,104 @@ class StorageS3(Storage):
 
             yield file
 
-    async def upload(self, source_path: Path, dest_key: str) -> None:
-        s3_client = self._create_s3_client()
+    async def read_bytes(self, key: str) -> bytes:
+        s3_client = self._get_s3_client()
+
+        bucket_key = self.prefix + key if self.prefix else key
+
+        def get_object_bytes() -> bytes:
+            response = s3_client.get_object(
+                Bucket=self.bucket_name,
+                Key=bucket_key,
+                **self._checksum_download_args,
+            )
+            with response["Body"] as body:
+                return body.read()
+
+        try:
+            return await self._executor.run(get_object_bytes)
+        except botocore.exceptions.ClientError as error:
+            error_code = error.response.get("Error", {}).get("Code", None)
+
+            # GetObject はキーが存在しない場合に NoSuchKey を返す
+            if error_code in ("NoSuchKey", "404"):
+                raise StorageDownloadNotFoundError(key) from error
+
+            raise
+
+    async def upload_bytes(self, dest_key: str, data: bytes) -> StorageObject:
+        if len(data) >= self.multipart_threshold:
+            # 大きいデータはファイルと同じくマルチパートでアップロードする
+            return await super().upload_bytes(dest_key=dest_key, data=data)
+
+        s3_client = self._get_s3_client()
 
         bucket_dest_key = self.prefix + dest_key if self.prefix else dest_key
 
-        await asyncio.to_thread(
+        put_result = await self._executor.run(
+            s3_client.put_object,
+            Bucket=self.bucket_name,
+            Key=bucket_dest_key,
+            Body=data,
+            **self._checksum_upload_args,
+        )
+
+        return StorageObject(key=dest_key, size=len(data), etag=put_result.get("ETag"))
+
+    async def upload(self, source_path: Path, dest_key: str) -> StorageObject:
+        s3_client = self._get_s3_client()
+
+        bucket_dest_key = self.prefix + dest_key if self.prefix else dest_key
+
+        await self._executor.run(
             s3_client.upload_file,
             Filename=str(source_path),
             Bucket=self.bucket_name,
             Key=bucket_dest_key,
+            ExtraArgs=self._checksum_upload_args,
+            Config=self.transfer_config,
+        )
+
+        # upload_file はレスポンスを返さないため、アップロードしたオブジェクトを取得する
+        return await self._head(key=dest_key)
+
+    async def _head(self, key: str) -> StorageObject:
+        s3_client = self._get_s3_client()
+
+        bucket_key = self.prefix + key if self.prefix else key
+
+        head_result = await self._executor.run(
+            s3_client.head_object, Bucket=self.bucket_name, Key=bucket_key
+        )
+
+        return StorageObject(
+            key=key,
+            size=head_result["ContentLength"],
+            etag=head_result.get("ETag"),
         )
+
+    async def link(self, source_key: str, dest_key: str) -> StorageObject:
+        s3_client = self._get_s3_client()
+
+        bucket_source_key = self.prefix + source_key if self.prefix else source_key
+        bucket_dest_key = self.prefix + dest_key if self.prefix else dest_key
+
+        # S3 にはリンクがないため、データを転送せずにバケット内でコピーする
+        try:
+            await self._executor.run(
+                s3_client.copy_object,
+                Bucket=self.bucket_name,
+                Key=bucket_dest_key,
+                CopySource={"Bucket": self.bucket_name, "Key": bucket_source_key},
+                **self._checksum_upload_args,
+            )
+        except botocore.exceptions.ClientError as error:
+            error_code = error.response.get("Error", {}).get("Code", None)
+
+            if error_code in ("NoSuchKey", "404"):
+                raise StorageDownloadNotFoundError(source_key) from error
+
+            raise
+
+        # CopyObject はサイズを返さないため、コピーしたオブジェクトを取得する
+        return await self._head(key=dest_key)